@@ -0,0 +1,90 @@
+'''
+批量模式: 一次处理多个sessionToken
+用法: python batch.py <tokens文件> [输出文件夹] [并发获取数]
+    tokens文件每行一个sessionToken, 也可以是每行带有"sessionToken"字段的jsonl
+    每个玩家的图片与result.txt输出至 输出文件夹/序号_昵称/
+'''
+
+import os
+import sys
+from json import loads
+from time import perf_counter
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from main import RksImageMaker, loadSettings, printwithcolor
+
+OUTPUT_FOLDER = 'batch_output'
+FETCH_WORKERS = 4       # 同时向云端请求存档的数量, 请勿过大
+
+maker : RksImageMaker = None
+
+def readTokens(path : str) -> list:
+    """读取tokens文件, 跳过空行与#注释"""
+    tokens = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'): continue
+            if line.startswith('{'):
+                line = loads(line).get('sessionToken', '')
+                if not line: continue
+            tokens.append(line)
+    return tokens
+
+def initWorker(settings : dict):
+    global maker
+    maker = RksImageMaker(settings, keepIllustrations=True)
+
+def renderWorker(folder : str, result : dict) -> str:
+    """在子进程中绘制图片并输出result.txt"""
+    os.makedirs(folder, exist_ok=True)
+    maker.writeResult(result, os.path.join(folder, 'result.txt'))
+    return maker.render(result, os.path.join(folder, f"result.{maker.settings['ResultPictureQuality'].lower()}"))
+
+def safeName(name : str) -> str:
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+
+def main():
+    global maker
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    tokens = readTokens(sys.argv[1])
+    outputFolder = sys.argv[2] if len(sys.argv) > 2 else OUTPUT_FOLDER
+    fetchWorkers = int(sys.argv[3]) if len(sys.argv) > 3 else FETCH_WORKERS
+    settings = loadSettings()
+    maker = RksImageMaker(settings)
+    if maker.atlas is not None: maker.atlas.build()     # 子进程启动前生成图集, 子进程直接映射
+    maker.prepareSongNames()                            # 同样先生成截断曲名的缓存
+
+    def fetchAndCompute(token):
+        save = maker.demo() if settings['yywMode'] else maker.fetch(token)
+        return maker.compute(save)
+
+    start = perf_counter()
+    done, failed = 0, 0
+    with Pool(os.cpu_count(), initWorker, (settings,)) as pool, ThreadPoolExecutor(fetchWorkers) as executor:
+        futures = {executor.submit(fetchAndCompute, token) : idx for idx, token in enumerate(tokens)}
+        jobs = []
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                printwithcolor(f'#{idx} 获取存档失败: {e}', [31])
+                continue
+            folder = os.path.join(outputFolder, f'{idx}_{safeName(result["nickname"])}')
+            jobs.append((idx, pool.apply_async(renderWorker, (folder, result))))
+        for idx, job in jobs:
+            try:
+                printwithcolor(f'#{idx} 已输出至{job.get()}', [36])
+                done += 1
+            except Exception as e:
+                failed += 1
+                printwithcolor(f'#{idx} 绘制失败: {e}', [31])
+    cost = perf_counter() - start
+    printwithcolor(f'完成{done}个, 失败{failed}个, 用时{cost:.2f}s, {done/cost if cost else 0:.2f} players/sec', [1,32])
+
+if __name__ == '__main__':
+    main()
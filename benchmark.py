@@ -0,0 +1,279 @@
+'''
+性能测试
+用法: python benchmark.py <项目> [参数]
+    background [scale]   对比原背景处理(LANCZOS+GaussianBlur)与降采样快速模式的用时和差异
+    bulk [players]       用随机生成的存档测试rks.bulkRks的吞吐量, 默认最多100000个玩家
+    shapes [renders]     对比逐个add_rounded_rectangle与批量叠加半透明框时两种布局每次绘制的用时, 默认5次
+    text [renders]       对比直接用ImageDraw绘制文字与使用文字遮罩缓存时每次绘制的用时, 默认5次
+    threads [renders]    成绩格子图块在1/2/4/8个线程中绘制的用时, MaxSongResultShowcase从39到全部谱面, 默认1次
+    full [pageRows]      MaxSongResultShowcase=-1时两种布局分条绘制的用时与峰值内存(RSS), 分别输出单张PNG与每页pageRows行的JPEG, 默认10行
+    startup [runs]       以python -X importtime在新进程中测量启动用时与各模块的导入用时, 默认10次取中位数
+'''
+
+import os
+import sys
+import random
+import subprocess
+from statistics import median
+from math import log10
+from time import perf_counter
+from PIL import Image, ImageChops, ImageStat
+
+STYLE_SIZES = {
+    0 : (3750, 1800),
+    1 : (1875, 3000),
+}
+SAMPLES = 5     # 参与测试的曲绘数量
+THREAD_COUNTS = (1, 2, 4, 8)
+THREAD_SHOWCASES = (39, 300)    # 另外再测试全部谱面
+FULL_RENDER = '''
+import sys, resource
+from json import loads, dumps
+from time import perf_counter
+import main
+settings = main.loadSettings()
+settings.update(loads(sys.argv[1]))
+maker = main.RksImageMaker(settings)
+result = maker.compute(maker.demo())
+start = perf_counter()
+output = maker.render(result, sys.argv[2], sys.argv[3])
+cost = perf_counter() - start
+print(dumps({'cost' : cost, 'rss' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, 'count' : len(result['b27']),
+             'outputs' : output if isinstance(output, list) else [output]}))
+'''
+BULK_CHUNK = 2000   # bulkRks每次处理的玩家数, 限制内存占用
+STARTUP_STAGES = {
+    'import main' : 'import main',
+    'RksImageMaker()' : 'import main; main.RksImageMaker()',
+    '加载全部字体' : 'import main; [main.FONT_CONFIG[i] for i in main.FONT_SPEC]',
+}
+
+def timeit(func, repeat : int = 1):
+    """返回(最短用时, 最后一次的返回值)"""
+    best, res = None, None
+    for _ in range(repeat):
+        start = perf_counter()
+        res = func()
+        cost = perf_counter() - start
+        best = cost if best is None else min(best, cost)
+    return best, res
+
+def imageDifference(a, b):
+    """返回(平均绝对误差, PSNR)"""
+    diff = ImageChops.difference(a, b)
+    stat = ImageStat.Stat(diff)
+    mae = sum(stat.mean) / len(stat.mean)
+    mse = sum(i*i for i in stat.rms) / len(stat.rms)
+    psnr = float('inf') if mse == 0 else 10 * log10(255 * 255 / mse)
+    return mae, psnr
+
+def benchBackground(scale : float = 0.25):
+    from main import makeBackground, BLUR_RADIUS
+    names = sorted(i for i in os.listdir('illustrationLowRes') if i.endswith('.png'))[:SAMPLES]
+    for style, target_size in STYLE_SIZES.items():
+        total_full, total_fast, total_mae, min_psnr = 0.0, 0.0, 0.0, float('inf')
+        for name in names:
+            img = Image.open(f'illustrationLowRes/{name}').convert('RGB')
+            cost_full, full = timeit(lambda: makeBackground(img, target_size, BLUR_RADIUS))
+            cost_fast, fast = timeit(lambda: makeBackground(img, target_size, BLUR_RADIUS, scale=scale))
+            mae, psnr = imageDifference(full, fast)
+            total_full += cost_full
+            total_fast += cost_fast
+            total_mae += mae
+            min_psnr = min(min_psnr, psnr)
+        n = len(names)
+        print(f'ImageStyle={style} {target_size[0]}x{target_size[1]} scale={scale}')
+        print(f'    LANCZOS+GaussianBlur: {total_full/n*1000:8.1f} ms')
+        print(f'    fast:                 {total_fast/n*1000:8.1f} ms  ({total_full/total_fast:.1f}x)')
+        print(f'    平均绝对误差 {total_mae/n:.3f}/255, 最低PSNR {min_psnr:.2f} dB')
+
+def randomRecords(rng, constant, players : int):
+    """随机存档: 约60%的谱面已游玩, 其中10%为AP, 30%为FC"""
+    import numpy as np
+    played = (rng.random((players, len(constant))) < 0.6) & (constant != 0)
+    acc = np.where(rng.random(played.shape) < 0.1, 100.0, rng.uniform(60, 100, played.shape))
+    acc = np.where(played, acc, 0.0)
+    records = np.empty((players, len(constant), 3))
+    records[:, :, 0] = np.floor(acc * 10000)
+    records[:, :, 1] = acc
+    records[:, :, 2] = played & ((acc == 100) | (rng.random(played.shape) < 0.3))
+    return records
+
+def benchBulk(maxPlayers : int = 100000):
+    import numpy as np
+    from rks import bulkRks
+    from main import RksImageMaker
+    maker = RksImageMaker()
+    charts = maker.charts
+    constant = charts.constant.ravel()
+    save = maker.demo()
+    cost_single, _ = timeit(lambda: maker.compute(save), 20)
+    print(f'谱面数 {len(constant)}, RksImageMaker.compute 单个玩家 {cost_single*1000:.2f} ms ({1/cost_single:,.0f} players/s)')
+    rng = np.random.default_rng(0)
+    players = 1000
+    while players <= maxPlayers:
+        total, done = 0.0, 0
+        while done < players:
+            n = min(BULK_CHUNK, players - done)
+            records = randomRecords(rng, constant, n)
+            start = perf_counter()
+            bulkRks(charts, records)
+            total += perf_counter() - start
+            done += n
+        print(f'bulkRks {players:>7,} players: {total:7.3f}s  {players/total:>10,.0f} players/s')
+        players *= 10
+
+def importTimes(stderr : str) -> dict:
+    """解析-X importtime的输出, 返回 (模块, 层级) -> 累计用时(us), 只保留顶层与其直接导入的模块"""
+    res = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'): continue
+        fields = line[len('import time:'):].split('|')
+        if not fields[1].strip().isdigit(): continue
+        name = fields[2][1:].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1: res[(name.strip(), depth)] = int(fields[1])
+    return res
+
+def runImportTime(code : str, runs : int):
+    """返回(进程用时中位数, (模块, 层级) -> 导入用时中位数), 出错时返回None"""
+    walls, imports = [], {}
+    for _ in range(runs):
+        start = perf_counter()
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+        walls.append(perf_counter() - start)
+        if proc.returncode:
+            print(proc.stderr.splitlines()[-1])
+            return None
+        for key, cost in importTimes(proc.stderr).items():
+            imports.setdefault(key, []).append(cost)
+    return median(walls), {key : median(v) for key, v in imports.items()}
+
+def benchStartup(runs : int = 10):
+    """各阶段的用时都减去空解释器(python -c pass)的启动用时, 解释器自身与site导入的模块不计入"""
+    base = runImportTime('pass', runs)
+    if base is None: return
+    print(f'空解释器: {base[0]*1000:.1f} ms (中位数, {runs}次)')
+    for stage, code in STARTUP_STAGES.items():
+        res = runImportTime(code, runs)
+        if res is None: return
+        wall, imports = res
+        imports = {key : cost for key, cost in imports.items() if key not in base[1] and key[0] != 'main'}
+        total = sum(cost for (name, depth), cost in imports.items() if depth == 0) + res[1].get(('main', 0), 0)
+        print(f'{stage}: +{(wall-base[0])*1000:.1f} ms, 其中导入 {total/1000:.1f} ms')
+        top = sorted(((cost, name) for (name, depth), cost in imports.items()), reverse=True)[:6]
+        print('    ' + ', '.join(f'{name} {cost/1000:.1f} ms' for cost, name in top))
+
+def benchText(renders : int = 5):
+    """常驻进程(server/batch)中连续绘制同一份结果, 成绩格子缓存关闭, 只有文字的绘制方式不同"""
+    from io import BytesIO
+    import main
+    settings = main.loadSettings()
+    settings['SongCellCache'] = False
+    maker = main.RksImageMaker(settings)
+    result = maker.compute(maker.demo())
+    images = {}
+    costs = {}
+    for sprites in (False, True):
+        main.TEXT_SPRITES = sprites
+        main.textSprite.cache_clear()
+        maker.illustrations = sorted(maker.illustrations)[:1]
+        maker.render(result, BytesIO(), 'BMP')        # 预热字体、曲绘与背景缓存
+        buffer = BytesIO()
+        costs[sprites], _ = timeit(lambda: maker.render(result, buffer, 'BMP'), renders)
+        images[sprites] = Image.open(buffer)
+    print(f"ImageStyle={settings['ImageStyle']} MaxSongResultShowcase={settings['MaxSongResultShowcase']}, {renders}次取最短")
+    print(f'    ImageDraw.text: {costs[False]*1000:8.1f} ms')
+    print(f'    文字遮罩缓存:   {costs[True]*1000:8.1f} ms  (每次绘制节省 {(costs[False]-costs[True])*1000:.1f} ms)')
+    mae, psnr = imageDifference(images[False].convert('RGB'), images[True].convert('RGB'))
+    print(f'    平均绝对误差 {mae:.3f}/255, PSNR {psnr:.2f} dB')
+
+def benchShapes(renders : int = 5):
+    """与text相同在常驻进程中连续绘制, 两种ImageStyle分别测试, 只有半透明框的叠加方式不同"""
+    from io import BytesIO
+    import main
+    settings = main.loadSettings()
+    settings['SongCellCache'] = False
+    maker = main.RksImageMaker(settings)
+    result = maker.compute(maker.demo())
+    maker.illustrations = sorted(maker.illustrations)[:1]
+    main.seed = lambda *args: random.seed(0)     # ImageStyle=1中drawSuggestion推分建议的底色是随机的, 固定后才能比较差异
+    for style in STYLE_SIZES:
+        maker.settings['ImageStyle'] = style
+        images = {}
+        costs = {}
+        for batch in (False, True):
+            main.BATCH_SHAPES = batch
+            maker.render(result, BytesIO(), 'BMP')        # 预热字体、曲绘与背景缓存
+            buffer = BytesIO()
+            costs[batch], _ = timeit(lambda: maker.render(result, buffer, 'BMP'), renders)
+            images[batch] = Image.open(buffer)
+        print(f"ImageStyle={style} MaxSongResultShowcase={settings['MaxSongResultShowcase']}, {renders}次取最短")
+        print(f'    add_rounded_rectangle: {costs[False]*1000:8.1f} ms')
+        print(f'    批量叠加:              {costs[True]*1000:8.1f} ms  (每次绘制节省 {(costs[False]-costs[True])*1000:.1f} ms)')
+        mae, psnr = imageDifference(images[False].convert('RGB'), images[True].convert('RGB'))
+        print(f'    平均绝对误差 {mae:.3f}/255, PSNR {psnr:.2f} dB')
+
+def benchThreads(renders : int = 1):
+    """成绩格子缓存关闭, 只测量绘制全部图块的用时, 不含背景与画布, 全部谱面时画布过大"""
+    from hashlib import sha1
+    from concurrent.futures import ThreadPoolExecutor
+    import main
+    settings = main.loadSettings()
+    settings['SongCellCache'] = False
+    settings['MaxSongResultShowcase'] = -1
+    maker = main.RksImageMaker(settings)
+    maker.prepareSongNames()
+    b27 = maker.compute(maker.demo())['b27']
+    style = settings['ImageStyle']
+    digest = lambda tiles: sha1(b''.join(tile.tobytes() for tile in tiles)).hexdigest()
+    print(f'ImageStyle={style}, CPU {os.cpu_count()}个, {renders}次取最短')
+    for count in sorted({i for i in THREAD_SHOWCASES if i < len(b27)} | {len(b27)}):
+        items = b27[:count]
+        base, expected = None, digest(main.songCellTiles(items[:39], style, maker.atlas))
+        for threads in THREAD_COUNTS:
+            executor = None if threads == 1 else ThreadPoolExecutor(threads)
+            same = digest(main.songCellTiles(items[:39], style, maker.atlas, executor=executor)) == expected
+            cost, _ = timeit(lambda: sum(1 for _ in main.songCellTiles(items, style, maker.atlas, executor=executor)), renders)
+            if executor is not None: executor.shutdown()
+            if base is None: base = cost
+            print(f'    {count:>5}个成绩 {threads}线程: {cost*1000:9.1f} ms  {count/cost:7.1f} 格/s  ({base/cost:.2f}x){"" if same else "  与单线程结果不同"}')
+
+def benchFull(pageRows : int = 10):
+    """每种情况在新进程中绘制, 峰值内存为该进程的ru_maxrss, 包括加载资源与计算, 成绩格子缓存关闭"""
+    import tempfile
+    from json import dumps, loads
+    folder = tempfile.mkdtemp()
+    for style in STYLE_SIZES:
+        for rows, imageType in ((0, 'PNG'), (pageRows, 'JPEG')):
+            settings = {'ImageStyle' : style, 'MaxSongResultShowcase' : -1, 'ResultPageRows' : rows, 'SongCellCache' : False, 'SkipUnchanged' : False}
+            output = os.path.join(folder, f'full_{style}_{rows}.{imageType.lower()}')
+            proc = subprocess.run([sys.executable, '-c', FULL_RENDER, dumps(settings), output, imageType], capture_output=True, text=True)
+            if proc.returncode:
+                print(f'ImageStyle={style} 失败(返回值{proc.returncode}): {(proc.stderr.strip().splitlines() or [""])[-1]}')
+                continue
+            res = loads(proc.stdout.strip().splitlines()[-1])
+            total = sum(os.path.getsize(i) for i in res['outputs'])
+            mode = 'PNG逐条编码' if rows == 0 else f'每页{rows}行{imageType}'
+            print(f"ImageStyle={style} {res['count']}个成绩 {mode}: {res['cost']:6.1f}s, 峰值内存 {res['rss']/1024/1024:5.0f} MB, "
+                  f"{len(res['outputs'])}个文件 共{total/1024/1024:.1f} MB")
+            for path in res['outputs']: os.remove(path)
+    os.rmdir(folder)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'background':
+        benchBackground(float(sys.argv[2]) if len(sys.argv) > 2 else 0.25)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'bulk':
+        benchBulk(int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'shapes':
+        benchShapes(int(sys.argv[2]) if len(sys.argv) > 2 else 5)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'text':
+        benchText(int(sys.argv[2]) if len(sys.argv) > 2 else 5)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'threads':
+        benchThreads(int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'full':
+        benchFull(int(sys.argv[2]) if len(sys.argv) > 2 else 10)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'startup':
+        benchStartup(int(sys.argv[2]) if len(sys.argv) > 2 else 10)
+    else:
+        print(__doc__)
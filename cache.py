@@ -0,0 +1,314 @@
+'''
+磁盘缓存
+    BackgroundCache: 调暗+缩放+模糊+裁剪后的背景板, 以未压缩RGB存储, 按总大小淘汰最久未使用的文件
+    IllustrationAtlas: 缩放到成绩格子尺寸的曲绘打包为一个文件, 通过mmap直接读取, 按曲绘sha1增量更新
+    SongCellCache: 绘制好的成绩格子图块(RGBA), 以决定格子外观的成绩字段为键, 按总大小淘汰最久未使用的文件
+    TableCache: info.tsv与difficulty.tsv的解析结果(以及截断后的曲名), pickle存储, 按源文件mtime与sha1失效
+用法: python cache.py warmup      按config.ini预先生成所有曲绘的背景板
+      python cache.py atlas       增量更新曲绘图集
+      python cache.py clear
+'''
+
+import os
+import sys
+import mmap
+import pickle
+import hashlib
+import threading
+from json import load, dump
+
+CACHE_FOLDER = 'cache'
+SONG_NAME_CACHE = os.path.join(CACHE_FOLDER, 'songname.pickle')
+ATLAS_TILE_SIZE = (307, 162)     # 与main.SONG_IMAGE_SIZE一致
+
+class DiskCache:
+    """以未压缩像素存储图片的目录, 总大小超过maxSize时删除最久未使用的文件"""
+    def __init__(self, folder : str, maxSize : int, mode : str = 'RGB', suffix : str = '.rgb'):
+        self.folder = folder
+        self.maxSize = maxSize
+        self.mode = mode
+        self.suffix = suffix
+
+    def path(self, key : str) -> str:
+        return os.path.join(self.folder, f'{key}{self.suffix}')
+
+    def get(self, key : str, size : tuple):
+        """命中时返回图片, 否则返回None"""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) != size[0] * size[1] * len(self.mode):
+            return None
+        try: os.utime(path)        # 更新mtime, 用于LRU淘汰
+        except OSError: pass
+        from PIL import Image      # 只读取解析缓存时不需要加载PIL
+        return Image.frombytes(self.mode, size, data)
+
+    def fits(self, count : int, size : tuple) -> bool:
+        """count张size大小的图片能否同时放入缓存"""
+        return count * size[0] * size[1] * len(self.mode) <= self.maxSize
+
+    def put(self, key : str, img):
+        """写入后不检查总大小, 调用者在一批写入结束后调用evict"""
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path(key)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'     # 同一进程中可能有多个线程在写入
+        with open(tmp, 'wb') as f:
+            f.write(img.convert(self.mode).tobytes())
+        os.replace(tmp, path)
+
+    def evict(self):
+        """总大小超过maxSize时删除最久未使用的文件"""
+        if not os.path.isdir(self.folder): return
+        entries = []
+        total = 0
+        for name in os.listdir(self.folder):
+            if not name.endswith(self.suffix): continue
+            path = os.path.join(self.folder, name)
+            try: stat = os.stat(path)
+            except OSError: continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.maxSize: break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError: pass
+
+    def clear(self):
+        if not os.path.isdir(self.folder): return
+        for name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, name))
+
+_digests = {}       # 路径 -> (mtime, size, sha1), 同一进程中避免重复计算曲绘哈希
+
+def sourceDigest(path : str) -> str:
+    """文件内容的sha1, mtime与大小未变化时直接使用上次的结果; 重新checkout后mtime变化, 但sha1不变"""
+    stat = os.stat(path)
+    cached = _digests.get(path)
+    if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        return cached[2]
+    sha1 = fileDigest(path)
+    _digests[path] = (stat.st_mtime, stat.st_size, sha1)
+    return sha1
+
+class BackgroundCache(DiskCache):
+    def __init__(self, folder : str = os.path.join(CACHE_FOLDER, 'background'), maxSize : int = 1024*1024*1024):
+        super().__init__(folder, maxSize)
+
+    def digest(self, source) -> str:
+        """曲绘内容的sha1, source为文件路径或PIL图片"""
+        if not isinstance(source, str):
+            return hashlib.sha1(source.tobytes()).hexdigest()
+        return sourceDigest(source)
+
+    def key(self, source, target_size : tuple, blur_radius) -> str:
+        return f'{self.digest(source)}_{target_size[0]}x{target_size[1]}_r{blur_radius}'
+
+class SongCellCache(DiskCache):
+    """
+    成绩格子图块缓存, 键为(版本, 样式, songid, 编号, 曲名, rks, 定数, acc, 分数, 难度, fc, 曲绘sha1)
+    两次运行之间未变化的格子直接读取图块叠加, 不再重新绘制
+    """
+    def __init__(self, folder : str = os.path.join(CACHE_FOLDER, 'cell'), maxSize : int = 256*1024*1024):
+        super().__init__(folder, maxSize, 'RGBA', '.rgba')
+
+    def key(self, fields : tuple) -> str:
+        return hashlib.sha1(repr(fields).encode('utf-8')).hexdigest()
+
+class TableCache:
+    '''
+    曲目数据解析结果的缓存, 与源文件的(mtime, 大小, sha1)一起pickle存储
+    mtime与大小都未变化时直接读取, 变化时再比较sha1, 内容确实不同才重新解析
+    key为解析方式的参数(如字号、宽度), 与缓存中的不同时也重新解析
+    '''
+    FORMAT = 2
+
+    def __init__(self, path : str = os.path.join(CACHE_FOLDER, 'tables.pickle'), sources : tuple = ('difficulty.tsv', 'info.tsv'), key = None):
+        self.path = path
+        self.sources = sources
+        self.key = key
+
+    def read(self):
+        try:
+            with open(self.path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['format'] == self.FORMAT and list(cached['sources']) == list(self.sources) and cached.get('key') == self.key:
+                return cached
+        except Exception:
+            pass
+        return None
+
+    def load(self, parse):
+        """返回(解析结果, 各源文件sha1), 缓存失效时调用parse()重新解析并写回"""
+        cached = self.read()
+        stats = {source : os.stat(source) for source in self.sources}
+        if cached is not None and all(cached['sources'][i][:2] == [stat.st_mtime_ns, stat.st_size] for i, stat in stats.items()):
+            return cached['data'], [cached['sources'][i][2] for i in self.sources]
+        digests = [fileDigest(i) for i in self.sources]
+        if cached is not None and digests == [cached['sources'][i][2] for i in self.sources]:
+            data = cached['data']         # 只有mtime变化(如重新checkout), 沿用结果并更新mtime
+        else:
+            data = parse()
+        entry = {'format':self.FORMAT, 'key':self.key, 'data':data,
+                 'sources':{i : [stats[i].st_mtime_ns, stats[i].st_size, digest] for i, digest in zip(self.sources, digests)}}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+        return data, digests
+
+    def clear(self):
+        if os.path.exists(self.path): os.remove(self.path)
+
+def fileDigest(path : str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class IllustrationAtlas:
+    '''
+    曲绘图集: 所有曲绘缩放到同一尺寸后以未压缩RGBX依次存放在atlas.bin中
+    atlas.json记录 songid -> [偏移, sha1, mtime, 文件大小]
+    读取时mmap整个atlas.bin, Image.frombuffer直接引用映射的内存, 不需要解码与复制
+    '''
+    def __init__(self, folder : str = CACHE_FOLDER, source : str = 'illustrationLowRes', size : tuple = ATLAS_TILE_SIZE):
+        self.folder = folder
+        self.source = source
+        self.size = size
+        self.tileBytes = size[0] * size[1] * 4
+        self.binPath = os.path.join(folder, 'atlas.bin')
+        self.indexPath = os.path.join(folder, 'atlas.json')
+        self.index = {}
+        self.buffer = None
+        self.mm = None
+        self.built = False      # 本进程中是否已经检查并增量更新过图集
+        self.open()
+
+    def close(self):
+        """释放对atlas.bin的映射, Windows下被映射的文件无法替换"""
+        try:
+            if self.buffer is not None: self.buffer.release()
+            if self.mm is not None: self.mm.close()
+        except BufferError:     # 仍有图片引用映射的内存, 交给垃圾回收关闭
+            pass
+        self.index, self.buffer, self.mm = {}, None, None
+
+    def open(self):
+        """重新读取索引并映射atlas.bin"""
+        self.close()
+        try:
+            with open(self.indexPath, 'r', encoding='utf-8') as f:
+                index = load(f)
+            if index.get('size') != list(self.size): return
+            with open(self.binPath, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, KeyError):
+            return
+        if len(mm) != len(index['tiles']) * self.tileBytes:
+            mm.close()
+            return
+        self.index, self.buffer, self.mm = index['tiles'], memoryview(mm), mm
+
+    def sourcePath(self, songid : str) -> str:
+        return os.path.join(self.source, f'{songid}.png')
+
+    def isFresh(self, songid : str, stat) -> bool:
+        entry = self.index.get(songid)
+        return entry is not None and entry[2] == stat.st_mtime and entry[3] == stat.st_size
+
+    def get(self, songid : str):
+        """
+        曲绘未变化时返回引用图集内存的RGBX图片(只读), 否则返回None
+        mtime或大小变化时再比较sha1, 只是重新checkout或touch时仍使用图集
+        """
+        if self.buffer is None: return None
+        try:
+            stat = os.stat(self.sourcePath(songid))
+        except OSError:
+            return None
+        if not self.isFresh(songid, stat):
+            entry = self.index.get(songid)
+            if entry is None or sourceDigest(self.sourcePath(songid)) != entry[1]: return None
+            entry[2], entry[3] = stat.st_mtime, stat.st_size
+        offset = self.index[songid][0]
+        from PIL import Image
+        return Image.frombuffer('RGBX', self.size, self.buffer[offset:offset+self.tileBytes], 'raw', 'RGBX', 0, 1)
+
+    def build(self) -> int:
+        """
+        增量生成图集: sha1未变化的曲绘直接复制旧图集中的数据, 其余重新解码缩放
+        写入临时文件后整体替换, 正在读取旧图集的进程不受影响, 返回重新生成的数量
+        """
+        self.built = True
+        if not os.path.isdir(self.source): return 0
+        songids = sorted(name[:-4] for name in os.listdir(self.source) if name.endswith('.png'))
+        stats = {songid : os.stat(self.sourcePath(songid)) for songid in songids}
+        if self.buffer is not None and set(songids) == set(self.index) and all(self.isFresh(i, stats[i]) for i in songids):
+            return 0
+        os.makedirs(self.folder, exist_ok=True)
+        tmp = f'{self.binPath}.{os.getpid()}.tmp'
+        index, rebuilt = {}, 0
+        try:
+            with open(tmp, 'wb') as f:
+                for songid in songids:
+                    stat = stats[songid]
+                    entry = self.index.get(songid)
+                    digest = entry[1] if self.isFresh(songid, stat) else sourceDigest(self.sourcePath(songid))
+                    if self.buffer is not None and entry is not None and entry[1] == digest:
+                        data = self.buffer[entry[0]:entry[0]+self.tileBytes]
+                    else:
+                        from PIL import Image
+                        data = Image.open(self.sourcePath(songid)).convert('RGB').resize(self.size).convert('RGBX').tobytes()
+                        rebuilt += 1
+                    index[songid] = [f.tell(), digest, stat.st_mtime, stat.st_size]
+                    f.write(data)
+                    del data
+        except BaseException:
+            if os.path.exists(tmp): os.remove(tmp)
+            raise
+        self.close()
+        os.replace(tmp, self.binPath)
+        tmp = f'{self.indexPath}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            dump({'size':list(self.size), 'tiles':index}, f, ensure_ascii=False)
+        os.replace(tmp, self.indexPath)
+        self.open()
+        return rebuilt
+
+def warmup():
+    """为所有曲绘生成当前配置(ImageStyle, MaxSongResultShowcase)下的背景板"""
+    from main import RksImageMaker, makeBackground, BLUR_RADIUS, BANDED_HEIGHT, printwithcolor
+    maker = RksImageMaker()
+    if maker.backgroundCache is None:
+        printwithcolor('config.ini中BackgroundCache未开启', [31])
+        return
+    showcase = maker.settings['MaxSongResultShowcase']
+    target_size = maker.targetSize(maker.chartsum if showcase == -1 else showcase)
+    if target_size[1] > BANDED_HEIGHT:
+        printwithcolor(f'{target_size[0]}x{target_size[1]}的图片分条绘制, 不使用背景板缓存', [33])
+        return
+    for idx, name in enumerate(maker.illustrations):
+        makeBackground(f'illustrationLowRes/{name}', target_size, BLUR_RADIUS, maker.backgroundCache, maker.settings['BackgroundScale'])
+        print(f'\r{idx+1}/{len(maker.illustrations)} {target_size[0]}x{target_size[1]}', end='')
+    print()
+    maker.backgroundCache.evict()
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'warmup': warmup()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'atlas':
+        print(f'已更新{IllustrationAtlas().build()}张曲绘')
+    elif len(sys.argv) > 1 and sys.argv[1] == 'clear':
+        BackgroundCache().clear()
+        SongCellCache().clear()
+        TableCache().clear()
+        TableCache(SONG_NAME_CACHE).clear()
+    else: print(__doc__)
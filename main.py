@@ -1,39 +1,136 @@
 import ctypes
+import zlib
+import struct
 import sys
-from json import loads
-from PIL import Image, ImageFilter, ImageDraw, ImageFont, ImageEnhance
-from dotenv import load_dotenv
+import threading
+from io import BytesIO
+from json import loads, dumps, load, dump
+from hashlib import sha1
 from random import choice
 import os
-from datetime import datetime, timezone
-from pytz import timezone
+from datetime import datetime
+from functools import lru_cache
+from itertools import repeat
 from random import randint,seed
+from math import floor, ceil
+from cache import BackgroundCache, IllustrationAtlas, SongCellCache, TableCache, SONG_NAME_CACHE, sourceDigest
+# PIL、numpy、dotenv在用到时才导入, 存档未变化而跳过绘制时不需要加载
 
 VERSION = 'Unknown'
 with open("VERSION", "r") as f:
     VERSION = f.read()
-    
-FONT_CONFIG = {
-            'rank': ImageFont.truetype("Resource/SourceHanSansCN-Regular.ttf", 24),
-            'difficulty': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 17),
-            'song_name': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 20),
-            'score': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 36),
-            'accuracy': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 28),
-            'accuracy_small': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 20),
-            'next': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 20),
-            'username': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 56),
-            'rks': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 30),
-            'rks_small': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 20),
-            'song_name_bigger': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 24),
-            'challenge_rank': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 36),
-            'data': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 26),
-            'updatetime': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 22),
-            'sheet': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 26),
-            'version': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 30),
-            'open-sourced': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 24),    
-            'warning': ImageFont.truetype("Resource/SourceHanSans&SairaHybrid-Regular.ttf", 14),
-                    
+
+FONT_REGULAR = "Resource/SourceHanSansCN-Regular.ttf"
+FONT_HYBRID = "Resource/SourceHanSans&SairaHybrid-Regular.ttf"
+FONT_SPEC = {
+            'rank': (FONT_REGULAR, 24),
+            'difficulty': (FONT_HYBRID, 17),
+            'song_name': (FONT_HYBRID, 20),
+            'score': (FONT_HYBRID, 36),
+            'accuracy': (FONT_HYBRID, 28),
+            'accuracy_small': (FONT_HYBRID, 20),
+            'next': (FONT_HYBRID, 20),
+            'username': (FONT_HYBRID, 56),
+            'rks': (FONT_HYBRID, 30),
+            'rks_small': (FONT_HYBRID, 20),
+            'song_name_bigger': (FONT_HYBRID, 24),
+            'challenge_rank': (FONT_HYBRID, 36),
+            'data': (FONT_HYBRID, 26),
+            'updatetime': (FONT_HYBRID, 22),
+            'sheet': (FONT_HYBRID, 26),
+            'version': (FONT_HYBRID, 30),
+            'open-sourced': (FONT_HYBRID, 24),
+            'warning': (FONT_HYBRID, 14),
 }
+FONT_FILES = {}     # 路径 -> 字体文件内容, 同一文件的各个字号共享一份
+FONT_FACES = {}     # (路径, 字号) -> FreeTypeFont
+font_lock = threading.Lock()
+
+def loadFont(path : str, size : int):
+    """按(路径, 字号)加载字体, 字体文件只读取一次"""
+    with font_lock:
+        font = FONT_FACES.get((path, size))
+        if font is None:
+            from PIL import ImageFont
+            data = FONT_FILES.get(path)
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = FONT_FILES[path] = f.read()
+            font = FONT_FACES[(path, size)] = ImageFont.truetype(BytesIO(data), size)
+        return font
+
+class FontConfig(dict):
+    """FONT_CONFIG[键]第一次被使用时才加载对应字体"""
+    def __missing__(self, key):
+        font = self[key] = loadFont(*FONT_SPEC[key])
+        return font
+
+FONT_CONFIG = FontConfig()
+SONG_NAME_WIDTH = 200   # 成绩格子中曲名的最大宽度
+measure_draw = None
+
+def measureDraw():
+    """只用于测量文字的ImageDraw, 在RGB/RGBA图片上测得的结果与此相同"""
+    global measure_draw
+    if measure_draw is None:
+        from PIL import Image, ImageDraw
+        measure_draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+    return measure_draw
+
+@lru_cache(maxsize=8192)
+def textBBox(text : str, font) -> tuple:
+    """等同于draw.textbbox((0, 0), text, font=font), 按(文字, 字体)缓存"""
+    return measureDraw().textbbox((0, 0), text, font=font)
+
+@lru_cache(maxsize=8192)
+def textLength(text : str, font) -> float:
+    """等同于draw.textlength(text, font=font), 按(文字, 字体)缓存"""
+    return measureDraw().textlength(text, font=font)
+
+@lru_cache(maxsize=4096)
+def truncateText(text : str, max_width : int, font) -> str:
+    """超过max_width时截断并加上..., 二分查找能放下的最长前缀"""
+    ellipsis = "..."
+    if textLength(text, font) <= max_width:
+        return text
+    low, high = 0, len(text)       # 能放下的最长前缀长度在[low, high]之间
+    while low < high:
+        mid = (low + high + 1) // 2
+        if textLength(text[:mid] + ellipsis, font) <= max_width: low = mid
+        else: high = mid - 1
+    return text[:low] + ellipsis
+
+TEXT_SPRITES = True     # 固定文字使用预先绘制的遮罩, 为False时全部直接用ImageDraw绘制
+
+@lru_cache(maxsize=4096)
+def textSprite(text : str, font, fx : float, fy : float):
+    """
+    文字在小数偏移(fx, fy)处绘制得到的L模式遮罩, 返回(遮罩, 左, 上)
+    遮罩左上角对应绘制坐标整数部分加上(左, 上), 左、上不大于0, 保证遮罩内的小数偏移与直接绘制时相同
+    """
+    from PIL import Image, ImageDraw
+    bbox = textBBox(text, font)
+    left, top = min(0, floor(bbox[0]) - 2), min(0, floor(bbox[1]) - 2)
+    sprite = Image.new('L', (ceil(bbox[2]) + 3 - left, ceil(bbox[3]) + 3 - top), 0)
+    ImageDraw.Draw(sprite).text((fx - left, fy - top), text, fill=255, font=font)
+    return sprite, left, top
+
+def drawText(img, xy, text : str, fill, font):
+    """等同于ImageDraw.Draw(img).text(xy, text, fill=fill, font=font), 单行文字的遮罩按(文字, 字体, 小数偏移)缓存"""
+    x, y = xy
+    if not TEXT_SPRITES or x < 0 or y < 0 or '\n' in text:
+        from PIL import ImageDraw
+        ImageDraw.Draw(img).text(xy, text, fill=fill, font=font)
+        return
+    sprite, left, top = textSprite(text, font, x - int(x), y - int(y))
+    img.paste(fill, (int(x) + left, int(y) + top), sprite)
+
+TRUNCATED_NAMES = {}    # 曲名 -> 截断后的曲名, 由RksImageMaker.prepareSongNames预先填充
+
+def truncateSongName(name : str) -> str:
+    truncated = TRUNCATED_NAMES.get(name)
+    if truncated is None: truncated = truncateText(name, SONG_NAME_WIDTH, FONT_CONFIG['song_name'])
+    return truncated
 # 预定义颜色常量
 DIFFICULTY_COLORS = {
     'AT': (56, 56, 56),
@@ -43,7 +140,11 @@ DIFFICULTY_COLORS = {
 }
 
 INFO_BLOCK_COLOR = (57, 197, 187)
+BLUR_RADIUS = 55   # 背景虚化程度
+SONG_IMAGE_SIZE = (int(256 * 1.2), int(135 * 1.2))
 WHITE = (255, 255, 255)
+RENDER_STATE = 'render_state.json'     # 上次输出时的存档指纹与输出文件
+DEFAULT_TIMEZONE = 'Asia/Shanghai'
 
 def printwithcolor(text: str, option: list, end1: str='\n'):
     '''
@@ -78,8 +179,41 @@ def fuck(info : str, errcode : int = 0):
     input("按下Enter以继续...")
     sys.exit(1)
     
+ASSET_CACHE = {}
+
+def loadAsset(path : str, size : tuple = None, resample = None, mode : str = 'RGBA'):
+    """
+    读取Resource中的图片, 每个(路径, 尺寸, 缩放算法, 模式)只解码与缩放一次, 整个进程内复用
+    返回的图片为共享对象, 只能用于paste等只读操作; 文件不存在时返回None
+    """
+    from PIL import Image
+    key = (path, size, resample, mode)
+    if key in ASSET_CACHE: return ASSET_CACHE[key]
+    if not os.path.exists(path):
+        ASSET_CACHE[key] = None
+        return None
+    if size is None:
+        img = Image.open(path).convert(mode)
+    else:
+        base = loadAsset(path, mode=mode)
+        img = base.resize(size) if resample is None else base.resize(size, resample)
+    ASSET_CACHE[key] = img
+    return img
+
+def loadSongImage(songid : str, atlas=None):
+    """歌曲插图(已缩放至SONG_IMAGE_SIZE), atlas为IllustrationAtlas时优先使用图集中预先缩放好的图块"""
+    from PIL import Image
+    if atlas is not None:
+        img = atlas.get(songid)
+        if img is not None: return img
+    img_path = f"illustrationLowRes/{songid}.png"
+    if not os.path.exists(img_path):
+        return loadAsset("Resource/nodata.png", SONG_IMAGE_SIZE, mode='RGB')
+    return Image.open(img_path).convert('RGB').resize(SONG_IMAGE_SIZE)
+
 def add_corners(im, rad):
     """将图片裁剪为圆角"""
+    from PIL import Image, ImageDraw
     circle = Image.new('L', (rad * 2, rad * 2), 0)
     draw = ImageDraw.Draw(circle)
     draw.ellipse((0, 0, rad * 2, rad * 2), fill=255)
@@ -97,6 +231,7 @@ def add_corners(im, rad):
 
 def add_rounded_rectangle(img, position, size, radius, color, alpha):
     """绘制圆角矩形（带透明度）"""
+    from PIL import Image, ImageDraw
     x, y = position
     width, height = size
     
@@ -117,6 +252,70 @@ def add_rounded_rectangle(img, position, size, radius, color, alpha):
     img.paste(rectangle, (x, y), rectangle)
     return img
 
+BATCH_SHAPES = True     # Overlay把所有半透明矩形画到一个图层上一次叠加, 为False时按顺序逐个add_rounded_rectangle
+
+@lru_cache(maxsize=256)
+def roundedMask(size : tuple, radius : int, alpha : int):
+    """圆角矩形的L模式遮罩, 形状内为alpha, 按(尺寸, 圆角, 透明度)缓存"""
+    from PIL import Image, ImageDraw
+    mask = Image.new('L', size, 0)
+    ImageDraw.Draw(mask).rounded_rectangle([(0, 0), (size[0] - 1, size[1] - 1)], radius=radius, fill=alpha)
+    return mask
+
+@lru_cache(maxsize=256)
+def roundedRectangle(size : tuple, radius : int, color : tuple, alpha : int):
+    """半透明圆角矩形图块(RGBA), 与add_rounded_rectangle中临时生成的图片相同, 只能只读使用"""
+    from PIL import Image
+    shape = Image.new('RGBA', size, color + (0,))
+    shape.putalpha(roundedMask(size, radius, alpha))
+    return shape
+
+class Overlay:
+    '''
+    半透明矩形的合成层: add/text/paste只按顺序记录, composite时
+    先把所有矩形画到覆盖它们外接矩形的一个RGBA图层上, 一次alpha_composite到画布, 再依次绘制文字与图标
+    因此记录的矩形不能盖住之前记录的文字, 需要盖住时先composite再记录
+    '''
+    def __init__(self):
+        self.ops = []
+
+    def add(self, position, size, radius, color, alpha):
+        self.ops.append(('shape', tuple(position), tuple(size), radius, tuple(color), int(alpha)))
+
+    def text(self, xy, text, fill, font, cached : bool = True):
+        """cached为False时不使用文字遮罩缓存(用户名等每次都不同的文字)"""
+        self.ops.append(('text', xy, text, fill, font, cached))
+
+    def extend(self, ops):
+        """追加预先生成的记录, 如Layout.panel"""
+        self.ops.extend(ops)
+
+    def paste(self, im, position):
+        if im is None: raise ValueError('图片不存在')     # 与直接paste时一样在调用处抛出
+        self.ops.append(('paste', im, position))
+
+    def composite(self, img):
+        from PIL import Image, ImageDraw
+        shapes = [op for op in self.ops if op[0] == 'shape']
+        if BATCH_SHAPES and shapes:
+            left, top = min(op[1][0] for op in shapes), min(op[1][1] for op in shapes)
+            right, bottom = max(op[1][0] + op[2][0] for op in shapes), max(op[1][1] + op[2][1] for op in shapes)
+            layer = Image.new('RGBA', (right - left, bottom - top), (0, 0, 0, 0))
+            for _, (x, y), size, radius, color, alpha in shapes:
+                layer.alpha_composite(roundedRectangle(size, radius, color, alpha), (x - left, y - top))
+            img.alpha_composite(layer, (left, top))
+        for op in self.ops:
+            if op[0] == 'shape':
+                if not BATCH_SHAPES: add_rounded_rectangle(img, *op[1:])
+            elif op[0] == 'paste':
+                img.paste(op[1], op[2], op[1])
+            elif op[5]:
+                drawText(img, op[1], op[2], fill=op[3], font=op[4])
+            else:
+                ImageDraw.Draw(img).text(op[1], op[2], fill=op[3], font=op[4])
+        self.ops = []
+        return img
+
 def classToNum(a : str) -> int:
     # 将难度字符串转换为数字
     if(a == 'EZ'): return 0
@@ -125,1858 +324,1269 @@ def classToNum(a : str) -> int:
     elif(a == 'AT'): return 3
     return 4
 
-def suggestionsCalculate(rks : float, diff : float, p3 : float, b27_contribution : float, position : int, contribution : float)->float:
-    target : float = int(rks*100) / 100.0 + 0.005
-    target += (rks>target)*0.01
-    target_contribution = (target - (rks - (b27_contribution if position>27 else contribution)/30.00)) * 30.00
-    target_acc = pow(target_contribution/diff,0.5)*45+55
-    if(target_acc>100):
-        if diff <= p3 : return -1.0
-        target_contribution = (target - (rks - p3/30.00)) * 30.00
-        if target_contribution > diff : return -1.0
-        return 100.00
-    return target_acc
-        
-
-
-def createImage(a_path, output_path, target_size, blur_radius, avatar, b27, username, rks, challengeModeRank, data, updatetime, progress, style, imageType, isrksCorrect, rks_savedata):
-    # (songid,rank,songname,rks,difficulty,acc,score,type,nxt,fc)
-    def draw_song_item(final_img, item, x, y, cell_width, cell_height, draw):
-        # 绘制编号
-        b_text = item[1]
-        text_bbox = draw.textbbox((0, 0), b_text, font=FONT_CONFIG['rank'])
-        b_width = 50
-        b_height = text_bbox[3] - text_bbox[1] + 10
-        color1 = (220, 220, 220)
-        
-        if item[1][0] == 'P':
-            color1 = (255, 240, 87)
-        
-        # 歌曲插图
-        img_path = f"illustrationLowRes/{item[0]}.png"
-        if not os.path.exists(img_path):
-            img_path = "Resource/nodata.png"
-            
-        song_img = Image.open(img_path).convert('RGB').resize((int(256 * 1.2), int(135 * 1.2)))
-        final_img.paste(song_img, (x + b_width, y))
-        
-        # 编号背景
-        final_img = add_rounded_rectangle(
-            final_img,
-            (x + 15, y),
-            (b_width, b_height),
-            5,
-            color1,
-            200
-        )
-        
-        # 编号文本
-        draw.text(
-            (x + (b_width - text_bbox[2]) // 2 + 15, y + (b_height - text_bbox[3]) // 2 - 5),
-            b_text,
-            fill=(0, 0, 0),
-            font=FONT_CONFIG['rank']
-        )
-        
-        # 难度标签
-        if item[0] != 'No Data':
-            diff_type = item[7]
-            tag_size = (70, 45)
-            tag_pos = (x + b_width, y + 135 - tag_size[1] + 27)
-            
-            final_img = add_rounded_rectangle(
-                final_img,
-                tag_pos,
-                tag_size,
-                5,
-                DIFFICULTY_COLORS.get(diff_type, WHITE),
-                200
-            )
-            
-            diff_text = f'{diff_type} {item[4]}\n' + '%.3f' % item[3]
-            text_bbox = draw.textbbox((0, 0), diff_text, font=FONT_CONFIG['difficulty'])
-            xx, yy = tag_pos[0] + (tag_size[0] - text_bbox[2]) // 2, tag_pos[1] + 5
-            
-            for line in diff_text.split('\n'):
-                draw.text(
-                    (xx, yy),
-                    line,
-                    font=FONT_CONFIG['difficulty'],
-                    fill=WHITE
-                )
-                yy += -2 + int(17 * 4 / 3)
-        
-        # 信息块
-        info_block_width = 240
-        info_block_height = 130
-        info_pos = (x + b_width + 256 + 50, y + (135 - info_block_height) // 2 + 25)
-        
-        try:
-            info_block = Image.open('Resource/infoblock.png').convert('RGBA').resize((info_block_width, info_block_height))
-            final_img.paste(info_block, (info_pos[0], info_pos[1] - 10), info_block)
-        except:
-            pass
-        
-        # 歌曲名称
-        def truncate_text(text, max_width, font):
-            ellipsis = "..."
-            if draw.textlength(text, font=font) <= max_width:
-                return text
-            
-            max_len = len(text)
-            while max_len > 0:
-                truncated = text[:max_len] + ellipsis
-                if draw.textlength(truncated, font=font) <= max_width:
-                    return truncated
-                max_len -= 1
-            
-            return ellipsis
-        
-        max_name_width = 200
-        truncated_name = truncate_text(item[2], max_name_width, FONT_CONFIG['song_name'])
-        song_name_font = FONT_CONFIG['song_name']
-        
-        if len(item[2]) <= 15:
-            song_name_font = FONT_CONFIG['song_name_bigger']
-        
-        name_bbox = draw.textbbox((0, 0), truncated_name, font=song_name_font)
-        draw.text(
-            (info_pos[0] + 100 - name_bbox[2] / 2 + 25, info_pos[1]),
-            truncated_name,
-            fill=WHITE,
-            font=song_name_font
-        )
-        
-        # 分数
-        score_text = f"{item[6]}"
-        score_bbox = draw.textbbox((0, 0), score_text, font=FONT_CONFIG['score'])
-        draw.text(
-            (info_pos[0] + 100 - score_bbox[2] / 2 + 40, info_pos[1] + 30),
-            score_text,
-            fill=WHITE,
-            font=FONT_CONFIG['score']
-        )
-        
-        # ACC
-        acc_val = item[5]
-        main_text = f'{acc_val:05.2f}'
-        tiny_text = f'{int(acc_val * 10000) % 100:02d}'
-        
-        font_main = FONT_CONFIG['accuracy']
-        font_tiny = FONT_CONFIG['accuracy_small']
-        
-        acc_x = info_pos[0] + 36 + 35
-        acc_y = info_pos[1] + 65
-        
-        draw.text((acc_x, acc_y), main_text, fill=WHITE, font=font_main)
-        
-        main_w = draw.textbbox((0, 0), main_text, font=font_main)[2]
-        draw.text((acc_x + main_w, acc_y + 7), tiny_text, fill=WHITE, font=font_tiny)
-        
-        tiny_w = draw.textbbox((0, 0), tiny_text, font=font_tiny)[2]
-        draw.text((acc_x + main_w + tiny_w, acc_y), '%', fill=WHITE, font=font_main)
-        
-        # 评级图标
-        icon_path = "Resource/"
-        score = item[6]
-        
-        if score == 1000000:
-            icon_path += "Phi.png"
-        elif item[9]:
-            icon_path += "FC.png"
+def saveImage(final_img, output_path, imageType):
+    """
+    保存图片, output_path可以是文件路径或BytesIO等文件对象
+    返回实际输出路径, output_path为文件对象时返回实际写入的格式(imageType无法保存时改为PNG)
+    """
+    try:
+        if(imageType == 'JPEG'):
+            if isinstance(output_path, str): output_path=output_path.replace('jpeg',"jpg")
+            final_img.convert('RGB').save(output_path, format=imageType,quality=70,optimize=True,progressive=True)
         else:
-            if score >= 960000:
-                icon_path += "V.png"
-            elif score >= 920000:
-                icon_path += "S.png"
-            elif score >= 880000:
-                icon_path += "A.png"
-            elif score >= 820000:
-                icon_path += "B.png"
-            elif score >= 700000:
-                icon_path += "C.png"
-            else:
-                icon_path += "F.png"
-        
-        if os.path.exists(icon_path):
-            try:
-                icon = Image.open(icon_path).convert('RGBA').resize((74, 74))
-                final_img.paste(icon, (info_pos[0], info_pos[1] + 25), icon)
-            except:
-                pass
-
-    if(style == 0):
-        # 横版布局
-        # 将原来的竖版尺寸转换为横版
-        if len(target_size) == 2 and target_size[0] < target_size[1]:
-            # 如果传入的是竖版尺寸，自动转换为横版
-            target_size = (7500, 2500)  # 增加宽度以适应每行6个
-        
-        original_img = Image.open(a_path).convert('RGB')
-        enhancer = ImageEnhance.Brightness(original_img)
-        original_img = enhancer.enhance(0.7)
-        original_width, original_height = original_img.size
-        
-        target_width, target_height = target_size
-        
-        # 背景模糊处理
-        ratio = max(target_width / original_width, target_height / original_height)
-        new_size = (int(original_width * ratio), int(original_height * ratio))
-        
-        blurred_bg = original_img.resize(new_size, Image.LANCZOS)
-        blurred_bg = blurred_bg.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-        
-        # 裁剪背景
-        left = (blurred_bg.width - target_width) // 2
-        top = (blurred_bg.height - target_height) // 2
-        blurred_bg = blurred_bg.crop((left, top, left+target_width, top+target_height))
-        
-        final_img = Image.new("RGBA", target_size)
-        final_img.paste(blurred_bg, (0, 0))
-        
-        # 绘制头像
-        ava=''
-        try:
-            ava = Image.open(f'avatar/{avatar}.png').convert('RGBA')
-            ava_round = add_corners(ava, 5)
-            final_img.paste(ava_round, (64, 64), ava_round)    
-        # except Exception as e:
-            #     fuck(f'找不到头像png文件, 请检查avatar是否为最新数据:{e}',5)
-        except:
-            ava = Image.new("RGBA",(64,64),(57,197,187))
-            ava_round = add_corners(ava, 5)
-            
-        # 数据不同步警告
-        if not isrksCorrect:
-            warning_text = f'发现计算rks({rks})与云端获取rks({rks_savedata})不同\n请确认游戏是否更新定数或更改rks计算法则'
-            warning_font = FONT_CONFIG['warning']
-            draw = ImageDraw.Draw(final_img)
-            
-            # 获取多行文本的边界框
-            lines = warning_text.split('\n')
-            max_width = 0
-            total_height = 0
-            
-            for line in lines:
-                bbox = draw.textbbox((0, 0), line, font=warning_font)
-                line_width = bbox[2] - bbox[0]
-                line_height = bbox[3] - bbox[1]
-                max_width = max(max_width, line_width)
-                total_height += line_height
-            
-            # 设置边距
-            padding_x = 10
-            padding_y = 5
-            line_spacing = 5
-            
-            # 警告框的位置（头像下方）
-            warning_x = 64
-            warning_y = 64 + ava_round.height + 5
-            
-            # 警告框尺寸
-            warning_width = max_width + padding_x * 2
-            warning_height = total_height + padding_y * 2 + line_spacing * (len(lines) - 1)
-            
-            # 绘制警告框
-            final_img = add_rounded_rectangle(
-                final_img,
-                (warning_x, warning_y),
-                (warning_width, warning_height),
-                radius=5,
-                color=(255, 255, 255),
-                alpha=230
-            )
-            
-            final_img = add_rounded_rectangle(
-                final_img,
-                (warning_x - 2, warning_y - 2),
-                (warning_width + 4, warning_height + 4),
-                radius=6,
-                color=(255, 0, 0),
-                alpha=100
-            )
-            
-            # 绘制警告文本
-            current_y = warning_y + padding_y
-            for line in lines:
-                bbox = draw.textbbox((0, 0), line, font=warning_font)
-                line_width = bbox[2] - bbox[0]
-                line_height = bbox[3] - bbox[1]
-                
-                line_x = warning_x + (warning_width - line_width) // 2
-                draw.text(
-                    (line_x, current_y),
-                    line,
-                    fill=(255, 0, 0),
-                    font=warning_font
-                )
-                current_y += line_height + line_spacing
-        
-        # --- 横版布局：上方信息区域 ---
-        draw = ImageDraw.Draw(final_img)
-        
-        # 1. 用户名框
-        username_x = 64 + ava_round.width + 20
-        username_y = 64
-        username_bg_width = 400
-        username_bg_height = 96
-        
-        final_img = add_rounded_rectangle(
-            final_img,
-            (username_x, username_y),
-            (username_bg_width, username_bg_height),
-            radius=10,
-            color=(50, 50, 50),
-            alpha=150
-        )
-        
-        username_bbox = draw.textbbox((0, 0), username, font=FONT_CONFIG['username'])
-        draw.text(
-            (username_x + (username_bg_width - username_bbox[2]) // 2, 
-             username_y + (username_bg_height - username_bbox[3]) // 2 - 5),
-            username,
-            fill=WHITE,
-            font=FONT_CONFIG['username']
-        )
-        
-        # 更新时间
-        final_img = add_rounded_rectangle(
-            final_img,
-            (username_x, username_y - 28),
-            (500, 30),
-            radius=5,
-            color=(50, 50, 50),
-            alpha=150
-        )
-        draw.text(
-            (username_x + 10, username_y - 28),
-            'Updated at: ' + updatetime[:-7] + ' UTC+08:00',
-            fill=WHITE,
-            font=FONT_CONFIG['updatetime']
-        )
-        
-        # 2. RKS显示框
-        main_txt = f'{int(rks)}.{int((rks - int(rks)) * 100)}'
-        tiny_txt = f'{int(rks * 1000000) % 10000:04d}'
-        
-        font_main = FONT_CONFIG['rks']
-        font_tiny = FONT_CONFIG['rks_small']
-        
-        main_bbox = draw.textbbox((0, 0), main_txt, font=font_main)
-        tiny_bbox = draw.textbbox((0, 0), tiny_txt, font=font_tiny)
-        
-        main_w = main_bbox[2] - main_bbox[0]
-        tiny_w = tiny_bbox[2] - tiny_bbox[0]
-        total_w = main_w + tiny_w
-        max_h = main_bbox[3] - main_bbox[1]
-        
-        rks_bg_width = total_w + 35
-        rks_bg_height = max_h + 10
-        rks_x = username_x
-        rks_y = username_y + username_bg_height + 10
-        
-        final_img = add_rounded_rectangle(
-            final_img,
-            (rks_x, rks_y),
-            (rks_bg_width, rks_bg_height + 4),
-            radius=6,
-            color=(230, 230, 230),
-            alpha=230
-        )
-        
-        base_y = rks_y + (rks_bg_height - max_h) // 2
-        draw.text((rks_x + 15, base_y - 5), main_txt, fill=(0, 0, 0), font=font_main)
-        draw.text((rks_x + 15 + main_w, base_y + 4), tiny_txt, fill=(0, 0, 0), font=font_tiny)
-        
-        # 3. 挑战模式图标
-        challenge_rank = challengeModeRank
-        rank_tier = challenge_rank // 100
-        rank_number = challenge_rank % 100
-        
-        icon_map = {
-            1: "Resource/green.png",
-            2: "Resource/blue.png",
-            3: "Resource/red.png",
-            4: "Resource/gold.png",
-            5: "Resource/rainbows.png"
-        }
-        icon_path = icon_map.get(rank_tier, "Resource/grey.png")
-        
-        try:
-            icon = Image.open(icon_path).convert('RGBA').resize((100, 60), Image.LANCZOS)
-            icon_x = rks_x + rks_bg_width + 10
-            icon_y = rks_y - 5
-            final_img.paste(icon, (icon_x, icon_y), icon)
-            
-            rank_font = FONT_CONFIG['challenge_rank']
-            rank_bbox = draw.textbbox((0, 0), str(rank_number), font=rank_font)
-            
-            draw.text(
-                (icon_x + (100 - rank_bbox[2]) // 2,
-                 icon_y + (60 - rank_bbox[3]) // 2 - 5),
-                str(rank_number),
-                fill=WHITE,
-                font=rank_font
-            )
-        except:
-            pass
-        
-        # 4. 数据框
-        data_font = FONT_CONFIG['data']
-        data_text_width = draw.textlength(data, font=data_font)
-        data_box_width = 30 + 8 + int(data_text_width) + 35
-        data_box_height = 40
-        
-        data_box_pos = (icon_x + 100 + 20, icon_y + 12)
-        final_img = add_rounded_rectangle(
-            final_img,
-            data_box_pos,
-            (data_box_width, data_box_height),
-            radius=5,
-            color=(80, 80, 80),
-            alpha=int(255 * 0.7)
-        )
-        
-        try:
-            data_icon = Image.open("Resource/data.png").convert('RGBA')
-            original_width, original_height = data_icon.size
-            new_height = 24
-            new_width = int(original_width * (new_height / original_height))
-            data_icon = data_icon.resize((new_width, new_height), Image.LANCZOS)
-            
-            data_icon_x = data_box_pos[0] + 10
-            data_icon_y = data_box_pos[1] + (data_box_height - new_height) // 2
-            final_img.paste(data_icon, (data_icon_x, data_icon_y), data_icon)
-            
-            data_text_x = data_icon_x + new_width + 10
-            data_text_y = data_box_pos[1] + (data_box_height - data_font.size) // 2
-            draw.text(
-                (data_text_x, data_text_y),
-                data,
-                fill=WHITE,
-                font=data_font
-            )
-        except:
-            pass
-        
-        # 5. 成绩统计表格
-        table_x = username_x + username_bg_width + 400
-        table_y = username_y
-        cell_width = 80
-        cell_height = 40
-        header_height = 40
-        row_height = cell_height
-        border_radius = 5
-        bg_alpha = 150
-        
-        headers = ["", "EZ", "HD", "IN", "AT"]
-        row_labels = ["C", "FC", "AP"]
-        
-        # 绘制表头
-        for col in range(5):
-            cell_x = table_x + col * cell_width
-            cell_y = table_y
-            
-            final_img = add_rounded_rectangle(
-                final_img,
-                (cell_x, cell_y),
-                (cell_width if col > 0 else 80, header_height),
-                radius=0,
-                color=(70, 70, 70),
-                alpha=bg_alpha
-            )
-            
-            header_text = headers[col] if col < len(headers) else ""
-            text_bbox = draw.textbbox((0, 0), header_text, font=FONT_CONFIG['sheet'])
-            draw.text(
-                (cell_x + (cell_width - text_bbox[2]) // 2, 
-                 cell_y + (header_height - text_bbox[3]) // 2 - 3),
-                header_text,
-                fill=WHITE,
-                font=FONT_CONFIG['sheet']
-            )
-        
-        # 绘制数据行
-        for row in range(3):
-            for col in range(5):
-                cell_x = table_x + col * cell_width
-                cell_y = table_y + header_height + row * row_height
-                
-                if col == 0:
-                    final_img = add_rounded_rectangle(
-                        final_img,
-                        (cell_x, cell_y),
-                        (80, row_height),
-                        radius=0,
-                        color=(60, 60, 60),
-                        alpha=bg_alpha
-                    )
-                    
-                    label_text = row_labels[row] if row < len(row_labels) else ""
-                    text_bbox = draw.textbbox((0, 0), label_text, font=FONT_CONFIG['sheet'])
-                    draw.text(
-                        (cell_x + (80 - text_bbox[2]) // 2, 
-                         cell_y + (row_height - text_bbox[3]) // 2),
-                        label_text,
-                        fill=WHITE,
-                        font=FONT_CONFIG['sheet']
-                    )
-                else:
-                    final_img = add_rounded_rectangle(
-                        final_img,
-                        (cell_x, cell_y),
-                        (cell_width, row_height),
-                        radius=0,
-                        color=(50, 50, 50),
-                        alpha=bg_alpha
-                    )
-                    
-                    if len(progress) > row and len(progress[row]) > col - 1:
-                        progress_text = f"{progress[row][col - 1]:4d}"
-                    else:
-                        progress_text = "0d"
-                    
-                    text_bbox = draw.textbbox((0, 0), progress_text, font=FONT_CONFIG['sheet'])
-                    draw.text(
-                        (cell_x + (cell_width - text_bbox[2]) // 2, 
-                         cell_y + (row_height - text_bbox[3]) // 2),
-                        progress_text,
-                        fill=WHITE,
-                        font=FONT_CONFIG['sheet']
-                    )
-        
-        # 表格外边框
-        table_width = 5 * cell_width
-        table_height = header_height + 3 * row_height
-        final_img = add_rounded_rectangle(
-            final_img,
-            (table_x, table_y),
-            (table_width, table_height),
-            radius=border_radius,
-            color=(100, 100, 100),
-            alpha=50
-        )
-        
-        # --- 横版布局：B27歌曲显示区域 ---
-        # --- 横版布局：B27歌曲显示区域 ---
-        start_y = 280  # 增加上方信息区域间距
-        cell_width = 256 + 180 + 50
-        cell_height = 135 + 100
-        
-        # 调整元素宽度和间距以适应每行6个
-        songs_per_row = 6
-        element_width_with_spacing = 600
-         
-        # 加载overflow图片
-        try:
-            OVERFLOW = Image.open("Resource/overflow.png").convert('RGBA').resize((625, 114))
-        except:
-            try:
-                OVERFLOW = Image.open("Resource/OVERFLOW.png").convert('RGBA').resize((625, 114))
-            except:
-                OVERFLOW = None
-        
-        # 统一绘制所有元素，每行6个
-        row_height_with_gap = cell_height - 10  # 行高
-        
-        # 计算总行数
-        total_items = len(b27)
-        
-        # 确定要显示的前27个歌曲
-        display_items = min(total_items, 30)  # 最多显示27个
-        
-        # 计算显示前27个歌曲所需行数
-        songs_per_row = 6
-        display_rows = (display_items + songs_per_row - 1) // songs_per_row  # 向上取整
-        
-        # 绘制前27个歌曲
-        for idx in range(display_items):
-            if idx >= display_items:
-                break
-                
-            item = b27[idx]
-            
-            # 计算行和列
-            row_idx = idx // songs_per_row
-            col_idx = idx % songs_per_row
-            
-            # 计算位置并转换为整数
-            x = int(60 + col_idx * element_width_with_spacing)
-            y = int(start_y + row_idx * row_height_with_gap)
-            
-            # 绘制每个歌曲元素
-            draw_song_item(final_img, item, x, y, cell_width, cell_height, draw)
-        
-        # 如果超过27个，显示overflow
-        if len(b27) > 30 and OVERFLOW:
-            # 计算overflow的位置（在B27之后，B28之前）
-            overflow_y = int(start_y + display_rows * row_height_with_gap - 10)
-            overflow_x = int((target_width - 625) // 2)  # 居中显示
-            final_img.paste(OVERFLOW, (overflow_x, overflow_y), mask=OVERFLOW)
-            
-            # 在overflow之后继续绘制剩余的歌曲
-            for idx in range(30, total_items):
-                item = b27[idx]
-                
-                # 重新计算行和列（从overflow之后的行开始）
-                adjusted_idx = idx - 30
-                row_idx = display_rows + 1 + (adjusted_idx // songs_per_row)  # +1是因为overflow占一行
-                col_idx = adjusted_idx % songs_per_row
-                
-                # 计算位置并转换为整数
-                x = int(60 + col_idx * element_width_with_spacing)
-                y = int(start_y + row_idx * row_height_with_gap - 65)
-                
-                # 绘制每个歌曲元素
-                draw_song_item(final_img, item, x, y, cell_width, cell_height, draw)
-        
-        # 底部信息
-        draw.text(
-            (5, target_height - 50),
-            'Ver. ' + VERSION,
-            fill=WHITE,
-            font=FONT_CONFIG['version']
-        )
-        draw.text(
-            (target_width - 740, target_height - 50),
-            'Phigros rks Image Maker',
-            fill=WHITE,
-            font=FONT_CONFIG['version']
-        )
-        draw.text(
-            (target_width - 390, target_height - 45),
-            'open-sourced on Github',
-            fill=WHITE,
-            font=FONT_CONFIG['open-sourced']
-        )
-        
-        # 最终保存
-        try:
-            if imageType == 'JPEG':
-                output_path = output_path.replace('jpeg', "jpg")
-                final_img.convert('RGB').save(output_path, format=imageType, quality=70, optimize=True, progressive=True)
-            else:
-                final_img.convert('RGB').save(output_path, format=imageType)
-        except:
-            final_img.convert('RGB').save(output_path, format='PNG')
-    else: 
-        original_img = Image.open(a_path).convert('RGB')
-        enhancer = ImageEnhance.Brightness(original_img)
-        original_img = enhancer.enhance(0.7)
-        original_width, original_height = original_img.size
-        
-        target_width, target_height = target_size
-        
-        # 背景模糊处理
-        ratio = max(target_width / original_width, target_height / original_height)
-        new_size = (int(original_width * ratio), int(original_height * ratio))
-        
-        blurred_bg = original_img.resize(new_size, Image.LANCZOS)
-        blurred_bg = blurred_bg.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-        
-        # 裁剪背景
-        left = (blurred_bg.width - target_width) // 2
-        top = (blurred_bg.height - target_height) // 2
-        blurred_bg = blurred_bg.crop((left, top, left+target_width, top+target_height))
-        
-        final_img = Image.new("RGBA", target_size)
-        final_img.paste(blurred_bg, (0, 0))
-        
-        # 绘制头像
-        
-        ava=''
-        try:
-            ava = Image.open(f'avatar/{avatar}.png').convert('RGBA')
-            ava_round = add_corners(ava, 5)
-            final_img.paste(ava_round, (64, 64), ava_round)    
-        # except Exception as e:
-            #     fuck(f'找不到头像png文件, 请检查avatar是否为最新数据:{e}',5)
-        except:
-            ava = Image.new("RGBA",(64,64),(57,197,187))
-            ava_round = add_corners(ava, 5)
-        
-        if not isrksCorrect:
-            # 创建警告消息
-            warning_text = f'发现计算rks({rks})与云端获取rks({rks_savedata})不同\n请确认游戏是否更新定数或更改rks计算法则'
-            
-            # 计算文本尺寸
-            warning_font = FONT_CONFIG['warning']
-            draw = ImageDraw.Draw(final_img)
-            
-            # 获取多行文本的边界框
-            lines = warning_text.split('\n')
-            max_width = 0
-            total_height = 0
-            
-            for line in lines:
-                bbox = draw.textbbox((0, 0), line, font=warning_font)
-                line_width = bbox[2] - bbox[0]
-                line_height = bbox[3] - bbox[1]
-                max_width = max(max_width, line_width)
-                total_height += line_height
-            
-            # 设置边距
-            padding_x = 10
-            padding_y = 5
-            line_spacing = 5
-            
-            # 警告框的位置（头像下方）
-            warning_x = 64  # 与头像左对齐
-            warning_y = 64 + ava_round.height + 5  # 头像下方20px
-            
-            # 警告框尺寸
-            warning_width = max_width + padding_x * 2
-            warning_height = total_height + padding_y * 2 + line_spacing * (len(lines) - 1)
-            
-            # 绘制警告框背景（红色边框，白色背景）
-            # 先绘制白色背景
-            final_img = add_rounded_rectangle(
-                final_img,
-                (warning_x, warning_y),
-                (warning_width, warning_height),
-                radius=5,
-                color=(255, 255, 255),  # 白色背景
-                alpha=230
-            )
-            
-            # 绘制红色边框（在白色背景上叠加一个半透明的红色边框）
-            final_img = add_rounded_rectangle(
-                final_img,
-                (warning_x - 2, warning_y - 2),
-                (warning_width + 4, warning_height + 4),
-                radius=6,
-                color=(255, 0, 0),  # 红色边框
-                alpha=100
-            )
-            
-            # 绘制警告文本
-            current_y = warning_y + padding_y
-            for line in lines:
-                bbox = draw.textbbox((0, 0), line, font=warning_font)
-                line_width = bbox[2] - bbox[0]
-                line_height = bbox[3] - bbox[1]
-                
-                # 居中绘制每行文本
-                line_x = warning_x + (warning_width - line_width) // 2
-                draw.text(
-                    (line_x, current_y),
-                    line,
-                    fill=(255, 0, 0),  # 红色文字
-                    font=warning_font
-                )
-                current_y += line_height + line_spacing
-        
-        
-        
-        # --- 新增：在头像右侧绘制用户名文本框 ---
-        draw = ImageDraw.Draw(final_img)
-
-        # 计算文本框位置（头像右侧 + 20px间距）
-        username_x = 64 + ava_round.width + 20
-        username_y = 64
-
-        # 文本框背景（圆角矩形）
-        username_bg_width = 600  # 宽度可根据需要调整
-        username_bg_height = 96
-        username_bg_radius = 10
-
-        final_img = add_rounded_rectangle(
-            final_img,
-            (username_x, username_y),
-            (username_bg_width, username_bg_height),
-            radius=username_bg_radius,
-            color=(50, 50, 50),  # 深灰色背景
-            alpha=150
-        )
-
-        # 绘制用户名文本（居中）
-        username_bbox = draw.textbbox((0, 0), username, font=FONT_CONFIG['username'])
+            final_img.convert('RGB').save(output_path, format=imageType)
+    except:
+        if not isinstance(output_path, str):
+            output_path.seek(0)
+            output_path.truncate()
+        final_img.convert('RGB').save(output_path, format='PNG')
+        imageType = 'PNG'
+    return output_path if isinstance(output_path, str) else imageType
+
+def makeBackground(a_path, target_size, blur_radius, cache=None, scale=1.0):
+    """
+    曲绘调暗、缩放、高斯模糊并居中裁剪为背景板, cache为BackgroundCache时优先复用已生成的背景板
+    scale<1时先在target_size*scale的分辨率下缩放与模糊, 最后再放大到target_size
+    """
+    from PIL import Image, ImageFilter, ImageEnhance
+    if cache is not None:
+        key = cache.key(a_path, target_size, blur_radius) + (f'_s{scale}' if scale < 1 else '')
+        blurred_bg = cache.get(key, target_size)
+        if blurred_bg is not None: return blurred_bg
+    original_img = a_path if isinstance(a_path, Image.Image) else Image.open(a_path).convert('RGB')
+    enhancer = ImageEnhance.Brightness(original_img)
+    original_img = enhancer.enhance(0.7)
+    original_width, original_height = original_img.size
+    
+    target_width, target_height = target_size
+    if scale < 1:
+        target_width, target_height = max(1, round(target_width * scale)), max(1, round(target_height * scale))
+        blur_radius = blur_radius * scale
+    
+    ratio = max(target_width / original_width, target_height / original_height)
+    new_size = (int(original_width * ratio), int(original_height * ratio))
+    
+    blurred_bg = original_img.resize(new_size, Image.LANCZOS)
+    blurred_bg = blurred_bg.filter(ImageFilter.GaussianBlur(radius=blur_radius))
+    
+    # 裁剪背景
+    left = (blurred_bg.width - target_width) // 2
+    top = (blurred_bg.height - target_height) // 2
+    blurred_bg = blurred_bg.crop((left, top, left+target_width, top+target_height))
+    if scale < 1: blurred_bg = blurred_bg.resize(target_size, Image.BILINEAR)
+    if cache is not None: cache.put(key, blurred_bg)
+    return blurred_bg
+
+SONG_CELL_ORIGIN = (0, 30)         # 格子左上角在图块中的位置, 留出编号文字超出格子的部分
+SONG_CELL_SIZE = (720, 210)
+
+def songCellKey(item, style : int) -> tuple:
+    """决定成绩格子外观的全部字段, 曲绘以内容sha1区分, 重新checkout只改变mtime时仍能命中"""
+    try: digest = sourceDigest(f"illustrationLowRes/{item[0]}.png")
+    except OSError: digest = ''
+    # (songid,rank,songname,rks,difficulty,acc,score,type,fc)
+    return (VERSION, style, item[0], item[1], item[2], item[3], item[4], item[5], item[6], item[7], item[9], digest)
+
+def renderSongCell(item, style : int, atlas=None):
+    """
+    在透明图块上绘制一个成绩格子(曲绘、编号、难度标签、信息块、曲名、分数、ACC、评级图标), 不含推分建议
+    图块内的半透明元素用alpha_composite叠加, 之后再整体叠加到背景上
+    """
+    from PIL import Image, ImageDraw
+    tile = Image.new('RGBA', SONG_CELL_SIZE, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(tile)
+    x, y = SONG_CELL_ORIGIN
+
+    def rounded_rectangle(position, size, radius, color, alpha):
+        tile.alpha_composite(roundedRectangle(tuple(size), radius, color, int(alpha)), position)
+
+    # 编号
+    b_text = item[1]
+    text_bbox = textBBox(b_text, FONT_CONFIG['rank'])
+    b_width = 50
+    b_height = text_bbox[3] - text_bbox[1] + 10
+    color1 = (255, 240, 87) if item[1][0] == 'P' else (220, 220, 220)
+
+    # 歌曲插图
+    tile.paste(loadSongImage(item[0], atlas), (x + b_width, y))
+    rounded_rectangle((x + 15, y), (b_width, b_height), 5, color1, 200)
+    drawText(tile, 
+        (x + (b_width - text_bbox[2]) // 2 + 15, y + (b_height - text_bbox[3]) // 2 - 5),
+        b_text,
+        fill=(0, 0, 0),
+        font=FONT_CONFIG['rank']
+    )
 
-        
-        draw = ImageDraw.Draw(final_img)
-        username_x = 64 + ava_round.width + 20
-        username_y = 64
-        username_bg_width = 600
-        username_bg_height = 96
-        username_bg_radius = 10
-
-        final_img = add_rounded_rectangle(
-            final_img,
-            (username_x, username_y),
-            (username_bg_width, username_bg_height),
-            radius=username_bg_radius,
-            color=(50, 50, 50),
-            alpha=150
-        )
-        draw.text(
-            (username_x + (username_bg_width - username_bbox[2]) // 2, username_y + (username_bg_height - username_bbox[3]) // 2 - 5),
-            username,
-            fill=WHITE,
-            font=FONT_CONFIG['username']
-        )
-        
-        final_img = add_rounded_rectangle(
-            final_img,
-            (username_x, username_y - 28),
-            (500,30),
-            radius=5,
-            color=(50, 50, 50),
-            alpha=150
-        )
-        draw.text(
-            (username_x + 10, username_y - 28),
-            'Updated at: '+updatetime[:-7]+' UTC+08:00',
-            fill=WHITE,
-            font=FONT_CONFIG['updatetime']
-        )
-        
-        # 在username绘制代码之后添加以下内容
-
-        # 表格参数配置  
-        table_x = username_x + username_bg_width + 400  # 表格起始x坐标（username框右侧20px）
-        table_y = username_y - 10  # 与username框对齐
-        cell_width = 80  # 单元格宽度
-        cell_height = 40  # 单元格高度
-        header_height = 40  # 表头高度
-        row_height = cell_height  # 行高
-        border_radius = 5  # 圆角半径
-        bg_alpha = 150  # 背景透明度
-
-        # 表头文本
-        headers = ["", "EZ", "HD", "IN", "AT"]
-        row_labels = ["C", "FC", "AP"]
-
-        # 1. 绘制表头
-        for col in range(5):
-            cell_x = table_x + col * cell_width
-            cell_y = table_y
-            
-            # 表头单元格背景
-            final_img = add_rounded_rectangle(
-                final_img,
-                (cell_x, cell_y),
-                (cell_width if col > 0 else 80, header_height),  # 第一列较窄
-                radius=0,
-                color=(70, 70, 70),
-                alpha=bg_alpha
-            )
-            
-            # 表头文字
-            header_text = headers[col] if col < len(headers) else ""
-            text_bbox = draw.textbbox((0, 0), header_text, font=FONT_CONFIG['sheet'])
-            draw.text(
-                (cell_x + (cell_width - text_bbox[2])//2, cell_y + (header_height - text_bbox[3])//2-3),
-                header_text,
-                fill=WHITE,
-                font=FONT_CONFIG['sheet']
-            )
-
-        # 2. 绘制数据行
-        for row in range(3):
-            for col in range(5):
-                cell_x = table_x + col * cell_width
-                cell_y = table_y + header_height + row * row_height
-                
-                # 第一列特殊处理（行标签）
-                if col == 0:
-                    final_img = add_rounded_rectangle(
-                        final_img,
-                        (cell_x, cell_y),
-                        (80, row_height),  # 行标签列较窄
-                        radius=0,
-                        color=(60, 60, 60),
-                        alpha=bg_alpha
-                    )
-                    
-                    label_text = row_labels[row] if row < len(row_labels) else ""
-                    text_bbox = draw.textbbox((0, 0), label_text, font=FONT_CONFIG['sheet'])
-                    draw.text(
-                        (cell_x + (80 - text_bbox[2])//2, cell_y + (row_height - text_bbox[3])//2),
-                        label_text,
-                        fill=WHITE,
-                        font=FONT_CONFIG['sheet']
-                    )
-                else:
-                    # 数据单元格背景
-                    final_img = add_rounded_rectangle(
-                        final_img,
-                        (cell_x, cell_y),
-                        (cell_width, row_height),
-                        radius=0,
-                        color=(50, 50, 50),
-                        alpha=bg_alpha
-                    )
-                    
-                    # 进度数据（确保progress数组存在且足够大）
-                    if len(progress) > row and len(progress[row]) > col-1:
-                        progress_text = f"{progress[row][col-1]:4d}"
-                    else:
-                        progress_text = "0d"
-                        
-                    text_bbox = draw.textbbox((0, 0), progress_text, font=FONT_CONFIG['sheet'])
-                    draw.text(
-                        (cell_x + (cell_width - text_bbox[2])//2, cell_y + (row_height - text_bbox[3])//2),
-                        progress_text,
-                        fill=WHITE,
-                        font=FONT_CONFIG['sheet']
-                    )
-
-        # 3. 添加表格外边框（可选）
-        table_width = 5 * cell_width
-        table_height = header_height + 3 * row_height
-        final_img = add_rounded_rectangle(
-            final_img,
-            (table_x, table_y),
-            (table_width, table_height),
-            radius=border_radius,
-            color=(100, 100, 100),
-            alpha=50,  # 半透明边框
-        )
-        
-        # --- 新增：在用户名下方绘制RKS显示框 ---
-        
-        # 计算RKS文本框位置（用户名下方 + 10px间距）
-        # 1. 原始数据
-        main_txt = f'{int(rks)}.{int((rks-int(rks))*100)}'    
-        tiny_txt = f'{int(rks * 1000000) % 10000:04d}' 
-
-        # 2. 字体
-        font_main = FONT_CONFIG['rks']              # 正常字号
-        font_tiny = FONT_CONFIG['rks_small']  # 小号，需提前加载
-
-        # 3. 量尺寸
-        main_bbox = draw.textbbox((0, 0), main_txt, font=font_main)
-        tiny_bbox = draw.textbbox((0, 0), tiny_txt, font=font_tiny)
-
-        main_w = main_bbox[2] - main_bbox[0]
-        tiny_w = tiny_bbox[2] - tiny_bbox[0]
-        total_w = main_w + tiny_w                 # 两段文字总宽
-        max_h = main_bbox[3] - main_bbox[1]
-
-        # 4. 背景框尺寸（左右 25 px、上下 20 px 边距）
-        rks_bg_width  = total_w + 35
-        rks_bg_height = max_h + 10
-        rks_x = username_x            # 与用户名左对齐
-        rks_y = username_y + username_bg_height
-
-        # 5. 画圆角背景
-        final_img = add_rounded_rectangle(
-            final_img,
-            (rks_x, rks_y),
-            (rks_bg_width, rks_bg_height + 4),
-            radius=6,
-            color=(230, 230, 230),
-            alpha=230
-        )
+    # 难度标签
+    if item[0] != 'No Data':
+        diff_type = item[7]
+        tag_size = (70, 45)
+        tag_pos = (x + b_width, y + 135 - tag_size[1] + 27)
+        rounded_rectangle(tag_pos, tag_size, 5, DIFFICULTY_COLORS.get(diff_type, WHITE), 200)
+
+        diff_text = f'{diff_type} {item[4]}\n' + '%.3f' % item[3]
+        text_bbox = textBBox(diff_text, FONT_CONFIG['difficulty'])
+        xx, yy = tag_pos[0] + (tag_size[0] - text_bbox[2]) // 2, tag_pos[1] + 5
+        for line in diff_text.split('\n'):
+            drawText(tile, (xx, yy), line, font=FONT_CONFIG['difficulty'], fill=WHITE)
+            yy += -2 + int(17 * 4 / 3)
+
+    # 信息块
+    info_block_width = 240
+    info_block_height = 130
+    info_pos = (x + b_width + 256 + 50, y + (135 - info_block_height) // 2 + 25)
+    info_block = loadAsset('Resource/infoblock.png', (info_block_width, info_block_height))
+    if info_block is not None:
+        tile.alpha_composite(info_block, (info_pos[0], info_pos[1] - 10))
+
+    # 歌曲名称
+    truncated_name = truncateSongName(item[2])
+    song_name_font = FONT_CONFIG['song_name_bigger'] if len(item[2]) <= 15 else FONT_CONFIG['song_name']
+    name_bbox = textBBox(truncated_name, song_name_font)
+    if style == 0:
+        name_x = info_pos[0] + 100 - name_bbox[2] / 2 + 25
+    else:
+        name_x = info_pos[0] + (info_block_width - (name_bbox[2] - name_bbox[0])) // 2
+    draw.text((name_x, info_pos[1]), truncated_name, fill=WHITE, font=song_name_font)
+
+    # 分数
+    score_text = f"{item[6]}"
+    score_bbox = textBBox(score_text, FONT_CONFIG['score'])
+    drawText(tile, 
+        (info_pos[0] + 100 - score_bbox[2] / 2 + 40, info_pos[1] + 30),
+        score_text,
+        fill=WHITE,
+        font=FONT_CONFIG['score']
+    )
 
-        # 6. 文字纵向居中基准线
-        base_y = rks_y + (rks_bg_height - max_h) // 2
+    # ACC
+    acc_val = item[5]
+    main_text = f'{acc_val:05.2f}'
+    tiny_text = f'{int(acc_val * 10000) % 100:02d}'
+    font_main = FONT_CONFIG['accuracy']
+    font_tiny = FONT_CONFIG['accuracy_small']
+    acc_x = info_pos[0] + 36 + 35
+    acc_y = info_pos[1] + 65
+    drawText(tile, (acc_x, acc_y), main_text, fill=WHITE, font=font_main)
+    main_w = textBBox(main_text, font_main)[2]
+    drawText(tile, (acc_x + main_w, acc_y + 7), tiny_text, fill=WHITE, font=font_tiny)
+    tiny_w = textBBox(tiny_text, font_tiny)[2]
+    drawText(tile, (acc_x + main_w + tiny_w, acc_y), '%', fill=WHITE, font=font_main)
+
+    # 评级图标
+    score = item[6]
+    if score == 1000000: icon_name = "Phi.png"
+    elif item[9]: icon_name = "FC.png"
+    elif score >= 960000: icon_name = "V.png"
+    elif score >= 920000: icon_name = "S.png"
+    elif score >= 880000: icon_name = "A.png"
+    elif score >= 820000: icon_name = "B.png"
+    elif score >= 700000: icon_name = "C.png"
+    else: icon_name = "F.png"
+    icon = loadAsset("Resource/" + icon_name, (74, 74))
+    if icon is not None:
+        tile.alpha_composite(icon, (info_pos[0], info_pos[1] + 25))
+    return tile
+
+def songCellTile(item, style : int, atlas=None, cell_cache=None):
+    """成绩格子图块, cell_cache为SongCellCache时复用相同成绩已绘制好的图块"""
+    tile, key = None, None
+    if cell_cache is not None:
+        key = cell_cache.key(songCellKey(item, style))
+        tile = cell_cache.get(key, SONG_CELL_SIZE)
+    if tile is None:
+        tile = renderSongCell(item, style, atlas)
+        if cell_cache is not None: cell_cache.put(key, tile)
+    return tile
+
+def songCellTiles(b27, style : int, atlas=None, cell_cache=None, executor=None):
+    """
+    按顺序返回所有成绩格子的图块, executor为ThreadPoolExecutor时在线程池中并行绘制
+    缩放、粘贴、叠加与读取缓存时Pillow会释放GIL, 各个图块互不影响
+    """
+    if executor is None:
+        return (songCellTile(item, style, atlas, cell_cache) for item in b27)
+    return executor.map(songCellTile, b27, repeat(style), repeat(atlas), repeat(cell_cache))
+
+# 两种ImageStyle的布局参数, 坐标为负数时从图片右侧/底部算起
+STYLE_LAYOUTS = {
+    0 : {       # 横版
+        'username' : (400, 96),             # 用户名框尺寸, 位于头像右侧20px
+        'username_layers' : 1,              # 用户名框叠加的层数
+        'rks_gap' : 10,                     # 用户名框与rks框的间距
+        'table' : (400, 0),                 # 成绩统计表格相对用户名框右上角的位置
+        'challenge_icon' : (None, -5),      # 挑战模式图标(先缩小到的尺寸, 相对rks框的纵向偏移)
+        'data_text' : None,                 # 数据文字相对数据图标左侧的位置, None时紧接图标
+        'grid' : ((60, 280), (600, 225), 6),    # 成绩格子(第一个格子的位置, 间距, 每行数量)
+        'overflow' : (30, None, 160),       # 成绩数超过该值时显示OVERFLOW(阈值, 位置, 第31个起下移), 位置为None时居中于前30个之后
+        'suggestions' : False,              # 在ACC下方绘制推分建议
+        'footer' : ((5, -50), (-740, -50), (-390, -45)),
+    },
+    1 : {       # 竖版
+        'username' : (600, 96),
+        'username_layers' : 2,
+        'rks_gap' : 0,
+        'table' : (400, -10),
+        'challenge_icon' : ((61, 20), -12),
+        'data_text' : 45,
+        'grid' : ((50, 248), (586, 215), 3),
+        'overflow' : (27, (600, 2360), 95),
+        'suggestions' : True,
+        'footer' : ((5, -50), (-615, -50), (-265, -45)),
+    },
+}
+OVERFLOW_INDEX = 30     # OVERFLOW之后的第一个成绩
+MIN_BOTTOM_MARGIN = 215 # 最后一行成绩格子顶边到图片底边的最小距离, 格子高162px, 下方为底部文字
+CHALLENGE_ICONS = {
+    1 : "Resource/green.png",
+    2 : "Resource/blue.png",
+    3 : "Resource/red.png",
+    4 : "Resource/gold.png",
+    5 : "Resource/rainbows.png",
+}
 
-        # 7. 先写主字
-        draw.text((rks_x + 15, base_y - 5), main_txt, fill=(0, 0, 0), font=font_main)
+class Layout:
+    '''
+    一种ImageStyle在确定的图片尺寸、成绩数量与头像尺寸下的静态几何, 由layoutOf缓存
+        username, table: 用户名框与成绩统计表格的左上角
+        panel: 与玩家无关的半透明框与文字(Overlay的记录), border: 表格外边框, 需要盖在表格文字上
+        progress: 表格中C/FC/AP数量的单元格, cells: 每个成绩格子的位置, overflow: OVERFLOW的位置或None
+        rows: 每行成绩格子的(第一个下标, 图块上边缘), 分条绘制时在这些位置切分
+    '''
+    def __init__(self, style : int, size : tuple, b27len : int, avatar_size : tuple):
+        spec = STYLE_LAYOUTS[style]
+        self.style = style
+        self.spec = spec
+        self.size = size
+        self.avatar_size = avatar_size
+        self.warning = (64, 64 + avatar_size[1] + 5)
+        self.username = (64 + avatar_size[0] + 20, 64)
+        self.username_size = spec['username']
+        self.rks_y = self.username[1] + self.username_size[1] + spec['rks_gap']
+        ux, uy = self.username
+        uw, uh = self.username_size
+        self.panel = [('shape', (ux, uy), (uw, uh), 10, (50, 50, 50), 150)] * spec['username_layers']
+        self.panel.append(('shape', (ux, uy - 28), (500, 30), 5, (50, 50, 50), 150))
+
+        # 成绩统计表格
+        sheet = FONT_CONFIG['sheet']
+        tx, ty = ux + uw + spec['table'][0], uy + spec['table'][1]
+        self.table = (tx, ty)
+        self.progress = []
+        for col, header in enumerate(["", "EZ", "HD", "IN", "AT"]):
+            bbox = textBBox(header, sheet)
+            self.panel.append(('shape', (tx + col * 80, ty), (80, 40), 0, (70, 70, 70), 150))
+            self.panel.append(('text', (tx + col * 80 + (80 - bbox[2]) // 2, ty + (40 - bbox[3]) // 2 - 3), header, WHITE, sheet, True))
+        for row, label in enumerate(["C", "FC", "AP"]):
+            y = ty + 40 + row * 40
+            bbox = textBBox(label, sheet)
+            self.panel.append(('shape', (tx, y), (80, 40), 0, (60, 60, 60), 150))
+            self.panel.append(('text', (tx + (80 - bbox[2]) // 2, y + (40 - bbox[3]) // 2), label, WHITE, sheet, True))
+            for col in range(1, 5):
+                self.panel.append(('shape', (tx + col * 80, y), (80, 40), 0, (50, 50, 50), 150))
+                self.progress.append((row, col - 1, tx + col * 80, y))
+        self.border = [('shape', (tx, ty), (400, 160), 5, (100, 100, 100), 50)]
+
+        # 成绩格子
+        (gx, gy), (px, py), columns = spec['grid']
+        threshold, overflow, shift = spec['overflow']
+        self.cells = [(gx + idx % columns * px, gy + idx // columns * py + (shift if idx >= OVERFLOW_INDEX else 0)) for idx in range(b27len)]
+        self.rows = [(idx, self.cells[idx][1] - SONG_CELL_ORIGIN[1]) for idx in range(0, b27len, columns)]
+        if b27len <= threshold: self.overflow = None
+        elif overflow is None: self.overflow = ((size[0] - 625) // 2, gy + ceil(OVERFLOW_INDEX / columns) * py - 10)
+        else: self.overflow = overflow
+
+        fonts = (FONT_CONFIG['version'], FONT_CONFIG['version'], FONT_CONFIG['open-sourced'])
+        texts = ('Ver. ' + VERSION, 'Phigros rks Image Maker', 'open-sourced on Github')
+        self.footer = [((x % size[0], y % size[1]), text, font) for (x, y), text, font in zip(spec['footer'], texts, fonts)]
+
+@lru_cache(maxsize=64)
+def layoutOf(style : int, size : tuple, b27len : int, avatar_size : tuple) -> Layout:
+    """按(样式, 图片尺寸, 成绩数量, 头像尺寸)缓存布局, 图片尺寸与成绩数量一一对应, 头像几乎都是128x128"""
+    return Layout(style, size, b27len, avatar_size)
+
+@lru_cache(maxsize=None)
+def challengeIcon(path : str, source : tuple = None):
+    """挑战模式图标(100x60), source不为None时先缩小到source再放大(竖版的像素风格)"""
+    from PIL import Image
+    if source is None: return loadAsset(path, (100, 60), Image.LANCZOS)
+    icon = loadAsset(path, source)
+    return None if icon is None else icon.resize((100, 60), Image.LANCZOS)
+
+def overflowImage():
+    """OVERFLOW横幅(625x114), 文件名大小写两种都可以, 找不到时为None"""
+    OVERFLOW = loadAsset("Resource/overflow.png", (625, 114))
+    if OVERFLOW is None: OVERFLOW = loadAsset("Resource/OVERFLOW.png", (625, 114))
+    return OVERFLOW
+
+def compositeText(img, xy, text : str, fill, font):
+    """在透明图层上绘制文字, 与drawText不同按alpha叠加, 图层叠加到背景后与直接在背景上drawText相同"""
+    from PIL import Image
+    x, y = xy
+    sprite, left, top = textSprite(text, font, x - int(x), y - int(y))
+    glyph = Image.new('RGBA', sprite.size, tuple(fill) + (0,))
+    glyph.putalpha(sprite)
+    img.alpha_composite(glyph, (int(x) + left, int(y) + top))
+
+BASE_LAYER = True       # 与玩家无关的框与文字预先绘制为透明图层, 为False时每次绘制时重新绘制
+PATCH_MARGIN = 16       # 基础图层各部分在元素范围外多留的行数, 容纳超出框的文字
+
+def layerPatch(width : int, top : int, bottom : int, ops : list):
+    '''
+    把记录(Overlay的shape/text, 以及('image', 图片, 位置))按alpha叠加到宽width、覆盖第top到bottom行的透明图层上
+    返回裁剪到内容外接矩形的(图块, 位置), 没有内容时返回None
+    '''
+    from PIL import Image
+    layer = Image.new('RGBA', (width, bottom - top), (0, 0, 0, 0))
+    for op in ops:
+        if op[0] == 'shape':
+            _, (x, y), size, radius, color, alpha = op
+            layer.alpha_composite(roundedRectangle(size, radius, color, alpha), (x, y - top))
+        elif op[0] == 'image':
+            layer.alpha_composite(op[1], (op[2][0], op[2][1] - top))
+        else:
+            compositeText(layer, (op[1][0], op[1][1] - top), op[2], op[3], op[4])
+    bbox = layer.getbbox()
+    return None if bbox is None else (layer.crop(bbox), (bbox[0], top + bbox[1]))
 
-        # 8. 再接小字
-        draw.text((rks_x + 15 + main_w, base_y + 4), tiny_txt, fill=(0, 0, 0), font=font_tiny)
-        
-        challenge_rank = challengeModeRank
-        rank_tier = challenge_rank // 100
-        rank_number = challenge_rank % 100
-
-        # 确定图标路径
-        icon_map = {
-            1: "Resource/green.png",
-            2: "Resource/blue.png",
-            3: "Resource/red.png",
-            4: "Resource/gold.png",
-            5: "Resource/rainbows.png"
-        }
-        icon_path = icon_map.get(rank_tier, "Resource/grey.png")
+@lru_cache(maxsize=16)
+def baseLayerOf(style : int, size : tuple, b27len : int, avatar_size : tuple, version : str) -> tuple:
+    '''
+    布局中与玩家无关的部分预先绘制成的透明图层, 按(样式, 图片尺寸, 成绩数量, 头像尺寸, VERSION)缓存
+    返回(下层, 上层): 下层为用户名与更新时间的框、表格的单元格与表头行标签、OVERFLOW, 在成绩格子之前叠加;
+    上层为底部文字, 与原来一样在成绩格子之后叠加. 每部分只绘制在覆盖它的横条上, 为[(图块, 位置)]
+    '''
+    layout = layoutOf(style, size, b27len, avatar_size)
+    width, height = size
+    shapes = [op for op in layout.panel if op[0] == 'shape']
+    top = min(op[1][1] for op in shapes) - PATCH_MARGIN
+    bottom = max(op[1][1] + op[2][1] for op in shapes) + PATCH_MARGIN
+    under = [layerPatch(width, max(0, top), min(height, bottom), layout.panel)]
+    OVERFLOW = overflowImage()
+    if layout.overflow is not None and OVERFLOW is not None:
+        under.append(layerPatch(width, layout.overflow[1], layout.overflow[1] + OVERFLOW.height, [('image', OVERFLOW, layout.overflow)]))
+    footer = [('text', xy, text, WHITE, font, True) for xy, text, font in layout.footer]
+    over = [layerPatch(width, max(0, min(xy[1] for xy, text, font in layout.footer) - PATCH_MARGIN), height, footer)]
+    return [i for i in under if i is not None], [i for i in over if i is not None]
+
+def addWarning(overlay, layout : Layout, rks, rks_savedata):
+    """头像下方的数据不同步警告"""
+    warning_font = FONT_CONFIG['warning']
+    lines = f'发现计算rks({rks})与云端获取rks({rks_savedata})不同\n请确认游戏是否更新定数或更改rks计算法则'.split('\n')
+    bboxes = [textBBox(line, warning_font) for line in lines]
+    max_width = max(bbox[2] - bbox[0] for bbox in bboxes)
+    total_height = sum(bbox[3] - bbox[1] for bbox in bboxes)
+    padding_x, padding_y, line_spacing = 10, 5, 5
+    warning_x, warning_y = layout.warning
+    warning_width = max_width + padding_x * 2
+    warning_height = total_height + padding_y * 2 + line_spacing * (len(lines) - 1)
+
+    # 白色背景上叠加半透明的红色边框
+    overlay.add((warning_x, warning_y), (warning_width, warning_height), radius=5, color=(255, 255, 255), alpha=230)
+    overlay.add((warning_x - 2, warning_y - 2), (warning_width + 4, warning_height + 4), radius=6, color=(255, 0, 0), alpha=100)
+    current_y = warning_y + padding_y
+    for line, bbox in zip(lines, bboxes):
+        overlay.text((warning_x + (warning_width - (bbox[2] - bbox[0])) // 2, current_y), line, fill=(255, 0, 0), font=warning_font)
+        current_y += bbox[3] - bbox[1] + line_spacing
+
+def addPlayerInfo(overlay, layout : Layout, username, updatetime, utcoffset, rks, challengeModeRank, data, progress):
+    """信息区域中与玩家有关的部分: 用户名、更新时间、rks、挑战模式、数据与C/FC/AP数量"""
+    from PIL import Image
+    spec = layout.spec
+    username_x, username_y = layout.username
+    username_bg_width, username_bg_height = layout.username_size
+    username_bbox = textBBox(username, FONT_CONFIG['username'])
+    overlay.text(
+        (username_x + (username_bg_width - username_bbox[2]) // 2, username_y + (username_bg_height - username_bbox[3]) // 2 - 5),
+        username, fill=WHITE, font=FONT_CONFIG['username'], cached=False
+    )
+    overlay.text((username_x + 10, username_y - 28), 'Updated at: ' + updatetime[:-7] + ' ' + utcoffset, fill=WHITE, font=FONT_CONFIG['updatetime'], cached=False)
+
+    # rks, 小数点后两位以后的部分用小号字体
+    main_txt = f'{int(rks)}.{int((rks - int(rks)) * 100)}'
+    tiny_txt = f'{int(rks * 1000000) % 10000:04d}'
+    font_main = FONT_CONFIG['rks']
+    font_tiny = FONT_CONFIG['rks_small']
+    main_bbox = textBBox(main_txt, font_main)
+    tiny_bbox = textBBox(tiny_txt, font_tiny)
+    main_w = main_bbox[2] - main_bbox[0]
+    max_h = main_bbox[3] - main_bbox[1]
+    rks_bg_width = main_w + tiny_bbox[2] - tiny_bbox[0] + 35
+    rks_bg_height = max_h + 10
+    rks_x, rks_y = username_x, layout.rks_y
+    overlay.add((rks_x, rks_y), (rks_bg_width, rks_bg_height + 4), radius=6, color=(230, 230, 230), alpha=230)
+    base_y = rks_y + (rks_bg_height - max_h) // 2
+    overlay.text((rks_x + 15, base_y - 5), main_txt, fill=(0, 0, 0), font=font_main)
+    overlay.text((rks_x + 15 + main_w, base_y + 4), tiny_txt, fill=(0, 0, 0), font=font_tiny)
+
+    # 挑战模式图标与等级
+    source, offset = spec['challenge_icon']
+    icon = challengeIcon(CHALLENGE_ICONS.get(challengeModeRank // 100, "Resource/grey.png"), source)
+    icon_x, icon_y = rks_x + rks_bg_width + 10, rks_y + offset
+    if icon is not None:
+        overlay.paste(icon, (icon_x, icon_y))
+        rank_font = FONT_CONFIG['challenge_rank']
+        rank_bbox = textBBox(str(challengeModeRank % 100), rank_font)
+        overlay.text((icon_x + (100 - rank_bbox[2]) // 2, icon_y + (60 - rank_bbox[3]) // 2 - 5), str(challengeModeRank % 100), fill=WHITE, font=rank_font)
+
+    # 数据框
+    data_font = FONT_CONFIG['data']
+    data_box_width = 30 + 8 + int(textLength(data, data_font)) + 35
+    data_box_height = 40
+    data_box_pos = (icon_x + 100 + 20, icon_y + 12)
+    overlay.add(data_box_pos, (data_box_width, data_box_height), radius=5, color=(80, 80, 80), alpha=int(255 * 0.7))
+    original = loadAsset("Resource/data.png")
+    if original is not None:
+        new_height = 24
+        new_width = int(original.width * (new_height / original.height))
+        data_icon_x = data_box_pos[0] + 10
+        overlay.paste(loadAsset("Resource/data.png", (new_width, new_height), Image.LANCZOS), (data_icon_x, data_box_pos[1] + (data_box_height - new_height) // 2))
+        data_text_x = data_icon_x + (new_width + 10 if spec['data_text'] is None else spec['data_text'])
+        overlay.text((data_text_x, data_box_pos[1] + (data_box_height - data_font.size) // 2), data, fill=WHITE, font=data_font, cached=False)
+
+    # C/FC/AP数量
+    for row, col, x, y in layout.progress:
+        progress_text = f"{progress[row][col]:4d}" if len(progress) > row and len(progress[row]) > col else "0d"
+        text_bbox = textBBox(progress_text, FONT_CONFIG['sheet'])
+        overlay.text((x + (80 - text_bbox[2]) // 2, y + (40 - text_bbox[3]) // 2), progress_text, fill=WHITE, font=FONT_CONFIG['sheet'])
+
+def drawSuggestion(final_img, x, y, nxt):
+    """成绩格子ACC下方的推分建议, 底色随机"""
+    from PIL import Image, ImageDraw
+    info_pos = (x + 50 + 256 + 50, y + (135 - 130)//2 + 25)
+    y = info_pos[1] + 65
+    next_text = f"{'{:.3f}'.format(nxt) if nxt > 0 else '无法推分'}%"
+    next_font = FONT_CONFIG['next']
+    next_bbox = textBBox(next_text, next_font)
+    next_width = next_bbox[2] - next_bbox[0]
+    next_height = next_bbox[3] - next_bbox[1]
+    padding_x = 8
+    padding_y = 4
+
+    # 圆角框位于ACC右下方
+    next_box_x = info_pos[0] + 130
+    next_box_y = y + next_height + 15
+    next_box_width = next_width + padding_x * 2
+    next_box_height = next_height + padding_y * 2
+
+    # radius为高度的一半, 两侧为半圆
+    next_box = Image.new('RGBA', (next_box_width, next_box_height), (0, 0, 0, 0))
+    seed(datetime.now().timestamp())
+    ImageDraw.Draw(next_box).rounded_rectangle(
+        [(0, 0), (next_box_width - 1, next_box_height - 1)],
+        radius=next_box_height // 2,
+        fill=(randint(3,12)*16, randint(3,12)*16, randint(3,12)*16, 255)
+    )
+    final_img.paste(next_box, (next_box_x, next_box_y), next_box)
+    drawText(final_img,
+        (next_box_x + (next_box_width - next_width) // 2, next_box_y + (next_box_height - next_height) // 2 - 2),
+        next_text,
+        fill=WHITE,
+        font=next_font
+    )
 
-        # 加载并调整图标大小
+BANDED_HEIGHT = 16384           # 高于该值的图片(如MaxSongResultShowcase=-1)分条绘制并逐条编码
+BAND_ROWS = 8                   # 分条绘制时每条的成绩行数
+BANDED_BACKGROUND_SCALE = 0.25  # 分条绘制时背景在不超过该比例的分辨率下模糊
+
+class PngWriter:
+    """逐条写入RGB图片的PNG编码器, 每行使用Up滤波, 内存占用只与一条的大小有关"""
+    def __init__(self, f, size : tuple):
+        import numpy as np
+        self.f = f
+        self.width, self.height = size
+        self.compressor = zlib.compressobj(6)
+        self.previous = np.zeros(self.width * 3, dtype=np.uint8)
+        f.write(b'\x89PNG\r\n\x1a\n')
+        self.chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0))
+
+    def chunk(self, tag : bytes, data : bytes):
+        self.f.write(struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data)))
+
+    def write(self, img):
+        import numpy as np
+        rows = np.asarray(img.convert('RGB')).reshape(img.height, -1)
+        filtered = np.empty((img.height, rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 2          # Up: 与上一行相减, uint8自然按256取模
+        np.subtract(rows[0], self.previous, out=filtered[0, 1:])
+        np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+        self.previous = rows[-1].copy()
+        data = self.compressor.compress(filtered.tobytes())
+        if data: self.chunk(b'IDAT', data)
+
+    def close(self):
+        self.chunk(b'IDAT', self.compressor.flush())
+        self.chunk(b'IEND', b'')
+
+def smallBackground(a_path, target_size, blur_radius, scale):
+    '''
+    makeBackground在target_size*scale下缩放、模糊后尚未放大的背景板, 分条绘制时按条放大
+    只缩放目标区域外加模糊半径3倍的边距, 超高的图片不会生成比目标大得多的中间图片
+    '''
+    from PIL import Image, ImageFilter, ImageEnhance
+    original_img = a_path if isinstance(a_path, Image.Image) else Image.open(a_path).convert('RGB')
+    original_img = ImageEnhance.Brightness(original_img).enhance(0.7)
+    width, height = max(1, round(target_size[0] * scale)), max(1, round(target_size[1] * scale))
+    blur_radius = blur_radius * scale
+    ratio = max(width / original_img.width, height / original_img.height)
+    full_width, full_height = original_img.width * ratio, original_img.height * ratio
+    margin = ceil(blur_radius * 3)
+    left, top = (full_width - width) // 2, (full_height - height) // 2
+    box = (max(0, left - margin), max(0, top - margin), min(full_width, left + width + margin), min(full_height, top + height + margin))
+    small = original_img.resize((round(box[2] - box[0]), round(box[3] - box[1])), Image.LANCZOS, box=tuple(i / ratio for i in box))
+    small = small.filter(ImageFilter.GaussianBlur(radius=blur_radius))
+    left, top = int(left - box[0]), int(top - box[1])
+    return small.crop((left, top, left + width, top + height))
+
+def createImageBanded(layout : Layout, drawInfo, a_path, output_path, blur_radius, b27, imageType, background_scale=1.0, atlas=None, cell_cache=None, executor=None, page_rows=0):
+    '''
+    分条绘制超高的图片, 内存中只保留BAND_ROWS行成绩格子高的一条, 背景缩小后模糊再按条放大
+    page_rows为0时各条依次以PNG编码写入同一张图片(其他格式无法逐条编码, 文件名改为.png), 返回输出路径,
+    output_path为文件对象时同样写入PNG并返回'PNG'; 否则每page_rows行保存为一页 文件名_页码, 格式不变, 返回各页的路径
+    '''
+    from PIL import Image
+    width, height = layout.size
+    base_under, base_over = baseLayerOf(layout.style, layout.size, len(b27), layout.avatar_size, VERSION)
+    small = smallBackground(a_path, layout.size, blur_radius, min(background_scale, BANDED_BACKGROUND_SCALE))
+    scale_y = small.height / height
+    tops = [top for idx, top in layout.rows if 0 < top < height]
+
+    def bands(start, end):
+        inside = [top for top in tops if start <= top < end]
+        return zip([start] + inside[BAND_ROWS::BAND_ROWS], inside[BAND_ROWS::BAND_ROWS] + [end])
+
+    def drawBand(top, bottom):
+        band = small.resize((width, bottom - top), Image.BILINEAR, box=(0, top * scale_y, small.width, min(small.height, bottom * scale_y))).convert('RGBA')
+        if top == 0: drawInfo(band, base_under)
+        else: compositePatches(band, base_under, top)
+        indices = [idx for idx, (x, y) in enumerate(layout.cells) if top <= y - SONG_CELL_ORIGIN[1] < bottom]
+        drawSongCells(band, layout, b27, indices, songCellTiles([b27[i] for i in indices], layout.style, atlas, cell_cache, executor), top)
+        compositePatches(band, base_over, top)
+        return band
+
+    pages = [0] + tops[page_rows::page_rows] + [height] if page_rows > 0 and isinstance(output_path, str) else [0, height]
+    if len(pages) == 2:
+        if isinstance(output_path, str) and imageType != 'PNG': output_path = os.path.splitext(output_path)[0] + '.png'
+        f = open(output_path, 'wb') if isinstance(output_path, str) else output_path
         try:
-            icon = Image.open(icon_path).convert('RGBA').resize((61,20))
-            icon_size = (100, 60)  # 保持与RKS框相同高度
-            icon = icon.resize(icon_size, Image.LANCZOS)
-            
-            # 图标位置（RKS框右侧+10px间距）
-            icon_x = rks_x + rks_bg_width + 10
-            icon_y = rks_y - 12
-            
-            # 粘贴图标
-            final_img.paste(icon, (icon_x, icon_y), icon)
-            
-            # 在图标上绘制居中数字
-            rank_font = FONT_CONFIG['challenge_rank']
-            rank_bbox = draw.textbbox((0, 0), str(rank_number), font=rank_font)
-            
-            draw.text(
-                (icon_x + (icon_size[0] - rank_bbox[2]) // 2, 
-                icon_y + (icon_size[1] - rank_bbox[3]) // 2-5),
-                str(rank_number),
-                fill=WHITE,
-                font=rank_font
-            )
-        except Exception as e:
-            fuck(f"Failed to load challenge rank icon: {e}")
-            
-        data_font = FONT_CONFIG['data']
+            writer = PngWriter(f, layout.size)
+            for top, bottom in bands(0, height): writer.write(drawBand(top, bottom))
+            writer.close()
+        finally:
+            if isinstance(output_path, str): f.close()
+        return output_path if isinstance(output_path, str) else 'PNG'
+    root, ext = os.path.splitext(output_path)
+    paths = []
+    for n, (start, end) in enumerate(zip(pages, pages[1:]), 1):
+        page = Image.new('RGB', (width, end - start))
+        for top, bottom in bands(start, end): page.paste(drawBand(top, bottom).convert('RGB'), (0, top - start))
+        paths.append(saveImage(page, f'{root}_{n}{ext}', imageType))
+    return paths
+
+def loadAvatar(avatar):
+    """圆角头像, 找不到时为None"""
+    from PIL import Image
+    try:
+        return add_corners(Image.open(f'avatar/{avatar}.png').convert('RGBA'), 5)
+    # except Exception as e:
+        #     fuck(f'找不到头像png文件, 请检查avatar是否为最新数据:{e}',5)
+    except:
+        return None
+
+def compositePatches(img, patches, top : int = 0):
+    """把[(图块, 位置)]叠加到img上, img为整张图片从第top行开始的横条, 超出横条的部分裁掉"""
+    for patch, (x, y) in patches:
+        y -= top
+        if y >= img.height or y + patch.height <= 0: continue
+        img.alpha_composite(patch, (x, max(0, y)), (0, max(0, -y)))
+
+def drawInfoArea(final_img, layout : Layout, ava_round, base_under, username, updatetime, utcoffset, rks, challengeModeRank, data, progress, isrksCorrect, rks_savedata):
+    """头像与上方的信息区域, base_under为baseLayerOf的下层, 为None时直接绘制其中的框与文字"""
+    if ava_round is not None: final_img.paste(ava_round, (64, 64), ava_round)
+    overlay = Overlay()
+    if not isrksCorrect:
+        addWarning(overlay, layout, rks, rks_savedata)
+        overlay.composite(final_img)    # 后面的框盖在警告上, 先叠加警告
+    if base_under is not None:
+        compositePatches(final_img, base_under)
+    else:
+        overlay.extend(layout.panel)
+    addPlayerInfo(overlay, layout, username, updatetime, utcoffset, rks, challengeModeRank, data, progress)
+    overlay.composite(final_img)        # 外边框盖在表格文字上, 先叠加之前的部分
+    overlay.extend(layout.border)
+    overlay.composite(final_img)
+
+def drawSongCells(final_img, layout : Layout, b27, indices, tiles, top : int = 0):
+    """把b27中indices对应的成绩格子图块叠加到final_img, final_img为从第top行开始的横条"""
+    for idx, tile in zip(indices, tiles):
+        x, y = layout.cells[idx]
+        y -= top
+        final_img.alpha_composite(tile, (x - SONG_CELL_ORIGIN[0], y - SONG_CELL_ORIGIN[1]))
+        # 推分建议不进入图块缓存. b27[i][8]存放score[i]的推分建议, 而b27前3项为P1~P3,
+        # 所以格子idx显示的谱面即score[idx-3], 其推分建议在b27[idx-3][8], 不是错位
+        if layout.spec['suggestions'] and idx >= 3:
+            drawSuggestion(final_img, x, y, b27[idx - 3][8])
+
+def createImage(a_path, output_path, target_size, blur_radius, avatar, b27, username, rks, challengeModeRank, data, updatetime, progress, style, imageType, isrksCorrect, rks_savedata, background_cache=None, background_scale=1.0, atlas=None, cell_cache=None, utcoffset='UTC+08:00', executor=None, page_rows=0):
+    '''
+    按STYLE_LAYOUTS中的布局绘制成绩图片, 两种ImageStyle共用, executor见songCellTiles
+    图片高于BANDED_HEIGHT或成绩行数多于page_rows(不为0时)时改为createImageBanded分条绘制
+    返回值见saveImage与createImageBanded; output_path为文件对象时不分页, 超高的图片只能写入PNG
+    '''
+    from PIL import Image
+    # (songid,rank,songname,rks,difficulty,acc,score,type,nxt,fc)
+    target_size = tuple(target_size)
+    ava_round = loadAvatar(avatar)      # 找不到时按64x64的头像排版
+    layout = layoutOf(style, target_size, len(b27), (64, 64) if ava_round is None else ava_round.size)
+
+    def drawInfo(img, base_under):
+        drawInfoArea(img, layout, ava_round, base_under, username, updatetime, utcoffset, rks, challengeModeRank, data, progress, isrksCorrect, rks_savedata)
+
+    paged = 0 < page_rows < len(layout.rows)
+    if paged and not isinstance(output_path, str):
+        printwithcolor('输出到文件对象时无法分页, 忽略ResultPageRows', [33])
+        paged = False
+    if target_size[1] > BANDED_HEIGHT or paged:
+        return createImageBanded(layout, drawInfo, a_path, output_path, blur_radius, b27, imageType, background_scale, atlas, cell_cache, executor, page_rows)
+
+    # 背景模糊处理
+    blurred_bg = makeBackground(a_path, target_size, blur_radius, background_cache, background_scale)
+    final_img = Image.new("RGBA", target_size)
+    final_img.paste(blurred_bg, (0, 0))
+
+    base_under, base_over = baseLayerOf(style, target_size, len(b27), layout.avatar_size, VERSION) if BASE_LAYER else (None, None)
+    drawInfo(final_img, base_under)
+
+    # 成绩格子
+    if not BASE_LAYER and layout.overflow is not None:
+        OVERFLOW = overflowImage()
+        if OVERFLOW is not None: final_img.paste(OVERFLOW, layout.overflow, mask=OVERFLOW)
+    drawSongCells(final_img, layout, b27, range(len(b27)), songCellTiles(b27, style, atlas, cell_cache, executor))
+
+    # 底部信息
+    if BASE_LAYER:
+        compositePatches(final_img, base_over)
+    else:
+        for xy, text, font in layout.footer:
+            drawText(final_img, xy, text, fill=WHITE, font=font)
+    return saveImage(final_img, output_path, imageType)
 
-        # 1. 计算数据框宽度（动态调整）
-        data_icon = Image.open("Resource/data.png").convert('RGBA')
-        data_icon_size = (30, 30)  # 数据图标大小
-        data_icon = data_icon.resize(data_icon_size, Image.LANCZOS)
-        
-        data_text_width = draw.textlength(data, font=data_font)
-        data_box_width = data_icon_size[0] + 8 + int(data_text_width) + 35  # 图标+间距+文字+边距
-        data_box_height = 40  # 与挑战模式图标同高
-
-        # 2. 绘制半透明背景（70%透明度）
-        data_box_pos = (icon_x + icon_size[0] + 20, icon_y+12)  # 挑战模式图标左侧-10px
-        final_img = add_rounded_rectangle(
-            final_img,
-            data_box_pos,
-            (data_box_width, data_box_height),
-            radius=5,
-            color=(80, 80, 80),  # 深灰色背景
-            alpha=int(255 * 0.7)  # 70%透明度
-        )
 
-        # 3. 粘贴数据图标（左侧居中）
-        data_icon = Image.open("Resource/data.png").convert('RGBA')
-        original_width, original_height = data_icon.size  # 原始尺寸 20x12
-        
-        # 计算等比缩放后的新尺寸（高度固定为数据框高度-8px=32px）
-        new_height = 24  # 略小于数据框高度以留出边距
-        new_width = int(original_width * (new_height / original_height))  # 20*(32/12)=53
-        
-        data_icon = data_icon.resize((new_width, new_height), Image.LANCZOS)
-        
-        # 图标位置（左侧居中，距离左边框10px）
-        data_icon_x = data_box_pos[0] + 10
-        data_icon_y = data_box_pos[1] + (data_box_height - new_height) // 2
-        final_img.paste(data_icon, (data_icon_x, data_icon_y), data_icon)
-        
-        # 调整数据文本起始位置（图标右侧+10px）
-        data_text_x = data_icon_x + new_width + 10
-
-        # 4. 绘制数据文本（右侧居中）
-        data_text_x = data_icon_x + data_icon_size[0] + 15
-        data_text_y = data_box_pos[1] + (data_box_height - data_font.size) // 2 
-        draw.text(
-            (data_text_x, data_text_y),
-            data,
-            fill=WHITE,
-            font=data_font
-        )
-        # 布局参数
-        start_y = 128 + 120 # 增加头像下方间距
-        cell_width = 256 + 180 + 50
-        cell_height = 135 + 100  # 增加行高
-
-        def truncate_text(text, max_width, font):
-            draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))  # 临时画布
-            ellipsis = "..."
-            
-            # 如果原始文本宽度 <= max_width，直接返回原文本
-            if draw.textlength(text, font=font) <= max_width:
-                return text
-            
-            # 否则逐步缩短文本并检查宽度
-            max_len = len(text)
-            while max_len > 0:
-                truncated = text[:max_len] + ellipsis
-                text_width = draw.textlength(truncated, font=font)
-                if text_width <= max_width:
-                    return truncated
-                max_len -= 1
-            
-            return ellipsis  # 极端情况（max_width极小）
-        try:
-            OVERFLOW=Image.open("Resource/overflow.png").convert('RGBA').resize((625,114))
-        except:
-            try:
-                OVERFLOW=Image.open("Resource/OVERFLOW.png").convert('RGBA').resize((625,114))
-            except Exception as e:
-                fuck(e)
-        if(len(b27)>27): final_img.paste(OVERFLOW,(600,2360),mask=OVERFLOW)
-        # 绘制所有B27元素
-        for idx, item in enumerate(b27):
-            row = idx // 3
-            col = idx % 3
-            
-            # 计算位置
-            x = 50 + col * (cell_width + 100)
-            y = start_y + row * (cell_height - 20)
-            if idx >= 30: y += 95
-            # 边界检查
-                
-            draw = ImageDraw.Draw(final_img)
-            
-            # 1. 绘制编号
-            b_text = item[1]
-            text_bbox = draw.textbbox((0,0), b_text, font=FONT_CONFIG['rank'])
-            # b_width = text_bbox[2] - text_bbox[0] + 20
-            b_width = 50
-            
-            b_height = text_bbox[3] - text_bbox[1] + 10
-            color1 = (220,220,220)
-            if(item[1][0]=='P'): color1=(255,240,87)
-            # Go 9 lines down
-            
-            # 2. 歌曲插图
-            img_path = f"illustrationLowRes/{item[0]}.png"
-            if not os.path.exists(img_path):
-                img_path = "Resource/nodata.png"
-                
-            song_img = Image.open(img_path).convert('RGB').resize((int(256*1.2), int(135*1.2)))
-            final_img.paste(song_img, (x + b_width, y))
-            
-            final_img = add_rounded_rectangle(
-                final_img,
-                (x + 15, y),
-                (b_width, b_height),
-                5,
-                color1,
-                200
-            )
-            draw.text(
-                (x + (b_width - text_bbox[2])//2 + 15, y + (b_height - text_bbox[3])//2 - 5),
-                b_text,
-                fill=(0,0,0),
-                font=FONT_CONFIG['rank']
-            )
-            
-            if(item[0] != 'No Data'):
-            # 3. 难度标签（左下角）
-                diff_type = item[7]
-                tag_size = (70, 45)
-                tag_pos = (x + b_width, y + 135 - tag_size[1] +27)  # 左下角位置
-                
-                final_img = add_rounded_rectangle(
-                    final_img,
-                    tag_pos,
-                    tag_size,
-                    5,
-                    DIFFICULTY_COLORS.get(diff_type, WHITE),
-                    200
-                )
-                
-                # 难度文字
-                diff_text = f'{diff_type} {item[4]}\n'+'%.3f'%item[3]
-                text_bbox = draw.textbbox((0,0), diff_text, font=FONT_CONFIG['difficulty'])
-                # draw.text(
-                #     (tag_pos[0] + (tag_size[0]-text_bbox[2])//2, tag_pos[1]),
-                #     diff_text,
-                #     fill=WHITE,
-                #     font=FONT_CONFIG['difficulty']
-                # )
-                xx,yy = tag_pos[0] + (tag_size[0]-text_bbox[2])//2, tag_pos[1]+5
-                for line in diff_text.split('\n'):
-                    draw.text(
-                        (xx, yy),
-                        line, 
-                        font=FONT_CONFIG['difficulty'], 
-                        fill=WHITE
-                    )
-                    yy += -2 + int(17*4/3)
-            # 1. 定义info_block的尺寸
-            info_block_width = 240
-            info_block_height = 130
-            # 2. 绘制info_block（圆角矩形背景）
-            info_pos = (x + b_width + 256 + 50, y + (135 - info_block_height)//2 + 25)
-            # final_img = add_rounded_rectangle(
-            #     final_img,
-            #     info_pos,
-            #     (info_block_width, info_block_height),
-            #     radius=5,
-            #     color=INFO_BLOCK_COLOR,
-            #     alpha=200
-            # )
-            info_block = Image.open('Resource/infoblock.png').convert('RGBA').resize((info_block_width,info_block_height))
-            final_img.paste(info_block, (info_pos[0], info_pos[1] - 10), info_block)
-            # 3. 计算居中坐标（关键修改）
-            def get_centered_x(text, font, box_width):
-                """计算文本在指定宽度内的居中x坐标"""
-                text_bbox = draw.textbbox((0, 0), text, font=font)
-                text_width = text_bbox[2] - text_bbox[0]
-                return (box_width - text_width) // 2
-
-            # 4. 绘制歌曲名称（居中）
-            max_name_width = 200
-            truncated_name = truncate_text(item[2], max_name_width, FONT_CONFIG['song_name'])
-            song_name_font = FONT_CONFIG['song_name']
-            if len(item[2]) <= 15:
-                song_name_font = FONT_CONFIG['song_name_bigger']
-
-            # 计算居中位置
-            name_x = info_pos[0] + get_centered_x(truncated_name, song_name_font, info_block_width)
-            draw.text(
-                (name_x, info_pos[1]),  # y坐标保持原样
-                truncated_name,
-                fill=WHITE,
-                font=song_name_font
-            )
+@lru_cache(maxsize=None)
+def loadTimeZone(name : str):
+    """按名称获取时区, 每个名称只查找一次; 未知的时区回退到Asia/Shanghai"""
+    from zoneinfo import ZoneInfo
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        printwithcolor(f'无法识别时区{name}, 使用{DEFAULT_TIMEZONE}', [33])
+        return ZoneInfo(DEFAULT_TIMEZONE)
 
-            
-            # # 5. 绘制分数（居中）
-            # score_text = f"{item[6]}"
-            # score_x = info_pos[0] + get_centered_x(score_text, FONT_CONFIG['score'], info_block_width)
-            # draw.text(
-            #     (score_x, info_pos[1] + 25),
-            #     score_text,
-            #     fill=WHITE,
-            #     font=FONT_CONFIG['score']
-            # )
-            # 4. 右侧信息块
-            '''info_pos = (x + b_width + 256, y + (135 - 90)//2)
-            final_img = add_rounded_rectangle(
-                final_img,
-                info_pos,
-                (225, 110),  # 增大尺寸
-                radius=0,
-                color=INFO_BLOCK_COLOR,
-                alpha=200  # 60%透明度
-            )
-            
-            # 歌曲名称（白色，自动截断）
-            
-            max_name_width = 200
-            truncated_name = truncate_text(item[2], max_name_width, FONT_CONFIG['song_name'])
-            song_name_font = FONT_CONFIG['song_name']
-            if(len(item[2]) <= 15): song_name_font=FONT_CONFIG['song_name_bigger']
-            name_bbox = draw.textbbox((0,0), truncated_name, font=song_name_font)
-            draw.text(
-                (info_pos[0] + 100 - name_bbox[2]/2, info_pos[1] + 5),
-                truncated_name,
-                fill=WHITE,
-                font=song_name_font
-            )'''
-            
-            # 分数显示（无逗号，加粗）
-            score_text = f"{item[6]}"
-            score_bbox = draw.textbbox((0,0), score_text, font=FONT_CONFIG['score'])
-            draw.text(
-                (info_pos[0] + 100 - score_bbox[2]/2+40, info_pos[1] + 30),
-                score_text,
-                fill=WHITE,
-                font=FONT_CONFIG['score']
-            )
-            
-            # 分割线（右移10px）
-            line_start = (info_pos[0] + 36, info_pos[1] + 65)  # 右移10px
-            # draw.line([line_start, (line_start[0]+128, line_start[1])], 
-            #          fill=WHITE, width=4)
-            
-            # ACC
-            acc_val = item[5]          # float
-            main_text = f'{acc_val:05.2f}'           # "96.42"
-            tiny_text = f'{int(acc_val * 10000) % 100:02d}'  
+def localNow(name : str = DEFAULT_TIMEZONE) -> datetime:
+    """指定时区的当前时间(带tzinfo)"""
+    return datetime.now(loadTimeZone(name))
 
-            # 2. 字体
-            font_main = FONT_CONFIG['accuracy']          # 正常字号
-            font_tiny = FONT_CONFIG['accuracy_small']    # 小号字号
+def utcOffsetLabel(time : datetime) -> str:
+    """UTC+08:00格式的时区标记"""
+    offset = time.strftime('%z')
+    return f'UTC{offset[:3]}:{offset[3:5]}'
 
-            # 3. 起始坐标
-            x, y = line_start[0] + 35, line_start[1]
+def challengeModeRankToChinese(cmr : int) -> str:
+    res : str = ''
+    if(cmr//100==0): res+='灰'
+    elif(cmr//100==1): res+='绿'
+    elif(cmr//100==2): res+='蓝'
+    elif(cmr//100==3): res+='红'
+    elif(cmr//100==4): res+='金'
+    else: res+='彩'
+    res += str(cmr%100)
+    return res
 
-            # 4. 主文本
-            draw.text((x, y), main_text, fill=WHITE, font=font_main)
+def loadPhigrosLibrary():
+    """加载PhigrosLibrary并声明各函数的参数/返回类型"""
+    if(sys.platform.startswith('linux')): phigros = ctypes.CDLL("./libphigros.so")
+    elif(sys.platform.startswith('win32')): phigros = ctypes.CDLL("./phigros-64.dll")
+    else: raise Exception('暂不支持除Linux/Windows外的操作系统')
+    phigros.get_handle.argtypes = ctypes.c_char_p,
+    phigros.get_handle.restype = ctypes.c_void_p
+    phigros.free_handle.argtypes = ctypes.c_void_p,
+    phigros.get_nickname.argtypes = ctypes.c_void_p,
+    phigros.get_nickname.restype = ctypes.c_char_p
+    phigros.get_summary.argtypes = ctypes.c_void_p,
+    phigros.get_summary.restype = ctypes.c_char_p
+    phigros.get_save.argtypes = ctypes.c_void_p,
+    phigros.get_save.restype = ctypes.c_char_p
+    phigros.load_difficulty.argtypes = ctypes.c_void_p,
+    phigros.get_b19.argtypes = ctypes.c_void_p,
+    phigros.get_b19.restype = ctypes.c_char_p
+    return phigros
+
+def loadSettings(path : str = 'config.ini') -> dict:
+    """读取config.ini, 未配置的项使用默认值"""
+    settings : dict = {
+        'AutoUpdate' : True,        #自动更新数据
+        'EnterToContiune' : True,   #按下Enter以继续
+        'yywMode' : False,          #演示模式
+        'OutputLog' : True,         #是否保留历史记录
+        'MaxSongResultShowcase' : 33,
+        'ResultPictureQuality' : 'auto', #low/high/auto
+        'ImageStyle' : 1,
+        'BackgroundCache' : True,   #缓存模糊后的背景板
+        'BackgroundCacheSize' : 1024, #背景板缓存上限(MB)
+        'BackgroundScale' : 0.25,   #背景在该比例的分辨率下模糊后再放大, 1为原分辨率
+        'IllustrationAtlas' : True, #使用预先缩放好的曲绘图集
+        'SongCellCache' : True,     #缓存绘制好的成绩格子
+        'SongCellCacheSize' : 256,  #成绩格子缓存上限(MB)
+        'RenderThreads' : 1,        #并行绘制成绩格子的线程数, 1为不使用多线程
+        'ResultPageRows' : 0,       #成绩图片每页的成绩行数, 超出时分页输出, 0为不分页
+        'SkipUnchanged' : True,     #存档与曲目数据未变化时跳过计算与绘制, 沿用上次的输出
+        'TimeZone' : DEFAULT_TIMEZONE, #更新时间使用的IANA时区名
+        } 
+    if os.path.exists(path):
+        from dotenv import load_dotenv
+        load_dotenv(path)
+        for key in settings.keys():
+            try:
+                set1 = os.getenv(key).encode('UTF-8')
+                set1 = set1.decode('utf-8')
+                if(key in {'MaxSongResultShowcase', 'BackgroundCacheSize', 'SongCellCacheSize'}):
+                    set1=int(set1)
+                elif(key=='RenderThreads'):
+                    set1=max(1, int(set1))
+                elif(key=='ResultPageRows'):
+                    set1=max(0, int(set1))
+                elif(key=='ResultPictureQuality'):
+                    if(set1 in {'high','HIGH','High','png','PNG'}): set1 = 'PNG'
+                    elif(set1 in {'low','LOW','Low','jpg','JPG','JPEG','jpeg'}): set1 = 'JPEG'
+                    elif(set1 in {'WEBP','webp'}): set1 = 'WEBP'
+                    elif(set1 in {'GIF','gif'}): set1 = 'GIF'
+                    elif(set1 in {'BMP','bmp'}): set1 = 'BMP'
+                    elif(set1 in {'TIF','TIFF','tif','tiff'}): set1 = 'TIF'
+                    else: set1 = 'auto'
+                elif(key=='ImageStyle'):
+                    set1=int(set1)
+                elif(key=='BackgroundScale'):
+                    set1=min(1.0, max(0.01, float(set1)))
+                elif(key=='TimeZone'):
+                    set1=set1.strip() or DEFAULT_TIMEZONE
+                else:
+                    if(set1 in {'True', 'TRUE', 'true', '1'}): set1 = 1     # strictly enabled
+                    elif(set1 in {'False', 'FALSE', 'false', '0'}): set1 = 0 # strictly disabled
+                    else: set1 = -1          # normal case
+                settings[key] = set1
+            except:
+                pass
+            
+    if(settings['ResultPictureQuality']=='auto'):
+        try:
+            if os.environ.get('GITHUB_ACTIONS') == 'true': 
+                settings['ResultPictureQuality'] = 'JPEG'
+            else: 
+                raise Exception
+        except: settings['ResultPictureQuality'] = 'PNG'
+    return settings
+
+def loadSongInfo(path : str = 'info.tsv'):
+    """读取info.tsv, 返回(songid列表, songid->曲名)"""
+    try:
+        singlefile = open(path, 'r', encoding='utf-8')
+    except:
+        raise Exception(f'无法打开{path}文件')
+    with singlefile:
+        songid = singlefile.readlines()    
+    songname = {}
+    for idx in range(len(songid)):
+        now = songid[idx]
+        songid[idx] = now.split('\t')[0]
+        songname.update({songid[idx]:now.split('\t')[1]})
+    return songid, songname
+
+def loadDifficulty(path : str = 'difficulty.tsv'):
+    """读取difficulty.tsv, 返回(songid->4个难度定数, 原始行, 谱面总数)"""
+    try:
+        difffile = open(path, 'r', encoding='utf-8')
+    except:
+        raise Exception(f'无法打开{path}文件')
+    with difffile:
+        contect = difffile.readlines()
+    diff = {}
+    for idx in range(len(contect)):
+        contect[idx] = contect[idx].rstrip('\n')
+    chartsum = 0
+    for i in contect:
+        sum = i.count('\t')
+        str1 = i.split('\t')
+        chartsum+=sum
+        if sum == 3:
+            diff[str1[0]] = [float(str1[1]), float(str1[2]), float(str1[3]), 0.0]
+        else:
+            diff[str1[0]] = [float(str1[1]), float(str1[2]), float(str1[3]), float(str1[4])]
+    return diff, contect, chartsum
 
-            # 5. 第 3、4 位（紧接主文本右侧，y 稍下沉）
-            #   textbbox 返回 (left, top, right, bottom)
-            main_w = draw.textbbox((0, 0), main_text, font=font_main)[2]  # 宽度 = right
-            draw.text((x + main_w, y + 7), tiny_text, fill=WHITE, font=font_tiny)
+def loadChartData() -> dict:
+    """解析info.tsv与difficulty.tsv, 结果由TableCache缓存"""
+    songid, songname = loadSongInfo()
+    diff, contect, chartsum = loadDifficulty()
+    return {'songid':songid, 'songname':songname, 'diff':diff, 'contect':contect, 'chartsum':chartsum}
 
-            # 6. 百分号（紧接小字右侧）
-            tiny_w = draw.textbbox((0, 0), tiny_text, font=font_tiny)[2]
-            draw.text((x + main_w + tiny_w, y), '%', fill=WHITE, font=font_main)
-            
-            if(idx>=3):
-                next_text = f"{'{:.3f}'.format(b27[idx-3][8],3) if (b27[idx-3][8]>0) else '无法推分'}%"
-                
-                # 使用较小字体
-                next_font = FONT_CONFIG['next']
-                
-                # 计算文本尺寸
-                next_bbox = draw.textbbox((0, 0), next_text, font=next_font)
-                next_width = next_bbox[2] - next_bbox[0]
-                next_height = next_bbox[3] - next_bbox[1]
-                
-                # 设置圆角框边距
-                padding_x = 8
-                padding_y = 4
-                
-                
-                # 圆角框的起始位置（ACC右侧，稍微向下偏移）
-                next_box_x = info_pos[0] + 130
-                next_box_y = y + next_height +  15  # 在ACC下方稍微偏移
-                
-                # 圆角框尺寸
-                next_box_width = next_width + padding_x * 2
-                next_box_height = next_height + padding_y * 2
-                
-                # 绘制完全圆角的底色框（radius = next_box_height/2 实现完全圆角）
-                next_box_radius = next_box_height // 2
-                
-                # 创建临时图像绘制圆角矩形
-                next_box = Image.new('RGBA', (next_box_width, next_box_height), (0, 0, 0, 0))
-                next_draw = ImageDraw.Draw(next_box)
-                
-                seed(datetime.now().timestamp())
-                
-                # 绘制完全圆角矩形（两侧为半圆）
-                next_draw.rounded_rectangle(
-                    [(0, 0), (next_box_width - 1, next_box_height - 1)],
-                    radius=next_box_radius,
-                    fill=(randint(3,12)*16, randint(3,12)*16, randint(3,12)*16, 255)
-                )
-                
-                # 将圆角框粘贴到主图像上
-                final_img.paste(next_box, (next_box_x, next_box_y), next_box)
-                
-                # 在圆角框内绘制白色文本（居中）
-                next_text_x = next_box_x + (next_box_width - next_width) // 2
-                next_text_y = next_box_y + (next_box_height - next_height) // 2
-                
-                draw.text(
-                    (next_text_x, next_text_y-2),
-                    next_text,
-                    fill=WHITE,  # 白色文本
-                    font=next_font
-                )
-            
-            # 评级图标
-            icon_path = "Resource/"
-            score = item[6]
-            if score == 1000000:
-                icon_path += "Phi.png"
-            elif item[9]:
-                icon_path += "FC.png"
-            else:
-                if score >= 960000: icon_path += "V.png"
-                elif score >=920000: icon_path += "S.png"
-                elif score >=880000: icon_path += "A.png"
-                elif score >=820000: icon_path += "B.png"
-                elif score >=700000: icon_path += "C.png"
-                else: icon_path += "F.png"
-            if os.path.exists(icon_path):
-                icon = Image.open(icon_path).convert('RGBA').resize((74,74))
-                final_img.paste(icon, (info_pos[0], info_pos[1]+25), icon)
-        draw.text(
-            (5, target_size[1]-50),
-            'Ver. '+VERSION,
-            fill=WHITE,
-            font=FONT_CONFIG['version']
-        )
-        draw.text(
-            (1260, target_size[1]-50),
-            'Phigros rks Image Maker',
-            fill=WHITE,
-            font=FONT_CONFIG['version']
-        )
-        draw.text(
-            (1610, target_size[1]-45),
-            'open-sourced on Github',
-            fill=WHITE,
-            font=FONT_CONFIG['open-sourced']
-        )
-        # 最终保存
+class RksImageMaker:
+    '''
+    一次性加载PhigrosLibrary、info.tsv、difficulty.tsv等资源,
+    之后可反复对多个玩家调用 fetch -> compute -> render
+    '''
+    def __init__(self, settings : dict = None, keepIllustrations : bool = False):
+        self.settings = settings if settings is not None else loadSettings()
+        self.phigros = loadPhigrosLibrary()
+        data, digests = TableCache().load(loadChartData)
+        self.songid, self.songname = data['songid'], data['songname']
+        self.diff, self.contect, self.chartsum = data['diff'], data['contect'], data['chartsum']
+        self.chartTable = None
+        self.dataVersion = digests
+        self.maxRks = None
+        self.songNamesReady = False
+        self.illustrations = [i for i in os.listdir('illustrationLowRes') if i.endswith('.png')]
+        self.keepIllustrations = keepIllustrations
+        self.illustrationCache = {}
+        self.backgroundCache = None
+        if self.settings['BackgroundCache']:
+            self.backgroundCache = BackgroundCache(maxSize=self.settings['BackgroundCacheSize']*1024*1024)
+        self.atlas = IllustrationAtlas(size=SONG_IMAGE_SIZE) if self.settings['IllustrationAtlas'] else None
+        self.cellCache = None
+        if self.settings['SongCellCache']:
+            self.cellCache = SongCellCache(maxSize=self.settings['SongCellCacheSize']*1024*1024)
+        self.executor = None
+        if self.settings['RenderThreads'] > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(self.settings['RenderThreads'])
+
+    @property
+    def charts(self):
+        """定数表, 第一次计算时才导入numpy并生成"""
+        if self.chartTable is None:
+            from rks import ChartTable
+            self.chartTable = ChartTable(self.songid, self.diff)
+        return self.chartTable
+
+    def getMaxRks(self)->float:
+        """全AP时的rks, 只有演示模式需要, 第一次调用时才排序所有定数"""
+        if self.maxRks is None:
+            allRksRanking = sorted((value[_-1] for value in self.diff.values() for _ in range(1, 5 if value[3] else 4)), reverse=True)
+            res = 0
+            for i, value in enumerate(allRksRanking[:27]):
+                res+=value
+                if i<=2: res+=value
+            self.maxRks = res/30
+        return self.maxRks
+
+    def fetch(self, sessionToken) -> dict:
+        """通过sessionToken从云端获取存档"""
+        if isinstance(sessionToken, str): sessionToken = sessionToken.encode('utf-8')
+        handle = self.phigros.get_handle(sessionToken)   # 获取handle,申请内存,参数为sessionToken
         try:
-            if(imageType == 'JPEG'):
-                output_path=output_path.replace('jpeg',"jpg")
-                final_img.convert('RGB').save(output_path, format=imageType,quality=70,optimize=True,progressive=True)
+            nickname = self.phigros.get_nickname(handle).decode('utf-8')        # 获取玩家昵称
+            if(nickname == 'ERROR:Could not find user.'):
+                raise Exception('Sessiontoken错误')
+            summary = loads(self.phigros.get_summary(handle).decode('utf-8'))
+            savedata = loads(self.phigros.get_save(handle).decode('utf-8'))
+        finally:
+            self.phigros.free_handle(handle)                 # 释放handle的内存,不会被垃圾回收,使用完handle请确保释放
+        return {'nickname':nickname, 'summary':summary, 'savedata':savedata}
+
+    def fingerprint(self, save : dict) -> str:
+        """存档、曲目数据版本与设置的sha1, 三者都未变化时输出也不会变化"""
+        content = dumps([VERSION, self.dataVersion, self.settings, save], sort_keys=True, ensure_ascii=False)
+        return sha1(content.encode('utf-8')).hexdigest()
+
+    def demo(self) -> dict:
+        """演示模式使用的全AP存档"""
+        summary={'challengeModeRank':551,'rankingScore':self.getMaxRks()}
+        savedata={'gameRecord':{},'gameProgress':{'challengeModeRank':551,'money':[3,7,4,3,0]},'user':{'avatar':''} }
+        for idx in self.contect:
+            sum = idx.count('\t')
+            str1 = idx.split('\t')
+            if sum == 3:
+                savedata['gameRecord'][str1[0]]=[1000000,100,1,1000000,100,1,1000000,100,1,0,0,0]
             else:
-                final_img.convert('RGB').save(output_path, format=imageType)
-        except:
-            final_img.convert('RGB').save(output_path, format='PNG')
-
-
-if(sys.platform.startswith('linux')): phigros = ctypes.CDLL("./libphigros.so")
-elif(sys.platform.startswith('win32')): phigros = ctypes.CDLL("./phigros-64.dll")
-else: fuck('暂不支持除Linux/Windows外的操作系统',1)
-phigros.get_handle.argtypes = ctypes.c_char_p,
-phigros.get_handle.restype = ctypes.c_void_p
-phigros.free_handle.argtypes = ctypes.c_void_p,
-phigros.get_nickname.argtypes = ctypes.c_void_p,
-phigros.get_nickname.restype = ctypes.c_char_p
-phigros.get_summary.argtypes = ctypes.c_void_p,
-phigros.get_summary.restype = ctypes.c_char_p
-phigros.get_save.argtypes = ctypes.c_void_p,
-phigros.get_save.restype = ctypes.c_char_p
-phigros.load_difficulty.argtypes = ctypes.c_void_p,
-phigros.get_b19.argtypes = ctypes.c_void_p,
-phigros.get_b19.restype = ctypes.c_char_p
-
-
-current_dir = os.getcwd()
-try: os.system(f'cd \"{current_dir}\"')
-except: printwithcolor('无法切换到文件所在目录, 可能无法正常运行',[1,31])
-settings : dict = {
-    'AutoUpdate' : True,        #自动更新数据
-    'EnterToContiune' : True,   #按下Enter以继续
-    'yywMode' : False,          #演示模式
-    'OutputLog' : True,         #是否保留历史记录
-    'MaxSongResultShowcase' : 33,
-    'ResultPictureQuality' : 'auto', #low/high/auto
-    'ImageStyle' : 1
-    } 
-
-flag1 : bool = False
-try:
-    sessionToken=str(sys.argv[1])
-    try: sessionToken=sessionToken.encode('UTF-8')
-    except: pass
+                savedata['gameRecord'][str1[0]]=[1000000,100,1,1000000,100,1,1000000,100,1,1000000,100,1]
+        return {'nickname':'Sample', 'summary':summary, 'savedata':savedata}
+
+    def compute(self, save : dict) -> dict:
+        """
+        计算rks, B27, P3, 推分建议与完成度表格, score只保留前max(27, MaxSongResultShowcase)个
+        suggestions为所有已游玩谱面的(songid, 难度, 曲名, 定数, acc, 单曲rks, 推分建议)
+        """
+        import numpy as np
+        from rks import ScoreTable, topCandidates, suggestionsOf, LEVELS
+        songid, songname = self.songid, self.songname
+        summary = save['summary']
+        gameRecords = save['savedata']['gameRecord']
+        data = save['savedata']['gameProgress']['money']
+        maxShowcase = self.settings['MaxSongResultShowcase']
+        if(maxShowcase==-1): maxShowcase = self.chartsum
+
+        table = ScoreTable(self.charts, gameRecords)
+        contribution = table.contribution()
+        constant = self.charts.constant
+        progress = table.progress(contribution)
+        contributionList, constantList = contribution.ravel().tolist(), constant.ravel().tolist()
+
+        def ranked(mask, n):
+            """mask中单曲rks最高的n个谱面, 按(rks, songid, 难度...)降序"""
+            res = []
+            for k in topCandidates(contribution, mask, n).tolist():
+                i, now = songid[k // 4], k % 4
+                res.append((
+                    contributionList[k],                #  0
+                    i,                                  #  1
+                    LEVELS[now],                        #  2
+                    constantList[k],                    #  3
+                    bool(gameRecords[i][now*3+2]),      #  4
+                    songname[i],                        #  5
+                    gameRecords[i][now*3],#score        #  6
+                    constantList[k], #difficulty        #  7
+                    gameRecords[i][now*3+1] #acc        #  8
+                    ))
+            res.sort()
+            res.reverse()
+            return res[:n]
+
+        score = ranked(contribution != 0, max(27, maxShowcase))
+        phi = ranked((contribution >= constant) & (constant != 0), 3)
+        rks = 0.0
+        for i in range(min(27,len(score))):
+            rks = rks + score[i][0]
+        for i in range(min(3,len(phi))):
+            rks = rks + phi[i][0]
+
+        rks = rks / 30.0
+
+        # B27内的谱面替换自身, 其余谱面替换B27中最低的一个; 需要AP时替换P3中最低的一个
+        inB27 = np.zeros(contribution.shape, dtype=bool)
+        for item in score[:27]: inB27[self.charts.index[item[1]], LEVELS.index(item[2])] = True
+        b27last = score[26][0] if len(score) >= 27 else 0.0
+        p3 = phi[2][0] if len(phi) >= 3 else 0.0
+        suggestion = suggestionsOf(rks, constant, contribution, inB27, b27last, p3)
+        isrksCorrect : bool = ((rks - summary['rankingScore']) <= 5e-7)
+        rks_savedata = summary['rankingScore']
+
+        b27 = [] # (songid,rank,songname,rks,difficulty,acc,score,type,nxt,fc)
+        b27len = 0
+
+        for i in range(3):
+            if(i>=len(phi)):
+                phi.append(['No Data',f'B{i+1}','No Data',0,0,0,0,0,'',0])
+                continue
+            id = phi[i][1]
+            accuary = gameRecords[phi[i][1]][classToNum(phi[i][2])*3+1]
+            scr = gameRecords[phi[i][1]][classToNum(phi[i][2])*3]
+            b27.append([id,f'P{i+1}',songname[id],phi[i][0],phi[i][3],accuary,scr,phi[i][2],'推分建议已经被砍了',phi[i][4]])
+        for i in range(maxShowcase):
+            if(i>=len(score)):
+                break
+            b27len+=1
+            id = score[i][1]
+            accuary = gameRecords[score[i][1]][classToNum(score[i][2])*3+1]
+            scr = gameRecords[score[i][1]][classToNum(score[i][2])*3]
+            b27.append([id,f'B{i+1}',songname[id],score[i][0],score[i][3],accuary,scr,score[i][2],-1.0,score[i][4]])
+
+        # 推分建议, b27[i][8]对应score[i]
+        for i in range(min(maxShowcase, len(score))):
+            b27[i][8] = float(suggestion[self.charts.index[score[i][1]], LEVELS.index(score[i][2])])
+        played = (table.score > 0) | (table.acc > 0)
+        suggestions = []    # 所有已游玩谱面, 按单曲rks降序
+        for k in np.argsort(-contribution, axis=None, kind='stable').tolist():
+            n, now = k // 4, k % 4
+            if not played[n, now] or not constant[n, now]: continue
+            suggestions.append((songid[n], LEVELS[now], songname[songid[n]], constantList[k], table.acc[n, now].item(), contributionList[k], suggestion[n, now].item()))
+
+        data_num = ''
+        if data[4]:   data_num=f'{data[4]}PiB {data[3]}TiB {data[2]}GiB {data[1]}MiB {data[0]}KiB'
+        elif data[3]: data_num=f'{data[3]}TiB {data[2]}GiB {data[1]}MiB {data[0]}KiB'
+        elif data[2]: data_num=f'{data[2]}GiB {data[1]}MiB {data[0]}KiB'
+        elif data[1]: data_num=f'{data[1]}MiB {data[0]}KiB'
+        else: f'{data[0]}KiB'
+
+        now = localNow(self.settings['TimeZone'])
+        return {
+            'nickname' : save['nickname'],
+            'summary' : summary,
+            'user' : save['savedata']['user'],
+            'gameRecords' : gameRecords,
+            'score' : score,
+            'phi' : phi,
+            'b27' : b27,
+            'b27len' : b27len,
+            'suggestions' : suggestions,
+            'progress' : progress,
+            'rks' : rks,
+            'isrksCorrect' : isrksCorrect,
+            'rks_savedata' : rks_savedata,
+            'data_num' : data_num,
+            'cmrcn' : challengeModeRankToChinese(summary['challengeModeRank']),
+            'updatetime' : now.replace(tzinfo=None),
+            'utcoffset' : utcOffsetLabel(now),
+        }
+
+    def writeResult(self, result : dict, path : str = 'result.txt'):
+        """将成绩以文字形式输出至result.txt"""
+        score, phi, b27, progress = result['score'], result['phi'], result['b27'], result['progress']
+        rks, rks_savedata = result['rks'], result['rks_savedata']
+        with open(path, 'w', encoding='utf-8') as f:
+            if(not self.settings['yywMode']): print(result['updatetime'], file=f)
+            else: print('已开启演示模式，所有成绩均为演示作用', file=f)
+            if(not result['isrksCorrect']) : print(f'\n发现计算rks({rks})与云端获取rks({rks_savedata})不同\n请确认游戏是否更新定数或更改rks计算法则\n', file=f)
+            print('昵称: ', result['nickname'], file=f)
+            print('课题模式:', result['cmrcn'], file=f)
+            print('RKS: ', result['summary']['rankingScore'], file=f)
+            print('Data: ', end='', file=f)
+            print(result['data_num'], end='\n\n', file=f)
+            print('\\    EZ   HD   IN   AT', file=f)
+            print(f'C   {progress[0][0]: 3d} {progress[0][1]: 3d} {progress[0][2]: 3d} {progress[0][3]: 3d} ', file=f)
+            print(f'FC  {progress[1][0]: 3d} {progress[1][1]: 3d} {progress[1][2]: 3d} {progress[1][3]: 3d} ', file=f)
+            print(f'AT  {progress[2][0]: 3d} {progress[2][1]: 3d} {progress[2][2]: 3d} {progress[2][3]: 3d} ', file=f)
+            print(file=f)
+            for i in range(min(3,len(phi))):
+                if phi[i][0] == 'No Data': break
+                print(f'P{i+1} {phi[i][5]} {phi[i][2]},  ACC: {"%.4f"%phi[i][8]}%, RKS: {"%.3f"%phi[i][0]}/{phi[i][7]}, Score:{phi[i][6]}', file=f)
+            print(file=f)
+            for i in range(result['b27len']):
+                print(f'B{i+1} {score[i][5]} {score[i][2]},  ACC: {"%.4f"%score[i][8]}% >> {"{:.3f}".format(b27[i][8],3) if b27[i][8]>0 else "无法推分"}%, RKS: {"%.3f"%score[i][0]}/{score[i][7]}, Score:{score[i][6]}', file=f)
+                if(i == 26):
+                    print('————OVERFLOW————', file=f)
+            print(file=f)
+            print('全部谱面推分建议:', file=f)
+            for songid, level, name, constant, acc, contribution, suggestion in result['suggestions']:
+                print(f'{name} {level} {constant},  ACC: {"%.4f"%acc}% >> {"{:.3f}".format(suggestion) if suggestion>0 else "无法推分"}%, RKS: {"%.3f"%contribution}', file=f)
+
+    def writeLog(self, result : dict, path : str = 'result.txt'):
+        """将result.txt复制到log文件夹"""
+        filename = f'{str(result["updatetime"]).replace(" ", "_").replace(":", "_").replace(".", "_")}'
+        if self.settings['yywMode']: 
+            filename = filename + "_yywmode"
+        if(os.path.exists('log')): 
+            if(not os.path.isfile('/log')): pass
+            else: os.system('mkdir log')
+        else: os.system('mkdir log')
+        
+        if(sys.platform.startswith('linux')): os.system(f'cp ./{path} ./log/{filename}.txt >/dev/null')
+        elif(sys.platform.startswith('win32')): 
+            os.system(f'copy .\\{path} .\\log\\{filename}.txt > NUL')
+
+    def targetSize(self, b27len : int) -> tuple:
+        """根据显示的成绩数量计算图片尺寸"""
+        if(self.settings['ImageStyle']==0):
+            # 横版行距为225, 高度每行只增加215, 成绩较多时按最后一行格子的位置加高
+            (gx, gy), (px, py), columns = STYLE_LAYOUTS[0]['grid']
+            last = b27len + 3 - 1
+            bottom = gy + last // columns * py + (STYLE_LAYOUTS[0]['overflow'][2] if last >= OVERFLOW_INDEX else 0) + MIN_BOTTOM_MARGIN
+            return (3750, max(1800 - floor((33-b27len)/6.0)*215, bottom))
+        return (1875, 3000 - floor((33-b27len)/3.0)*215 - (b27len <=27 if 95 else 0))
+
+    def loadIllustration(self, name : str):
+        """读取并解码曲绘, keepIllustrations为True时常驻内存"""
+        from PIL import Image
+        if name in self.illustrationCache: return self.illustrationCache[name]
+        img = Image.open(f"illustrationLowRes/{name}").convert('RGB')
+        if self.keepIllustrations: self.illustrationCache[name] = img
+        return img
+
+    def prepareSongNames(self):
+        """截断info.tsv中所有曲名, 结果按字体文件与info.tsv缓存在磁盘上, 之后的绘制直接查表"""
+        if self.songNamesReady: return
+        path, size = FONT_SPEC['song_name']
+        cache = TableCache(SONG_NAME_CACHE, (path, 'info.tsv'), (size, SONG_NAME_WIDTH))
+        names, _ = cache.load(lambda: {name : truncateSongName(name) for name in self.songname.values()})
+        TRUNCATED_NAMES.update(names)
+        self.songNamesReady = True
+
+    def render(self, result : dict, output_path = None, imageType : str = None):
+        """
+        绘制成绩图片, 返回实际输出路径, 分页输出时为各页路径的列表
+        output_path可以是BytesIO等文件对象, 此时返回实际写入的格式, 超高的图片只能写入PNG
+        """
+        self.prepareSongNames()
+        if imageType is None: imageType = self.settings['ResultPictureQuality']
+        if output_path is None: output_path = f"result.{imageType.lower()}"
+        illustration = choice(self.illustrations)
+        if self.atlas is not None and not self.atlas.built:
+            # 第一次绘制前增量更新图集, 曲绘未变化时只需stat一遍
+            try: self.atlas.build()
+            except Exception as e: printwithcolor(f'曲绘图集更新失败, 改为直接读取曲绘: {e}', [33])
+        # 图块总大小超过缓存上限时, 写入的图块会在本次绘制中互相淘汰, 不如不缓存
+        cellCache = self.cellCache if self.cellCache is not None and self.cellCache.fits(len(result['b27']), SONG_CELL_SIZE) else None
+        output = createImage(
+            a_path=f"illustrationLowRes/{illustration}" if self.backgroundCache else self.loadIllustration(illustration),
+            output_path=output_path,
+            target_size=self.targetSize(result['b27len']),
+            blur_radius=BLUR_RADIUS,
+            avatar=result['user']['avatar'],
+            b27=result['b27'],
+            username=result['nickname'],
+            rks=round(result['rks'],6),
+            challengeModeRank=result['summary']['challengeModeRank'],
+            data=result['data_num'],
+            updatetime=str(result['updatetime']),
+            utcoffset=result['utcoffset'],
+            progress=result['progress'],
+            style=self.settings['ImageStyle'],
+            imageType=imageType,
+            isrksCorrect=result['isrksCorrect'],
+            rks_savedata=result['rks_savedata'],
+            background_cache=self.backgroundCache,
+            background_scale=self.settings['BackgroundScale'],
+            atlas=self.atlas,
+            cell_cache=cellCache,
+            executor=self.executor,
+            page_rows=self.settings['ResultPageRows']
+        )
+        for cache in (self.backgroundCache, cellCache):     # 一次绘制结束后再统一淘汰
+            if cache is not None: cache.evict()
+        return output
+
+def loadRenderState(path : str = RENDER_STATE) -> dict:
     try:
-        handle = phigros.get_handle(sessionToken)
-        nickname = phigros.get_nickname(handle).decode('utf-8')        # 获取玩家昵称
-        if(nickname == 'ERROR:Could not find user.'):raise('114514')
-        flag1 = True
-    except:
-        raise('114514')
-except:
+        with open(path, 'r', encoding='utf-8') as f:
+            return load(f)
+    except (OSError, ValueError):
+        return {}
+
+def saveRenderState(state : dict, path : str = RENDER_STATE):
+    with open(path, 'w', encoding='utf-8') as f:
+        dump(state, f, ensure_ascii=False, indent=2)
+
+def isUnchanged(fingerprint : str, state : dict) -> bool:
+    """指纹与上次相同且上次的输出文件都还在"""
+    outputs = state.get('outputs')
+    return state.get('fingerprint') == fingerprint and bool(outputs) and all(os.path.exists(i) for i in outputs)
+
+def printResult(result : dict, yywMode : bool = False):
+    """在终端中彩色输出成绩"""
+    score, phi, b27, progress = result['score'], result['phi'], result['b27'], result['progress']
+    gameRecords, cmrcn, summary = result['gameRecords'], result['cmrcn'], result['summary']
+    rks, rks_savedata = result['rks'], result['rks_savedata']
+    if(not yywMode): print(result['updatetime'])
+    else: print('已开启演示模式，所有成绩均为演示作用')
+    if(not result['isrksCorrect']) : printwithcolor(f'发现计算rks({rks})与云端获取rks({rks_savedata})不同\n请确认游戏是否更新定数或更改rks计算法则',[31,1])
+    if(cmrcn[0]=='灰'):printwithcolor(cmrcn,[30,1],' ')
+    elif(cmrcn[0]=='绿'):printwithcolor(cmrcn,[32,1],' ')
+    elif(cmrcn[0]=='蓝'):printwithcolor(cmrcn,[36,1],' ')
+    elif(cmrcn[0]=='红'):printwithcolor(cmrcn,[31,1],' ')
+    elif(cmrcn[0]=='金'):printwithcolor(cmrcn,[33,1],' ')
+    else:printwithcolor(cmrcn,[35,1],' ')
+    printwithcolor('%.10f'%summary['rankingScore'], [7,1], ' ')
+    printwithcolor(result['data_num'], [1,3])
+    print('\\   ',end='')
+    printwithcolor('EZ',[1,32],'   ')
+    printwithcolor('HD',[1,36],'   ')
+    printwithcolor('IN',[1,31],'   ')
+    printwithcolor('AT',[1,37])
+    printwithcolor('C',37,'')
+    print(f'   {progress[0][0]: 3d} {progress[0][1]: 3d} {progress[0][2]: 3d} {progress[0][3]: 3d} ')
+    printwithcolor('FC',34,'')
+    print(f'  {progress[1][0]: 3d} {progress[1][1]: 3d} {progress[1][2]: 3d} {progress[1][3]: 3d} ')
+    printwithcolor('AP',33,'')
+    print(f'  {progress[2][0]: 3d} {progress[2][1]: 3d} {progress[2][2]: 3d} {progress[2][3]: 3d} ')
+    print()
+    for i in range(min(3,len(phi))):
+        if phi[i][0] == 'No Data': break
+        printwithcolor(f'P{i+1}',[43,1],' ')
+        printwithcolor(phi[i][5],0,' ')
+        printwithcolor(phi[i][2],[1],'    ')
+        printwithcolor(f'{"%.4f"%phi[i][8]}%', [1], ' ')
+        printwithcolor(f'{"%.3f"%phi[i][0]}/{phi[i][7]}', [44], ' ')
+        printwithcolor(f'{phi[i][6]}',[1,33])
+    print()
+    for i in range(result['b27len']):
+        printwithcolor(f'B{i+1}',[43,1],' ')
+        printwithcolor(score[i][5],0,' ')
+        printwithcolor(score[i][2],[1,(30+((2)if(score[i][2]=='EZ')else((4)if(score[i][2]=='HD')else((1)if(score[i][2]=='IN')else(7)))))],'\n')
+        printwithcolor(f'{"%.4f"%score[i][8]}%', [1], ' ')
+        printwithcolor(f'>> {"{:.3f}".format(b27[i][8],3) if b27[i][8]>0 else "无法推分"}%',[0,32],' ')
+        printwithcolor(f'{"%.3f"%score[i][0]}', [44], '')
+        printwithcolor(f'/{score[i][7]}',[0],' ')
+        printwithcolor(f'{score[i][6]}',[1,36])
+        if(i == 26):
+            printwithcolor('————OVERFLOW————',[0])
+
+def readSessionToken():
+    """从.env或标准输入读取sessionToken, 输入0则结束程序"""
+    sessionToken = None
     if os.path.exists('.env'):
+        from dotenv import load_dotenv
         load_dotenv('.env')
         try:
             sessionToken = os.getenv('SESSIONTOKEN').encode('UTF-8')
         except:
             sessionToken = None
-        if(not sessionToken): 
-            print('.env文件中没有SESSIONTOKEN项, 请输入Sessiontoken, 输入0则结束程序')
-            sessionToken = None
-            flag1 : bool = True
-            try:
-                while True:
-                    sessionToken : str = input().strip()
-                    if(sessionToken == '0'): break
-                    if(sessionToken != ''):
-                        flag1 = False
-                        break
-                if(flag1): sys.exit(0)  
-            except:
-                fuck('?')
+        if(sessionToken): return sessionToken
+        print('.env文件中没有SESSIONTOKEN项, 请输入Sessiontoken, 输入0则结束程序')
     else:
         print('未检测到.env文件')
         print('请输入Sessiontoken, 输入0则结束程序')
-        sessionToken = None
-        flag1 : bool = True
+    try:
         while True:
             sessionToken : str = input().strip()
-            if(sessionToken == '0'): break
-            if(sessionToken != ''):
-                flag1 = False
-                break
-        if(flag1): sys.exit(0)   
-   
-if os.path.exists('config.ini'):
-    load_dotenv('config.ini')
-    for key in settings.keys():
-        try:
-            set1 = os.getenv(key).encode('UTF-8')
-            set1 = set1.decode('utf-8')
-            if(key=='MaxSongResultShowcase'):
-                set1=int(set1)
-            elif(key=='ResultPictureQuality'):
-                if(set1 in {'high','HIGH','High','png','PNG'}): set1 = 'PNG'
-                elif(set1 in {'low','LOW','Low','jpg','JPG','JPEG','jpeg'}): set1 = 'JPEG'
-                elif(set1 in {'WEBP','webp'}): set1 = 'WEBP'
-                elif(set1 in {'GIF','gif'}): set1 = 'GIF'
-                elif(set1 in {'BMP','bmp'}): set1 = 'BMP'
-                elif(set1 in {'TIF','TIFF','tif','tiff'}): set1 = 'TIF'
-                else: set1 = 'auto'
-            elif(key=='ImageStyle'):
-                set1=int(set1)
-            else:
-                if(set1 in {'True', 'TRUE', 'true', '1'}): set1 = 1     # strictly enabled
-                elif(set1 in {'False', 'FALSE', 'false', '0'}): set1 = 0 # strictly disabled
-                else: set1 = -1          # normal case
-            settings[key] = set1
-        except:
-            pass
-        
-if(settings['ResultPictureQuality']=='auto'):
-    try:
-        if os.environ.get('GITHUB_ACTIONS') == 'true': 
-            settings['ResultPictureQuality'] = 'JPEG'
-        else: 
-            raise Exception
-    except: settings['ResultPictureQuality'] = 'PNG'
-# else:
-#     f = open('config.ini', 'w')
-#     for key, value in settings.items():
-#         f.write(f'{key}={"True" if value else "False"}\n')
-#     f.close()
-
-try:  sessionToken = sessionToken.encode('utf-8')
-except: pass
-
-# print(phigros)
-try:
-    if settings['AutoUpdate'] == 1: raise(Exception)
-    elif settings['AutoUpdate'] == -1:
-        updatefileOption = input('是否更新本地的曲绘、头像、歌曲难度、歌曲信息文件(y/n)默认为y\n')
-        if (updatefileOption == 'Y' or updatefileOption == 'y'):
-            raise(Exception)
-except Exception as e: 
-    if(e != KeyboardInterrupt):
-        try:
-            import updatefile
-            updatefile.main()
-        except Exception as e:
-            printwithcolor(f'无法更新文件{e}',[31])
-
-
-# phigros.re8.argtypes = ctypes.c_void_p,
-try:
-    singlefile = open('info.tsv', 'r', encoding='utf-8')
-except:
-    fuck('无法打开info.tsv文件',11)
-songid = singlefile.readlines()    
-songname = {}
-for idx in range(len(songid)):
-    now = songid[idx]
-    songid[idx] = now.split('\t')[0]
-    songname.update({songid[idx]:now.split('\t')[1]})
-# print(songname)
-# print(gameRecords)
-try:
-    difffile = open('difficulty.tsv', 'r', encoding='utf-8')
-except:
-    fuck('无法打开difficulty.tsv文件',11)
-diff = {}
-allRksRanking = {}
-contect = difffile.readlines()
-for idx in range(len(contect)):
-    contect[idx] = contect[idx].rstrip('\n')
-# print(contect)
-for i in contect:
-    sum = i.count('\t')
-    str1 = i.split('\t')
-    if sum == 3:
-        diff[str1[0]] = [float(str1[1]), float(str1[2]), float(str1[3]), 0.0]
-        for _ in range(1,4):
-            allRksRanking[(str1[0],_)]=[diff[str1[0]][_-1]]
-    else:
-        diff[str1[0]] = [float(str1[1]), float(str1[2]), float(str1[3]), float(str1[4])]
-        for _ in range(1,5):
-            allRksRanking[(str1[0],_)]=[diff[str1[0]][_-1]]
-allRksRanking = sorted(allRksRanking.items(), key=lambda x: x[1])
-allRksRanking.reverse()
-def getMaxRks()->int:
-    res = 0
-    for idx,i in zip(allRksRanking,range(0,min(27,len(allRksRanking)))):
-        res+=idx[1][0]
-        if i<=2: res+=idx[1][0]
-    return res/30
-
-if not settings['yywMode']:
-        
-    try:
-        if(not flag1): handle = phigros.get_handle(sessionToken)   # 获取handle,申请内存,参数为sessionToken
-    except Exception as e:
-        fuck(e)
-    # print(handle)
-    nickname = phigros.get_nickname(handle).decode('utf-8')        # 获取玩家昵称
-    if(nickname == 'ERROR:Could not find user.'):
-        fuck('Sessiontoken错误',4)
-    summary = loads(phigros.get_summary(handle).decode('utf-8'))
-    savedata = loads(phigros.get_save(handle).decode('utf-8'))
-    gameRecords = savedata['gameRecord']
-    data = savedata['gameProgress']['money']
-    user = savedata['user']
-    # with open("1.txt", 'w', encoding='utf-8') as f:
-    #     print(gameRecords, file=f)
-    # print(savedata)             # 获取存档
-else:
-    nickname = 'Sample'
-    summary={'challengeModeRank':551,'rankingScore':getMaxRks()}
-    user = {'avatar':''}
-    savedata={'gameRecord':{},'gameProgress':{'challengeModeRank':551,'money':[3,7,4,3,0]} }
-    for idx in contect:
-        sum = idx.count('\t')
-        str1 = idx.split('\t')
-        if sum == 3:
-            savedata['gameRecord'][str1[0]]=[1000000,100,1,1000000,100,1,1000000,100,1,0,0,0]
-        else:
-            savedata['gameRecord'][str1[0]]=[1000000,100,1,1000000,100,1,1000000,100,1,1000000,100,1]
-    gameRecords = savedata['gameRecord']
-    data = savedata['gameProgress']['money']
-        
-singlefile = open('info.tsv', 'r', encoding='utf-8')
-songid = singlefile.readlines()    
-songname = {}
-for idx in range(len(songid)):
-    now = songid[idx]
-    songid[idx] = now.split('\t')[0]
-    songname.update({songid[idx]:now.split('\t')[1]})
-# print(songname)
-# print(gameRecords)
-difffile = open('difficulty.tsv', 'r', encoding='utf-8')
-diff = {}
-contect = difffile.readlines()
-for idx in range(len(contect)):
-    contect[idx] = contect[idx].rstrip('\n')
-# print(contect)
-chartsum = 0
-for i in contect:
-    sum = i.count('\t')
-    str1 = i.split('\t')
-    chartsum+=sum
-    if sum == 3:
-        diff[str1[0]] = [float(str1[1]), float(str1[2]), float(str1[3]), 0.0]
-    else:
-        diff[str1[0]] = [float(str1[1]), float(str1[2]), float(str1[3]), float(str1[4])]
-
-if(settings['MaxSongResultShowcase']==-1): settings['MaxSongResultShowcase'] = chartsum
-
-rksContribution = {}
-score = []
-phi = []
-progress = [[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]]
-levelToNumMap = {'EZ':0, 'HD':1, 'IN':2, 'AT':3, 0:'EZ', 1:'HD', 2:'IN', 3:'AT'}
-for i in songid: 
-    rksContribution[i] = [0.0, 0.0, 0.0, 0.0]
-    if not i in gameRecords: continue
-    for now in range(4):
-        # if(diff[i][now]>=16.4):
-        #     gameRecords[i]=[1000000,100,1,1000000,100,1,1000000,100,1,1000000,100,1]
-        #     rksContribution[i][now] = diff[i][now]
-        #     progress[0][now]+=1
-        #     progress[1][now]+=1
-        #     progress[2][now]+=1
-        #     score.append((rksContribution[i][now],i,levelToNumMap[now],diff[i][now],True))
-        #     phi.append((rksContribution[i][now],i,levelToNumMap[now],diff[i][now],True))
-        # continue
-        rksContribution[i][now] = pow((gameRecords[i][now*3+1]-55.0)/45,2)*diff[i][now] if gameRecords[i][now*3+1] >= 70 else 0
-        progress[0][now]+=(gameRecords[i][now*3+1] >= 70)
-        progress[1][now]+=bool(gameRecords[i][now*3+2])
-        progress[2][now]+=bool(rksContribution[i][now] == diff[i][now] and diff[i][now])
-        if rksContribution[i][now] : score.append((
-            rksContribution[i][now],            #  0                
-            i,                                  #  1
-            levelToNumMap[now],                 #  2          
-            diff[i][now],                       #  3    
-            bool(gameRecords[i][now*3+2]),      #  4                     
-            songname[i],                        #  5   
-            gameRecords[i][now*3],#score        #  6                   
-            diff[i][now], #difficulty           #  7                
-            gameRecords[i][now*3+1] #acc        #  8                   
-            ))
-        if(rksContribution[i][now] >= diff[i][now] and diff[i][now]) : phi.append((
-            rksContribution[i][now],            #  0                
-            i,                                  #  1
-            levelToNumMap[now],                 #  2          
-            diff[i][now],                       #  3    
-            bool(gameRecords[i][now*3+2]),      #  4                     
-            songname[i],                        #  5   
-            gameRecords[i][now*3],#score        #  6                   
-            diff[i][now], #difficulty           #  7                
-            gameRecords[i][now*3+1] #acc        #  8    
-            ))
-    # print(i, rksContribution[i])
-
-score.sort()
-score.reverse()
-# print(score)
-phi.sort()
-phi.reverse()
-# print(phi)
-# print(rksContribution) 
-rks = 0.0
-for i in range(min(27,len(score))):
-    rks = rks + score[i][0]
-for i in range(min(3,len(phi))):
-    rks = rks + phi[i][0]
-
-rks = rks / 30.0
-isrksCorrect : bool = ((rks - summary['rankingScore']) <= 5e-7)
-rks_savedata = summary['rankingScore']
-
-b27 = [] # (songid,rank,songname,rks,difficulty,acc,score,type,nxt,fc)
-b27len = 0
-
-for i in range(3):
-    if(i>=len(phi)):
-        phi.append(['No Data',f'B{i+1}','No Data',0,0,0,0,0,'',0])
-        continue
-    id = phi[i][1]
-    accuary = gameRecords[phi[i][1]][classToNum(phi[i][2])*3+1]
-    scr = gameRecords[phi[i][1]][classToNum(phi[i][2])*3]
-    b27.append([id,f'P{i+1}',songname[id],phi[i][0],phi[i][3],accuary,scr,phi[i][2],'推分建议已经被砍了',phi[i][4]])
-for i in range(settings['MaxSongResultShowcase']):
-    if(i>=len(score)):
-        break
-        b27.append(('No Data',f'B{i+1}','No Data',0,0,0,0,0,'',0))
-        continue
-    b27len+=1
-    id = score[i][1]
-    accuary = gameRecords[score[i][1]][classToNum(score[i][2])*3+1]
-    scr = gameRecords[score[i][1]][classToNum(score[i][2])*3]
-    # cnt1 = int(rks*100)/100.0  +0.01
-    # nxt = (cnt1-rks)*30
-    # # nxt = ((cnt1+0.008 if rks-cnt1<0.005 else cnt1+0.018)-rks)*30
-    # target_rks = nxt + score[i][0]
-    # target_acc = pow(target_rks / score[i][3], 1/2) * 45 + 55
-    # print(score[i][0])
-    # print((cnt1+0.005 if rks-cnt1<0.005 else cnt1+0.015),f'{target_rks:f}',target_rks,target_acc,pow((target_acc-55)/45,2)*score[0][3])
-    
-                
-    
-    b27.append([id,f'B{i+1}',songname[id],score[i][0],score[i][3],accuary,scr,score[i][2],-1.0,score[i][4]])
+            if(sessionToken == '0'): sys.exit(0)
+            if(sessionToken != ''): return sessionToken.encode('utf-8')
+    except EOFError:
+        fuck('?')
 
+def main():
+    current_dir = os.getcwd()
+    try: os.system(f'cd \"{current_dir}\"')
+    except: printwithcolor('无法切换到文件所在目录, 可能无法正常运行',[1,31])
+    settings = loadSettings()
 
-for i in range(settings['MaxSongResultShowcase']):
-    if(i>=len(score)):
-        break
     try:
-        suggestion = suggestionsCalculate(rks,score[i][3],phi[2][0],b27[27+3-1][3],i+1,b27[i+3][3])
-    except:
-        try:
-            suggestion = suggestionsCalculate(rks,score[i][3],0,b27[27+3-1][3],i+1,b27[i+3][3])
-        except:
+        if settings['AutoUpdate'] == 1: raise(Exception)
+        elif settings['AutoUpdate'] == -1:
+            updatefileOption = input('是否更新本地的曲绘、头像、歌曲难度、歌曲信息文件(y/n)默认为y\n')
+            if (updatefileOption == 'Y' or updatefileOption == 'y'):
+                raise(Exception)
+    except Exception as e: 
+        if(e != KeyboardInterrupt):
             try:
-                suggestion = suggestionsCalculate(rks,score[i][3],b27[2][3],0,i+1,b27[i+3][3])
-            except:
-                suggestion = suggestionsCalculate(rks,score[i][3],0,0,i+1,b27[i+3][3])
-    b27[i][8]=suggestion
-updatetime = datetime.now().astimezone(timezone('Asia/Shanghai')).replace(tzinfo=None)
+                import updatefile
+                updatefile.main()
+            except Exception as e:
+                printwithcolor(f'无法更新文件{e}',[31])
 
-original_stdout = sys.stdout
-sys.stdout = open('result.txt', 'w', encoding='utf-8')
-if(not settings['yywMode']): print(updatetime)
-else: print('已开启演示模式，所有成绩均为演示作用')
-if(not isrksCorrect) : print(f'\n发现计算rks({rks})与云端获取rks({rks_savedata})不同\n请确认游戏是否更新定数或更改rks计算法则\n')
+    try:
+        maker = RksImageMaker(settings)
+    except Exception as e:
+        fuck(e,11)
+
+    if not settings['yywMode']:
+        save = None
+        if len(sys.argv) > 1:
+            try: save = maker.fetch(sys.argv[1])
+            except: save = None
+        if save is None:
+            try:
+                save = maker.fetch(readSessionToken())
+            except Exception as e:
+                fuck(e,4)
+    else:
+        save = maker.demo()
 
-# print('Save version: ', summary['saveVersion'])
-def challengeModeRankToChinese(cmr : int) -> str:
-    res : str = ''
-    if(cmr//100==0): res+='灰'
-    elif(cmr//100==1): res+='绿'
-    elif(cmr//100==2): res+='蓝'
-    elif(cmr//100==3): res+='红'
-    elif(cmr//100==4): res+='金'
-    else: res+='彩'
-    res += str(cmr%100)
-    return res
-cmrcn = challengeModeRankToChinese(summary['challengeModeRank'])
-print('昵称: ', nickname)
-print('课题模式:', cmrcn)
-print('RKS: ', summary['rankingScore'])
-# print('GameVersion: ', summary['gameVersion'])
-# print('头像: ', user['avatar'])
-print('Data: ', end='')
-
-data_num = ''
-if data[4]:   data_num=f'{data[4]}PiB {data[3]}TiB {data[2]}GiB {data[1]}MiB {data[0]}KiB'
-elif data[3]: data_num=f'{data[3]}TiB {data[2]}GiB {data[1]}MiB {data[0]}KiB'
-elif data[2]: data_num=f'{data[2]}GiB {data[1]}MiB {data[0]}KiB'
-elif data[1]: data_num=f'{data[1]}MiB {data[0]}KiB'
-else: f'{data[0]}KiB'
-print(data_num, end='\n\n')
-print('\\    EZ   HD   IN   AT')
-print(f'C   {progress[0][0]: 3d} {progress[0][1]: 3d} {progress[0][2]: 3d} {progress[0][3]: 3d} ')
-print(f'FC  {progress[1][0]: 3d} {progress[1][1]: 3d} {progress[1][2]: 3d} {progress[1][3]: 3d} ')
-print(f'AT  {progress[2][0]: 3d} {progress[2][1]: 3d} {progress[2][2]: 3d} {progress[2][3]: 3d} ')
-print()
-for i in range(min(3,len(phi))):
-    print(f'P{i+1} {phi[i][5]} {phi[i][2]},  ACC: {"%.4f"%phi[i][8]}%, RKS: {"%.3f"%phi[i][0]}/{phi[i][7]}, Score:{phi[i][6]}')
-print()
-for i in range(b27len):
-    print(f'B{i+1} {score[i][5]} {score[i][2]},  ACC: {"%.4f"%score[i][8]}% >> {"{:.3f}".format(b27[i][8],3) if b27[i][8]>0 else "无法推分"}%, RKS: {"%.3f"%score[i][0]}/{score[i][7]}, Score:{score[i][6]}')
-    if(i == 26):
-        print('————OVERFLOW————')
-sys.stdout = original_stdout
-# print(rks)
-# print(diff)
-# phigros.load_difficulty(b"../difficulty.tsv")# 读取difficulty.tsv,参数为文件路径
-# b19 = phigros.get_b19(handle).decode('utf-8')
-# print(b19)             # 从存档读取B19,依赖load_difficulty
-if(not settings['yywMode']): phigros.free_handle(handle)                 # 释放handle的内存,不会被垃圾回收,使用完handle请确保释放
-
-# score[i][2] ->EZ/HD/IN/AT
-if settings['OutputLog']:
-    filename = f'{str(updatetime).replace(" ", "_").replace(":", "_").replace(".", "_")}'
-    if settings['yywMode']: 
-        filename = filename + "_yywmode"
-    if(os.path.exists('log')): 
-        if(not os.path.isfile('/log')): pass
-        else: os.system('mkdir log')
-    else: os.system('mkdir log')
-    
-    if(sys.platform.startswith('linux')): os.system(f'cp ./result.txt ./log/{filename}.txt >/dev/null')
-    elif(sys.platform.startswith('win32')): 
-        os.system(f'copy .\\result.txt .\\log\\{filename}.txt > NUL')
-from math import floor
-output_path = f"result.{settings['ResultPictureQuality'].lower()}"
-if(settings['ImageStyle']==0):
-    target_size=(3750, 1800 - floor((33-b27len)/6.0)*215)
-else:
-    target_size=(1875, 3000 - floor((33-b27len)/3.0)*215 - (b27len <=27 if 95 else 0))
-createImage(
-    
-    a_path=f"illustrationLowRes/{choice(os.listdir('illustrationLowRes'))}",  # 替换为你的图片路径
-    output_path=output_path,
-    target_size=target_size,
-    blur_radius=55,  # 可根据需要调整虚化程度
-    avatar=user['avatar'],
-    b27=b27,
-    username=nickname,
-    rks=round(rks,6),
-    challengeModeRank=summary['challengeModeRank'],
-    data=data_num,
-    updatetime=str(updatetime),
-    progress=progress,
-    style=settings['ImageStyle'],
-    imageType=settings['ResultPictureQuality'],
-    isrksCorrect=isrksCorrect,
-    rks_savedata=rks_savedata
-)
-printwithcolor(f'成绩图片已输出至{output_path}, 文字文件已输出至result.txt',[36])
-
-if(not settings['yywMode']): print(updatetime)
-else: print('已开启演示模式，所有成绩均为演示作用')
-if(not isrksCorrect) : printwithcolor(f'发现计算rks({rks})与云端获取rks({rks_savedata})不同\n请确认游戏是否更新定数或更改rks计算法则',[31,1])
-if(cmrcn[0]=='灰'):printwithcolor(cmrcn,[30,1],' ')
-elif(cmrcn[0]=='绿'):printwithcolor(cmrcn,[32,1],' ')
-elif(cmrcn[0]=='蓝'):printwithcolor(cmrcn,[36,1],' ')
-elif(cmrcn[0]=='红'):printwithcolor(cmrcn,[31,1],' ')
-elif(cmrcn[0]=='金'):printwithcolor(cmrcn,[33,1],' ')
-else:printwithcolor(cmrcn,[35,1],' ')
-printwithcolor('%.10f'%summary['rankingScore'], [7,1], ' ')
-# print('GameVersion: ', summary['gameVersion'])
-printwithcolor(data_num, [1,3])
-print('\\   ',end='')
-printwithcolor('EZ',[1,32],'   ')
-printwithcolor('HD',[1,36],'   ')
-printwithcolor('IN',[1,31],'   ')
-printwithcolor('AT',[1,37])
-printwithcolor('C',37,'')
-print(f'   {progress[0][0]: 3d} {progress[0][1]: 3d} {progress[0][2]: 3d} {progress[0][3]: 3d} ')
-printwithcolor('FC',34,'')
-print(f'  {progress[1][0]: 3d} {progress[1][1]: 3d} {progress[1][2]: 3d} {progress[1][3]: 3d} ')
-printwithcolor('AP',33,'')
-print(f'  {progress[2][0]: 3d} {progress[2][1]: 3d} {progress[2][2]: 3d} {progress[2][3]: 3d} ')
-print()
-for i in range(min(3,len(phi))):
-    printwithcolor(f'P{i+1}',[43,1],' ')
-    printwithcolor(songname[phi[i][1]],0,' ')
-    printwithcolor(phi[i][2],[1],'    ')
-    printwithcolor(f'{"%.4f"%gameRecords[phi[i][1]][classToNum(phi[i][2])*3+1]}%', [1], ' ')
-    printwithcolor(f'{"%.3f"%phi[i][0]}/{diff[phi[i][1]][classToNum(phi[i][2])]}', [44], ' ')
-    printwithcolor(f'{gameRecords[phi[i][1]][classToNum(phi[i][2])*3]}',[1,33])
-print()
-for i in range(b27len):
-    printwithcolor(f'B{i+1}',[43,1],' ')
-    printwithcolor(songname[score[i][1]],0,' ')
-    printwithcolor(score[i][2],[1,(30+((2)if(score[i][2]=='EZ')else((4)if(score[i][2]=='HD')else((1)if(score[i][2]=='IN')else(7)))))],'\n')
-    printwithcolor(f'{"%.4f"%gameRecords[score[i][1]][classToNum(score[i][2])*3+1]}%', [1], ' ')
-    printwithcolor(f'>> {"{:.3f}".format(b27[i][8],3) if b27[i][8]>0 else "无法推分"}%',[0,32],' ')
-    printwithcolor(f'{"%.3f"%score[i][0]}', [44], '')
-    printwithcolor(f'/{diff[score[i][1]][classToNum(score[i][2])]}',[0],' ')
-    printwithcolor(f'{gameRecords[score[i][1]][classToNum(score[i][2])*3]}',[1,36])
-    # print(f'B{i+1} {songname[score[i][1]]},  ACC: {round(gameRecords[score[i][1]][classToNum(score[i][2])*3+1],2)}%, RKS: {round(score[i][0],3)}/{diff[score[i][1]][classToNum(score[i][2])]}, Score:{gameRecords[score[i][1]][classToNum(score[i][2])*3]}')
-    if(i == 26):
-        printwithcolor('————OVERFLOW————',[0])
-if settings['EnterToContiune']:
-    try: input('按下Enter以继续')
-    except: pass
-sys.exit(0)
\ No newline at end of file
+    fingerprint = maker.fingerprint(save)
+    state = loadRenderState()
+    if settings['SkipUnchanged'] == 1 and isUnchanged(fingerprint, state):
+        printwithcolor(f'存档与曲目数据均未变化, 沿用上次的输出: {", ".join(state["outputs"])}',[36])
+    else:
+        result = maker.compute(save)
+        maker.writeResult(result)
+        if settings['OutputLog']:
+            maker.writeLog(result)
+        output_path = maker.render(result)
+        outputs = output_path if isinstance(output_path, list) else [output_path]
+        saveRenderState({'fingerprint':fingerprint, 'outputs':outputs + ['result.txt']})
+        printwithcolor(f'成绩图片已输出至{", ".join(outputs)}, 文字文件已输出至result.txt',[36])
+        printResult(result, settings['yywMode'])
+    if settings['EnterToContiune']:
+        try: input('按下Enter以继续')
+        except: pass
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
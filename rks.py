@@ -0,0 +1,122 @@
+'''
+成绩表的列式表示
+    ChartTable: 所有谱面的定数, 按info.tsv中的歌曲顺序展开为 歌曲数×4 的数组
+    ScoreTable: 一个玩家的分数、acc、fc, 与ChartTable形状一致, 单曲rks与完成度表格用向量运算求出
+    suggestionsOf: 所有谱面的推分建议
+    bulkRks: 同时计算多个玩家的rks
+'''
+
+import numpy as np
+
+LEVELS = ('EZ', 'HD', 'IN', 'AT')
+
+class ChartTable:
+    def __init__(self, songid : list, diff : dict):
+        self.songid = list(songid)
+        self.index = {i : n for n, i in enumerate(self.songid)}
+        # 没有该难度或difficulty.tsv中缺少该曲时定数为0
+        self.constant = np.array([diff.get(i, (0.0, 0.0, 0.0, 0.0)) for i in self.songid], dtype=np.float64).reshape(-1, 4)
+
+class ScoreTable:
+    def __init__(self, charts : ChartTable, gameRecords : dict):
+        self.charts = charts
+        records = np.zeros((len(charts.songid), 12))
+        for i, n in charts.index.items():
+            record = gameRecords.get(i)
+            if record is not None: records[n] = record[:12]
+        records = records.reshape(-1, 4, 3)
+        self.score = records[:, :, 0]
+        self.acc = records[:, :, 1]
+        self.fc = records[:, :, 2] != 0
+
+    def contribution(self) -> np.ndarray:
+        """单曲rks, acc<70时为0"""
+        return contributionOf(self.acc, self.charts.constant)
+
+    def progress(self, contribution : np.ndarray) -> list:
+        """C/FC/AP各难度的数量, 与原来的4×4表格格式一致"""
+        constant = self.charts.constant
+        return [
+            (self.acc >= 70).sum(0).tolist(),
+            self.fc.sum(0).tolist(),
+            ((contribution == constant) & (constant != 0)).sum(0).tolist(),
+            [0, 0, 0, 0],
+        ]
+
+def contributionOf(acc : np.ndarray, constant : np.ndarray) -> np.ndarray:
+    """单曲rks = ((acc-55)/45)^2 * 定数, acc<70时为0"""
+    res = np.subtract(acc, 55.0)
+    res /= 45
+    np.square(res, out=res)
+    res *= constant
+    res[acc < 70] = 0.0
+    return res
+
+def topCandidates(values : np.ndarray, mask : np.ndarray, n : int) -> np.ndarray:
+    """
+    mask为True的元素中不小于第n大值的扁平下标(未排序), 用argpartition代替完整排序
+    与第n大值相等的元素全部保留, 调用者按原来的元组排序后截取前n个即可得到与完整排序相同的结果
+    """
+    idx = np.flatnonzero(mask)
+    if len(idx) <= n: return idx
+    selected = values.ravel()[idx]
+    kth = selected[np.argpartition(selected, len(selected) - n)[len(selected) - n]]
+    return idx[selected >= kth]
+
+def suggestionsOf(rks : float, constant : np.ndarray, contribution : np.ndarray, inB27 : np.ndarray, b27last : float, p3 : float) -> np.ndarray:
+    '''
+    推分建议: 使rks显示值(两位小数)提高所需的acc, 需要AP时为100, 无法推分时为-1, 没有定数的位置为nan
+    B27内的谱面替换自身, 其余谱面替换B27中最低的一个(b27last, 不足27个时为0)
+    acc超过100时只能通过AP进入P3, 替换P3中最低的一个(p3, 不足3个时为0)
+    '''
+    target = int(rks*100) / 100.0 + 0.005
+    target += (rks>target)*0.01
+    target_contribution = (target - (rks - np.where(inB27, contribution, b27last)/30.00)) * 30.00
+    with np.errstate(divide='ignore', invalid='ignore'):
+        target_acc = np.sqrt(target_contribution/constant)*45+55
+    phi_contribution = (target - (rks - p3/30.00)) * 30.00
+    ap = np.where((constant <= p3) | (phi_contribution > constant), -1.0, 100.0)
+    res = np.where(target_acc > 100, ap, target_acc)
+    res[constant == 0] = np.nan
+    return res
+
+def stackRecords(charts : ChartTable, gameRecordsList : list) -> np.ndarray:
+    """把多个玩家的gameRecord堆叠为 玩家数×谱面数×3 的数组, 最后一维与gameRecord相同为(分数, acc, fc)"""
+    records = np.zeros((len(gameRecordsList), len(charts.songid), 12))
+    for p, gameRecords in enumerate(gameRecordsList):
+        for i, n in charts.index.items():
+            record = gameRecords.get(i)
+            if record is not None: records[p, n] = record[:12]
+    return records.reshape(len(gameRecordsList), -1, 3)
+
+def topIndices(values : np.ndarray, n : int) -> np.ndarray:
+    """每行最大的n个值的列下标, 按值降序, 值<=0的位置为-1"""
+    n = min(n, values.shape[1])
+    idx = np.argpartition(-values, n - 1, axis=1)[:, :n]
+    order = np.argsort(-np.take_along_axis(values, idx, axis=1), axis=1, kind='stable')
+    idx = np.take_along_axis(idx, order, axis=1)
+    idx[np.take_along_axis(values, idx, axis=1) <= 0] = -1
+    return idx
+
+def bulkRks(charts : ChartTable, records : np.ndarray) -> dict:
+    '''
+    同时计算多个玩家的rks, records为stackRecords的结果(或同样形状的数组)
+    返回 rks: 玩家数, b27: 玩家数×27, p3: 玩家数×3 (谱面下标, songid为charts.songid[k//4], 难度为LEVELS[k%4], 不足时为-1),
+    progress: 玩家数×3×4 的C/FC/AP表格
+    并列的谱面之间顺序不保证与RksImageMaker.compute相同, rks不受影响
+    '''
+    constant = charts.constant.ravel()
+    acc = np.ascontiguousarray(records[:, :, 1])
+    contribution = contributionOf(acc, constant)
+    phi = np.where((contribution >= constant) & (constant != 0), contribution, 0.0)
+    b27 = topIndices(contribution, 27)
+    p3 = topIndices(phi, 3)
+    rks = (np.where(b27 >= 0, np.take_along_axis(contribution, np.maximum(b27, 0), axis=1), 0.0).sum(1)
+         + np.where(p3 >= 0, np.take_along_axis(phi, np.maximum(p3, 0), axis=1), 0.0).sum(1)) / 30.0
+    players = len(records)
+    progress = np.stack([
+        np.count_nonzero((acc >= 70).reshape(players, -1, 4), axis=1),
+        np.count_nonzero((records[:, :, 2] != 0).reshape(players, -1, 4), axis=1),
+        np.count_nonzero(((contribution == constant) & (constant != 0)).reshape(players, -1, 4), axis=1),
+    ], axis=1)
+    return {'rks' : rks, 'b27' : b27, 'p3' : p3, 'progress' : progress}
@@ -0,0 +1,105 @@
+'''
+常驻渲染服务, 字体、定数、曲绘与PhigrosLibrary只在启动时加载一次
+用法: python server.py [port] [host]
+    GET  /render?sessionToken=xxx&format=png|jpeg   返回图片字节
+    POST /render  (body为sessionToken)               同上
+    GET  /health
+'''
+
+import sys
+import threading
+from io import BytesIO
+from json import dumps
+from time import perf_counter
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from main import RksImageMaker, printwithcolor
+
+HOST = '127.0.0.1'
+PORT = 8000
+CONTENT_TYPE = {
+    'PNG' : 'image/png',
+    'JPEG' : 'image/jpeg',
+    'WEBP' : 'image/webp',
+    'GIF' : 'image/gif',
+    'BMP' : 'image/bmp',
+    'TIF' : 'image/tiff',
+}
+FORMAT_ALIAS = {'png':'PNG', 'jpg':'JPEG', 'jpeg':'JPEG', 'webp':'WEBP', 'gif':'GIF', 'bmp':'BMP', 'tif':'TIF', 'tiff':'TIF'}
+
+maker : RksImageMaker = None
+render_lock = threading.Lock()     # FONT_CONFIG中的字体对象在线程间共享, 绘制时串行
+
+def renderBytes(sessionToken, imageType : str = None):
+    """获取存档并绘制, 返回(图片字节, 实际写入的图片格式)"""
+    if imageType is None: imageType = maker.settings['ResultPictureQuality']
+    save = maker.demo() if maker.settings['yywMode'] else maker.fetch(sessionToken)
+    result = maker.compute(save)
+    buffer = BytesIO()
+    with render_lock:
+        imageType = maker.render(result, buffer, imageType)
+    return buffer.getvalue(), imageType
+
+class RenderHandler(BaseHTTPRequestHandler):
+    def send(self, code : int, body : bytes, contentType : str = 'application/json; charset=utf-8'):
+        self.send_response(code)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_render(self, sessionToken, query : dict):
+        if not sessionToken and not maker.settings['yywMode']:
+            self.send(400, dumps({'error':'缺少sessionToken'}).encode('utf-8'))
+            return
+        imageType = FORMAT_ALIAS.get(query.get('format', [''])[0].lower())
+        start = perf_counter()
+        try:
+            body, imageType = renderBytes(sessionToken, imageType)
+        except Exception as e:
+            self.send(500, dumps({'error':str(e)}, ensure_ascii=False).encode('utf-8'))
+            return
+        self.send(200, body, CONTENT_TYPE.get(imageType, 'application/octet-stream'))
+        printwithcolor(f'{self.path.split("?")[0]} {len(body)} bytes {perf_counter()-start:.3f}s', [36])
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/health':
+            self.send(200, b'{"status":"ok"}')
+        elif url.path == '/render':
+            self.handle_render(query.get('sessionToken', [''])[0], query)
+        else:
+            self.send(404, b'{"error":"not found"}')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/render':
+            self.send(404, b'{"error":"not found"}')
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        sessionToken = self.rfile.read(length).decode('utf-8').strip()
+        self.handle_render(sessionToken, parse_qs(url.query))
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    global maker
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    host = sys.argv[2] if len(sys.argv) > 2 else HOST
+    start = perf_counter()
+    maker = RksImageMaker(keepIllustrations=True)
+    if maker.atlas is not None: maker.atlas.build()
+    maker.prepareSongNames()
+    printwithcolor(f'资源加载完成, 用时{perf_counter()-start:.3f}s', [32])
+    server = ThreadingHTTPServer((host, port), RenderHandler)
+    printwithcolor(f'渲染服务已启动: http://{host}:{port}/render', [36])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+'''
+RksImageMaker.compute、rks.suggestionsOf与rks.bulkRks的回归测试
+与原来逐谱面排序、逐个try/except计算推分建议的实现比较, bulkRks与compute比较
+用法: python -m unittest test_rks
+'''
+
+import math
+import random
+import unittest
+import numpy as np
+from main import RksImageMaker, loadSettings
+from rks import suggestionsOf, stackRecords, bulkRks, LEVELS
+
+def oldRanking(maker : RksImageMaker, gameRecords : dict):
+    """原来的compute: 所有谱面生成元组后完整排序"""
+    songid, songname, diff = maker.songid, maker.songname, maker.diff
+    score, phi = [], []
+    progress = [[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]]
+    for i in songid:
+        if not i in gameRecords: continue
+        for now in range(4):
+            contribution = pow((gameRecords[i][now*3+1]-55.0)/45,2)*diff[i][now] if gameRecords[i][now*3+1] >= 70 else 0
+            progress[0][now]+=(gameRecords[i][now*3+1] >= 70)
+            progress[1][now]+=bool(gameRecords[i][now*3+2])
+            progress[2][now]+=bool(contribution == diff[i][now] and diff[i][now])
+            item = (contribution, i, LEVELS[now], diff[i][now], bool(gameRecords[i][now*3+2]), songname[i],
+                    gameRecords[i][now*3], diff[i][now], gameRecords[i][now*3+1])
+            if contribution: score.append(item)
+            if contribution >= diff[i][now] and diff[i][now]: phi.append(item)
+    score.sort(reverse=True)
+    phi.sort(reverse=True)
+    rks = (sum(i[0] for i in score[:27]) + sum(i[0] for i in phi[:3])) / 30.0
+    return score, phi, rks, progress
+
+def oldSuggestion(rks : float, diff : float, p3 : float, b27_contribution : float, position : int, contribution : float) -> float:
+    """原来的suggestionsCalculate"""
+    target = int(rks*100) / 100.0 + 0.005
+    target += (rks>target)*0.01
+    target_contribution = (target - (rks - (b27_contribution if position>27 else contribution)/30.00)) * 30.00
+    target_acc = pow(target_contribution/diff,0.5)*45+55
+    if(target_acc>100):
+        if diff <= p3 : return -1.0
+        target_contribution = (target - (rks - p3/30.00)) * 30.00
+        if target_contribution > diff : return -1.0
+        return 100.00
+    return target_acc
+
+def randomSave(maker : RksImageMaker, rng : random.Random, charts : int, aps : int = None) -> dict:
+    """随机选取charts个谱面, aps不为None时恰好有aps个AP"""
+    available = [(i, now) for i in maker.songid for now in range(4) if maker.diff[i][now]]
+    chosen = rng.sample(available, charts)
+    gameRecords = {}
+    for n, (i, now) in enumerate(chosen):
+        record = gameRecords.setdefault(i, [0] * 12)
+        ap = n < aps if aps is not None else rng.random() < 0.1
+        acc = 100.0 if ap else rng.choice([rng.uniform(60, 99.99), round(rng.uniform(90, 99.99), 2)])
+        record[now*3:now*3+3] = [1000000 if ap else int(acc * 9000), acc, int(ap or rng.random() < 0.3)]
+    return {'nickname' : 'test', 'summary' : {'rankingScore' : 0.0, 'challengeModeRank' : 0},
+            'savedata' : {'gameRecord' : gameRecords, 'gameProgress' : {'money' : [0,0,0,0,0]}, 'user' : {'avatar' : ''}}}
+
+class ComputeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        settings = loadSettings()
+        settings['MaxSongResultShowcase'] = 39
+        cls.maker = RksImageMaker(settings)
+
+    def assertRanking(self, save : dict):
+        result = self.maker.compute(save)
+        score, phi, rks, progress = oldRanking(self.maker, save['savedata']['gameRecord'])
+        n = max(27, self.maker.settings['MaxSongResultShowcase'])
+        self.assertEqual([i[1:] for i in result['score']], [i[1:] for i in score[:n]])
+        self.assertEqual([i[1:] for i in result['phi'] if i[0] != 'No Data'], [i[1:] for i in phi[:3]])
+        np.testing.assert_allclose([i[0] for i in result['score']], [i[0] for i in score[:n]], rtol=1e-12)
+        self.assertAlmostEqual(result['rks'], rks, places=10)
+        self.assertEqual(result['progress'][:3], progress[:3])
+        self.assertEqual(result['b27len'], min(n, len(score)))
+        return result
+
+    def test_full_saves(self):
+        rng = random.Random(0)
+        for _ in range(40):
+            self.assertRanking(randomSave(self.maker, rng, rng.randint(40, 400)))
+
+    def test_short_b27(self):
+        rng = random.Random(1)
+        for charts in [0, 1, 5, 26, 27]:
+            result = self.assertRanking(randomSave(self.maker, rng, charts, aps=0))
+            self.assertEqual(len(result['b27']), 3 + result['b27len'] - sum(1 for i in result['phi'] if i[0] == 'No Data'))
+
+    def test_few_aps(self):
+        rng = random.Random(2)
+        for aps in [0, 1, 2, 3]:
+            result = self.assertRanking(randomSave(self.maker, rng, 60, aps=aps))
+            self.assertEqual(sum(1 for i in result['phi'] if i[0] != 'No Data'), aps)
+
+class SuggestionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        settings = loadSettings()
+        settings['MaxSongResultShowcase'] = 39
+        cls.maker = RksImageMaker(settings)
+
+    def suggestionOf(self, result : dict, songid : str, level : str) -> float:
+        for i, now, name, constant, acc, contribution, suggestion in result['suggestions']:
+            if i == songid and now == level: return suggestion
+        self.fail(f'{songid} {level} 不在suggestions中')
+
+    def test_matches_old_ladder(self):
+        """B27不少于27个且AP不少于3个时, 与原来的计算完全一致"""
+        rng = random.Random(3)
+        for _ in range(40):
+            result = self.maker.compute(randomSave(self.maker, rng, rng.randint(60, 400), aps=rng.randint(3, 10)))
+            score, phi, b27, rks = result['score'], result['phi'], result['b27'], result['rks']
+            for i in range(result['b27len']):
+                expected = oldSuggestion(rks, score[i][3], phi[2][0], b27[27+3-1][3], i+1, b27[i+3][3])
+                self.assertEqual(b27[i][8], expected)
+                self.assertEqual(self.suggestionOf(result, score[i][1], score[i][2]), expected)
+
+    def test_outside_b27(self):
+        """B27以外的谱面替换B27中最低的一个"""
+        rng = random.Random(4)
+        result = self.maker.compute(randomSave(self.maker, rng, 200, aps=5))
+        score, phi, rks = result['score'], result['phi'], result['rks']
+        inB27 = {(i[1], i[2]) for i in score[:27]}
+        outside = [i for i in result['suggestions'] if (i[0], i[1]) not in inB27]
+        self.assertTrue(outside)
+        for songid, level, name, constant, acc, contribution, suggestion in outside:
+            self.assertEqual(suggestion, oldSuggestion(rks, constant, phi[2][0], score[26][0], 28, contribution))
+
+    def test_short_b27_and_p3(self):
+        """B27不足27个时B27外替换0, AP不足3个时P3中替换0, 原来的计算在这些情况下会出错"""
+        rng = random.Random(5)
+        for charts, aps in [(1, 0), (10, 1), (26, 2), (60, 0)]:
+            result = self.maker.compute(randomSave(self.maker, rng, charts, aps=aps))
+            score, rks = result['score'], result['rks']
+            b27last = score[26][0] if len(score) >= 27 else 0.0
+            p3 = result['phi'][2][0] if aps >= 3 else 0.0
+            for i in range(result['b27len']):
+                expected = oldSuggestion(rks, score[i][3], p3, b27last, i+1, score[i][0])
+                self.assertEqual(result['b27'][i][8], expected)
+
+    def test_missing_charts(self):
+        """没有定数的位置为nan, 有定数的位置不为nan"""
+        constant = np.array([[1.0, 5.0, 10.0, 0.0], [2.0, 8.0, 12.0, 15.5]])
+        contribution = np.array([[1.0, 0.0, 9.5, 0.0], [0.0, 0.0, 12.0, 15.0]])
+        inB27 = contribution > 0
+        res = suggestionsOf(1.5, constant, contribution, inB27, 0.0, 0.0)
+        self.assertTrue(math.isnan(res[0, 3]))
+        self.assertFalse(np.isnan(res[constant != 0]).any())
+        for (n, now), value in np.ndenumerate(res):
+            if not constant[n, now]: continue
+            self.assertEqual(value, oldSuggestion(1.5, constant[n, now], 0.0, 0.0, 1 if inB27[n, now] else 28, contribution[n, now]))
+
+class BulkRksTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        settings = loadSettings()
+        settings['MaxSongResultShowcase'] = 39
+        cls.maker = RksImageMaker(settings)
+
+    def test_matches_compute(self):
+        """每个玩家的rks、C/FC/AP表格以及B27与P3的单曲rks与compute一致, 并列谱面的顺序不比较"""
+        rng = random.Random(6)
+        saves = [randomSave(self.maker, rng, rng.randint(40, 400)) for _ in range(20)]
+        saves += [randomSave(self.maker, rng, charts, aps=aps) for charts, aps in [(0, 0), (1, 0), (10, 1), (26, 2), (27, 3), (60, 0)]]
+        charts = self.maker.charts
+        res = bulkRks(charts, stackRecords(charts, [save['savedata']['gameRecord'] for save in saves]))
+        for player, save in enumerate(saves):
+            result = self.maker.compute(save)
+            self.assertAlmostEqual(res['rks'][player], result['rks'], places=10)
+            self.assertEqual(res['progress'][player].tolist(), result['progress'][:3])
+            b27 = [i[0] for i in result['score'][:27]]
+            p3 = [i[0] for i in result['phi'] if i[0] != 'No Data']
+            constant = charts.constant.ravel()
+            acc = np.array([save['savedata']['gameRecord'].get(charts.songid[k // 4], [0] * 12)[k % 4 * 3 + 1] for k in range(len(constant))])
+            single = np.where(acc >= 70, ((acc - 55) / 45) ** 2 * constant, 0.0)
+            np.testing.assert_allclose(sorted((single[k] for k in res['b27'][player] if k >= 0), reverse=True), b27, rtol=1e-12)
+            np.testing.assert_allclose(sorted((single[k] for k in res['p3'][player] if k >= 0), reverse=True), p3, rtol=1e-12)
+            for k in res['p3'][player]:
+                if k >= 0: self.assertEqual(single[k], constant[k])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+'''
+updatefile中fetch_to_file续传与verify_file校验根目录文件的测试, 使用本地HTTP服务器代替GitHub
+用法: python -m unittest test_updatefile
+'''
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+from contextlib import redirect_stdout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import updatefile
+
+class FileHandler(BaseHTTPRequestHandler):
+    """按server.files提供文件, 支持Range、If-Range与If-None-Match(ETag), 每个请求的状态码记录在server.statuses"""
+    def send_response(self, code, message = None):
+        self.server.statuses.append(code)
+        super().send_response(code, message)
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.path not in self.server.files:
+            self.send_response(404)
+            self.end_headers()
+            return
+        content, etag = self.server.files[self.path]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        ranged = self.headers.get('Range')
+        if ranged and self.headers.get('If-Range', etag) == etag:
+            start = int(ranged[len('bytes='):].split('-')[0])
+        if start >= len(content) and start:
+            self.send_response(416)
+            self.end_headers()
+            return
+        self.send_response(206 if start else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content) - start))
+        if start: self.send_header('Content-Range', f'bytes {start}-{len(content)-1}/{len(content)}')
+        self.end_headers()
+        if self.server.truncate is None:
+            self.wfile.write(content[start:])
+        else:       # 只发送部分内容后断开连接
+            self.wfile.write(content[start:start+self.server.truncate])
+            self.wfile.flush()
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+        self.server.files, self.server.requests, self.server.statuses, self.server.truncate = {}, [], [], None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'a.png')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder)
+
+    def url(self, name : str = '/a.png') -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}{name}'
+
+class FetchToFileTest(ServerTestCase):
+    def writePart(self, content : bytes, validator : str = None):
+        with open(self.path + updatefile.PART_SUFFIX, 'wb') as f:
+            f.write(content)
+        if validator is not None:
+            with open(self.path + updatefile.VALIDATOR_SUFFIX, 'w', encoding='utf-8') as f:
+                f.write(validator)
+
+    def assertDownloaded(self, content : bytes):
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertFalse(os.path.exists(self.path + updatefile.PART_SUFFIX))
+        self.assertFalse(os.path.exists(self.path + updatefile.VALIDATOR_SUFFIX))
+
+    def test_download(self):
+        self.server.files['/a.png'] = (b'0123456789', '"v1"')
+        self.assertEqual(updatefile.fetch_to_file(self.url(), self.path), 10)
+        self.assertDownloaded(b'0123456789')
+        self.assertNotIn('Range', self.server.requests[0])
+
+    def test_resume_same_version(self):
+        self.server.files['/a.png'] = (b'0123456789', '"v1"')
+        self.writePart(b'0123', '"v1"')
+        self.assertEqual(updatefile.fetch_to_file(self.url(), self.path), 6)
+        self.assertDownloaded(b'0123456789')
+        self.assertEqual(self.server.requests[0]['Range'], 'bytes=4-')
+        self.assertEqual(self.server.requests[0]['If-Range'], '"v1"')
+
+    def test_resume_changed_version(self):
+        """远端文件已更新时, 旧版本的临时文件不能与新文件拼接"""
+        self.server.files['/a.png'] = (b'abcdefghij', '"v2"')
+        self.writePart(b'0123', '"v1"')
+        self.assertEqual(updatefile.fetch_to_file(self.url(), self.path), 10)
+        self.assertDownloaded(b'abcdefghij')
+
+    def test_part_without_validator(self):
+        self.server.files['/a.png'] = (b'abcdefghij', '"v2"')
+        self.writePart(b'0123')
+        updatefile.fetch_to_file(self.url(), self.path)
+        self.assertDownloaded(b'abcdefghij')
+        self.assertNotIn('Range', self.server.requests[0])
+
+    def test_interrupted_keeps_validator(self):
+        """连接中断时保留临时文件与ETag, 下次从断点续传"""
+        self.server.files['/a.png'] = (b'0123456789', '"v1"')
+        self.server.truncate = 4
+        chunk_size, updatefile.CHUNK_SIZE = updatefile.CHUNK_SIZE, 2
+        try:
+            with self.assertRaises(Exception):
+                updatefile.fetch_to_file(self.url(), self.path)
+        finally:
+            updatefile.CHUNK_SIZE = chunk_size
+        self.assertTrue(os.path.exists(self.path + updatefile.VALIDATOR_SUFFIX))
+        self.server.truncate = None
+        updatefile.fetch_to_file(self.url(), self.path)
+        self.assertDownloaded(b'0123456789')
+        self.assertEqual(self.server.requests[-1]['Range'], 'bytes=4-')
+
+    def test_local_files_skip_parts(self):
+        self.writePart(b'0123', '"v1"')
+        self.assertEqual(updatefile.get_local_files(self.folder), [])
+
+class VerifyFileTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.folder, 'info.tsv')
+        self.state = {}
+
+    def writeLocal(self, content : bytes):
+        with open(self.path, 'wb') as f:
+            f.write(content)
+
+    def readLocal(self) -> bytes:
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def verify(self, remote_sha : str = None) -> bool:
+        with redirect_stdout(io.StringIO()):
+            return updatefile.verify_file('info.tsv', self.url('/'), self.folder, self.url('/bak'), remote_sha, self.state)
+
+    def downloaded(self) -> int:
+        return self.server.statuses.count(200)
+
+    def test_blob_sha_match(self):
+        """blob SHA一致时不发送请求"""
+        self.writeLocal(b'a\tb\n')
+        self.assertTrue(self.verify(updatefile.git_blob_sha(b'a\tb\n')))
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual(self.state['info.tsv']['sha'], updatefile.git_blob_sha(b'a\tb\n'))
+
+    def test_blob_sha_changed(self):
+        self.server.files['/info.tsv'] = (b'new\n', '"v2"')
+        self.writeLocal(b'old\n')
+        self.assertFalse(self.verify(updatefile.git_blob_sha(b'new\n')))
+        self.assertEqual(self.readLocal(), b'new\n')
+        self.assertEqual(self.downloaded(), 1)
+
+    def test_not_modified(self):
+        """本地文件仍是上次下载的内容时发条件请求, 304时不下载"""
+        self.server.files['/info.tsv'] = (b'a\tb\n', '"v1"')
+        self.writeLocal(b'a\tb\n')
+        self.state['info.tsv'] = {'sha' : updatefile.git_blob_sha(b'a\tb\n'), 'etag' : '"v1"', 'last_modified' : None}
+        self.assertTrue(self.verify())
+        self.assertEqual(self.server.statuses, [304])
+        self.assertEqual(self.server.requests[0]['If-None-Match'], '"v1"')
+        self.assertEqual(self.readLocal(), b'a\tb\n')
+
+    def test_remote_changed(self):
+        """远端文件变化时只下载一次, 之后的条件请求返回304"""
+        self.server.files['/info.tsv'] = (b'new\n', '"v2"')
+        self.writeLocal(b'old\n')
+        self.state['info.tsv'] = {'sha' : updatefile.git_blob_sha(b'old\n'), 'etag' : '"v1"', 'last_modified' : None}
+        self.assertFalse(self.verify())
+        self.assertEqual(self.readLocal(), b'new\n')
+        self.assertEqual(self.state['info.tsv']['etag'], '"v2"')
+        self.assertEqual(self.state['info.tsv']['sha'], updatefile.git_blob_sha(b'new\n'))
+        self.assertTrue(self.verify())
+        self.assertEqual(self.server.statuses, [200, 304])
+        self.assertEqual(self.downloaded(), 1)
+
+    def test_local_edited(self):
+        """本地文件被修改后不能使用304, 重新下载覆盖"""
+        self.server.files['/info.tsv'] = (b'a\tb\n', '"v1"')
+        self.writeLocal(b'edited\n')
+        self.state['info.tsv'] = {'sha' : updatefile.git_blob_sha(b'a\tb\n'), 'etag' : '"v1"', 'last_modified' : None}
+        self.assertFalse(self.verify())
+        self.assertNotIn('If-None-Match', self.server.requests[0])
+        self.assertEqual(self.readLocal(), b'a\tb\n')
+        self.assertEqual(self.downloaded(), 1)
+
+    def test_missing_local(self):
+        self.server.files['/info.tsv'] = (b'a\tb\n', '"v1"')
+        self.assertTrue(self.verify())
+        self.assertNotIn('If-None-Match', self.server.requests[0])
+        self.assertEqual(self.readLocal(), b'a\tb\n')
+        self.assertEqual(self.downloaded(), 1)
+        self.assertFalse(os.path.exists(self.path + updatefile.PART_SUFFIX))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,11 @@
 import os
+import json
+import threading
 import requests
+from hashlib import sha1
+from time import perf_counter
 from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
 # 配置参数
 GITHUB_PROXY = "https://git.yylx.win/" #"https://github.akams.cn/"
 LOCAL_FOLDER = "illustrationLowRes"
@@ -17,11 +22,32 @@ API_URL2 = "https://api.github.com/repos/Tb114/Phigros_Resource/contents?ref=inf
 API_URL_BAK =  GITHUB_PROXY+"https://api.github.com/repos/Tb114/Phigros_Resource/contents?ref=illustrationLowRes"
 API_URL1_BAK = GITHUB_PROXY+"https://api.github.com/repos/Tb114/Phigros_Resource/contents?ref=avatar"
 API_URL2_BAK = GITHUB_PROXY+"https://api.github.com/repos/Tb114/Phigros_Resource/contents?ref=info"
+DOWNLOAD_WORKERS = 8        # 同时下载的文件数
+TIMEOUT = 10
+CHUNK_SIZE = 64 * 1024
+PART_SUFFIX = '.part'       # 未下载完成的临时文件, 下次同步时续传
+VALIDATOR_SUFFIX = '.etag' + PART_SUFFIX    # 临时文件对应的ETag/Last-Modified, 续传时作为If-Range
+STATE_FILE = 'update_state.json'    # 记录根目录文件的SHA与ETag/Last-Modified
+
+_session = None
+_session_lock = threading.Lock()
+_print_lock = threading.Lock()     # 多线程下载时避免输出混在一起
+
+def get_session():
+    """所有下载共用一个带连接池的Session, 复用TCP/TLS连接"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=DOWNLOAD_WORKERS)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+    return _session
 
 def get_github_files(api_url):
     """使用GitHub API获取文件列表"""
     try:
-        response = requests.get(api_url, timeout=10)
+        response = get_session().get(api_url, timeout=TIMEOUT)
         if response.status_code in [200,301,302]:
             # 过滤掉.gitignore文件
             return [item['name'] for item in response.json() if item['type'] == 'file' and item['name'] != '.gitignore']
@@ -37,84 +63,171 @@ def get_local_files(file_folder):
         os.makedirs(file_folder)
         return []
     
-    return [f for f in os.listdir(file_folder) if os.path.isfile(os.path.join(file_folder, f))]
+    return [f for f in os.listdir(file_folder) if os.path.isfile(os.path.join(file_folder, f)) and not f.endswith(PART_SUFFIX)]
+
+def fetch_to_file(url, file_path):
+    """
+    下载到临时文件后替换, 临时文件已存在时用Range续传, 返回本次下载的字节数
+    续传时以记录的ETag/Last-Modified作为If-Range, 远端文件已变化时服务器返回完整文件, 不会拼接新旧两个版本
+    """
+    part_path = file_path + PART_SUFFIX
+    validator_path = file_path + VALIDATOR_SUFFIX
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    validator = None
+    if offset:
+        try:
+            with open(validator_path, 'r', encoding='utf-8') as f:
+                validator = f.read().strip()
+        except OSError:
+            pass
+        if not validator: offset = 0    # 没有记录版本的临时文件无法确认, 重新下载
+    headers = {'Range': f'bytes={offset}-', 'If-Range': validator} if offset else {}
+    size = 0
+    with get_session().get(url, headers=headers, timeout=TIMEOUT, stream=True) as response:
+        current = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        if response.status_code == 416 or (response.status_code == 206 and current and current != validator):
+            # 临时文件与远端不符, 丢弃后重新下载
+            os.remove(part_path)
+            raise Exception(f"续传失败: {os.path.basename(file_path)} (HTTP {response.status_code})")
+        if response.status_code not in [200,206,301,302]:
+            raise Exception(f"下载失败: {os.path.basename(file_path)} (HTTP {response.status_code})")
+        if current:
+            with open(validator_path, 'w', encoding='utf-8') as f:
+                f.write(current)
+        elif os.path.exists(validator_path):
+            os.remove(validator_path)
+        with open(part_path, 'ab' if response.status_code == 206 else 'wb') as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+    os.replace(part_path, file_path)
+    if os.path.exists(validator_path): os.remove(validator_path)
+    return size
 
 def download_file(file_name, raw_url, file_folder, unexpected_url, flag = True):
-    """从GitHub下载文件"""
+    """从GitHub下载文件, 返回下载的字节数, 失败时返回None"""
     file_url = urljoin(raw_url, file_name)
     # unexpected_url = urljoin(unexpected_url, file_name) ## 垃圾东西，不科学，把我//硬变成了/
     if(flag): unexpected_url = f'{unexpected_url}/{file_name}'
+    file_path = os.path.join(file_folder, file_name)
     try:
-        response = requests.get(file_url, timeout=10)
-        if response.status_code in [200,301,302]:
-            file_path = os.path.join(file_folder, file_name)
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
-            print(f"已下载: {file_name}")
-        else: raise Exception(f"下载失败: {file_name} (HTTP {response.status_code})")
+        size = fetch_to_file(file_url, file_path)
     except Exception as e:
         # print(f"下载 {file_name} 时出错: {e}\n尝试使用代理网站")
         try:
-            response = requests.get(unexpected_url, timeout=10)
-            if response.status_code in [200,301,302]:
-                file_path = os.path.join(file_folder, file_name)
-                with open(file_path, 'wb') as f:
-                    f.write(response.content)
-                print(f"已下载: {file_name}")
-            else:
-                # print('=-------=')
+            size = fetch_to_file(unexpected_url, file_path)
+        except Exception as e:
+            with _print_lock:
                 print(unexpected_url)
-                print(f"下载失败: {file_name} (HTTP {response.status_code})")
-        except requests.exceptions.RequestException as e:
-            print(f"下载 {file_name} 时出错: {e}")
+                print(f"下载 {file_name} 时出错: {e}")
+            return None
+    with _print_lock:
+        print(f"已下载: {file_name}")
+    return size
+
+def download_files(files, raw_url, file_folder, unexpected_url):
+    """并发下载多个文件并输出吞吐量"""
+    start = perf_counter()
+    done, total = 0, 0
+    with ThreadPoolExecutor(DOWNLOAD_WORKERS) as executor:
+        for size in executor.map(lambda file: download_file(file, raw_url, file_folder, unexpected_url), files):
+            if size is None: continue
+            done += 1
+            total += size
+    cost = perf_counter() - start
+    print(f"下载完成 {done}/{len(files)} 个文件, 共 {total/1048576:.2f} MB, 用时 {cost:.2f}s, {total/1048576/cost if cost else 0:.2f} MB/s")
+    return done
 
-def verify_file(file_name, raw_url, file_folder, unexpected_url):
-    """验证本地文件与GitHub上的文件内容是否一致"""
+def git_blob_sha(content):
+    """与GitHub contents API返回的sha算法一致"""
+    return sha1(b'blob %d\0' % len(content) + content).hexdigest()
+
+def load_state():
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def save_state(state):
+    write_file(STATE_FILE, json.dumps(state, ensure_ascii=False, indent=2).encode('utf-8'))
+
+def write_file(file_path, content):
+    """先写临时文件再替换, 避免中断时留下不完整的文件"""
+    with open(file_path + PART_SUFFIX, 'wb') as f:
+        f.write(content)
+    os.replace(file_path + PART_SUFFIX, file_path)
+
+def get_github_blobs(api_url, unexpected_api_url):
+    """获取分支下文件名与blob SHA的对应关系, 失败时返回空字典"""
+    for url in (api_url, unexpected_api_url):
+        try:
+            response = get_session().get(url, timeout=TIMEOUT)
+            if response.status_code == 200:
+                return {item['name'] : item['sha'] for item in response.json() if item['type'] == 'file'}
+        except Exception:
+            pass
+    return {}
+
+def fetch_if_modified(url, entry, conditional):
+    """请求文件内容, conditional时带上记录的ETag/Last-Modified, 未修改(304)返回None"""
+    headers = {}
+    if conditional:
+        if entry.get('etag'): headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'): headers['If-Modified-Since'] = entry['last_modified']
+    response = get_session().get(url, headers=headers, timeout=TIMEOUT)
+    if response.status_code == 304: return None
+    if response.status_code not in [200,301,302]:
+        raise Exception(f"HTTP {response.status_code}")
+    entry['etag'] = response.headers.get('ETag')
+    entry['last_modified'] = response.headers.get('Last-Modified')
+    return response.content
+
+def verify_file(file_name, raw_url, file_folder, unexpected_url, remote_sha = None, state = None):
+    """验证本地文件与GitHub上的文件内容是否一致
+    有remote_sha时直接与本地文件的blob SHA比较, 否则用state中记录的ETag/Last-Modified发条件请求, 只在文件变化时下载一次"""
     file_url = urljoin(raw_url, file_name)
     local_path = os.path.join(file_folder, file_name)
     # unexpected_url = urljoin(unexpected_url, file_name) ## 垃圾东西，不科学，把我//硬变成了/
     unexpected_url = f'{unexpected_url}/{file_name}'
-    
-    # 获取GitHub文件内容
+    entry = state.setdefault(file_name, {}) if state is not None else {}
+
+    # 获取本地文件内容
+    local_content, local_sha = None, None
+    if os.path.exists(local_path):
+        try:
+            with open(local_path, 'rb') as f:
+                local_content = f.read()
+            local_sha = git_blob_sha(local_content)
+        except IOError as e:
+            print(f"读取本地文件 {file_name} 失败: {e}")
+            return False
+    if remote_sha is not None and remote_sha == local_sha:
+        entry['sha'] = local_sha
+        return True
+
+    # 本地文件仍是上次下载的内容时才允许服务器返回304
+    conditional = remote_sha is None and local_sha is not None and local_sha == entry.get('sha')
     try:
-        response = requests.get(file_url, timeout=10)
-        # if response.status_code != 200:
-        #     print(f"无法验证 {file_name}: GitHub文件访问失败")
-        #     return False
-        github_content = response.content
-    except requests.exceptions.RequestException as e:
+        github_content = fetch_if_modified(file_url, entry, conditional)
+    except Exception as e:
         # print(f"获取GitHub文件 {file_name} 时出错: {e}\n尝试使用代理网站")
         try:
-            response = requests.get(unexpected_url, timeout=10)
-            # if response.status_code != 200:
-            #     print(f"无法验证 {file_name}: GitHub文件访问失败")
-            #     return False
-            github_content = response.content
-        except requests.exceptions.RequestException as e:
+            github_content = fetch_if_modified(unexpected_url, entry, conditional)
+        except Exception as e:
             print(f"代理网站下载 {file_name} 时出错: {e}")
             return False
-    
-    # 检查本地文件是否存在
-    if not os.path.exists(local_path):
-        print(f"本地文件 {file_name} 不存在，将下载")
-        download_file(file_name, raw_url, file_folder, unexpected_url, False)
+    if github_content is None: return True
+
+    # 比较内容, 直接写入已获取的内容
+    entry['sha'] = git_blob_sha(github_content)
+    if github_content == local_content: return True
+    write_file(local_path, github_content)
+    if local_content is None:
+        print(f"本地文件 {file_name} 不存在，已下载")
         return True
-    
-    # 获取本地文件内容
-    try:
-        with open(local_path, 'rb') as f:
-            local_content = f.read()
-    except IOError as e:
-        print(f"读取本地文件 {file_name} 失败: {e}")
-        return False
-    
-    # 比较内容
-    if github_content != local_content:
-        print(f"文件不一致: {file_name}, 重新下载...")
-        download_file(file_name, raw_url, file_folder, unexpected_url, False)
-        return False
-    
-    return True
+    print(f"文件不一致: {file_name}, 已更新")
+    return False
 
 def sync_folder(api_url, raw_url, local_folder, unexpected_raw_url, unexpected_api_url):
     """同步单个文件夹"""
@@ -141,8 +254,7 @@ def sync_folder(api_url, raw_url, local_folder, unexpected_raw_url, unexpected_a
     missing_files = set(github_files) - set(local_files)
     if missing_files:
         print(f"发现 {len(missing_files)} 个新文件需要下载:")
-        for file in missing_files:
-            download_file(file, raw_url, local_folder, unexpected_raw_url)
+        download_files(sorted(missing_files), raw_url, local_folder, unexpected_raw_url)
     else:
         print("没有发现需要下载的新文件")
     
@@ -162,13 +274,23 @@ def main():
     
     # 验证根目录下的两个特殊文件
     print("开始验证根目录下的曲目与难度文件...")
-    verify_file('difficulty.tsv', RAW_CONTENT_URL1, '.', RAW_CONTENT_URL1_BAK)
-    verify_file('info.tsv', RAW_CONTENT_URL1, '.', RAW_CONTENT_URL1_BAK)
-    verify_file('tmp.tsv', RAW_CONTENT_URL1, '.', RAW_CONTENT_URL1_BAK)
+    state = load_state()
+    blobs = get_github_blobs(API_URL2, API_URL2_BAK)
+    for file_name in ['difficulty.tsv', 'info.tsv', 'tmp.tsv']:
+        verify_file(file_name, RAW_CONTENT_URL1, '.', RAW_CONTENT_URL1_BAK, blobs.get(file_name), state)
+    save_state(state)
     print("同步完成")
     replaceAvatarName()
+    buildAtlas()
     # if platform.startswith('win32'): os.system('cls')
     # else: os.system('Clear')
+def buildAtlas():
+    """增量更新曲绘图集, 未安装Pillow时跳过"""
+    from importlib.util import find_spec
+    if find_spec('PIL') is None: return
+    from cache import IllustrationAtlas
+    rebuilt = IllustrationAtlas().build()
+    if rebuilt: print(f"曲绘图集已更新 {rebuilt} 张")
 def replaceAvatarName():
     import os
 